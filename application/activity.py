@@ -0,0 +1,255 @@
+"""
+Helpers that maintain the per-day summaries of a user's brushing activity.
+
+Functions:
+-record_daily_activity(user, day, slots, seconds, sessions): adds sessions to the user's UserDailyActivity row
+-lock_daily_activity(user, days): loads the user's UserDailyActivity rows of several days, locked
+-save_daily_activity(user, rows, added): writes UserDailyActivity rows changed in memory with one upsert
+-slots_to_activity_type(slots): converts a UserDailyActivity slots bitmask to 'morning', 'evening' or 'both'
+-mark_calendar_days(user, days): sets the bits of the given days in the user's UserActivityYear bitmaps
+-calendar_bit(day): position of a day in a year bitmap
+-count_days(bitmap): number of days set in a bitmap
+-longest_run(bitmap): longest sequence of consecutive days set in a bitmap
+-activity_days(user, bounds): the user's active days within the bounds of an ActivityRangeSerializer
+-calendar_summary(year, calendar): the activityCalendar response for a UserActivityYear row
+"""
+
+import base64
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import UserActivityYear, UserDailyActivity, empty_calendar
+
+
+def record_daily_activity(user, day, slots=0, seconds=0, sessions=1):
+    """
+    Adds brushing sessions to the user's summary row for the given day, creating the row if needed.
+
+    Args:
+        user (CustomUser): The user who brushed their teeth
+        day (date): The day of the sessions, in the user's local time
+        slots (int): Bits of the slots the sessions happened in, from UserDailyActivity.SLOT_BITS,
+                     0 when only brushing time is added
+        seconds (int): Brushing time to add to the day
+        sessions (int): Number of sessions to add to the day
+
+    Returns:
+        bool: True if the sessions added a slot to the day, i.e. one of them is the first of its slot
+              on that day
+
+    Note:
+    -The row is updated with F() expressions (a bitwise OR for the slot), so concurrent sessions
+    are all counted. If no row exists yet it is inserted, and if another request inserted it
+    first the update is simply retried.
+    -A slot is added by an UPDATE that only matches the row if it lacks one of the bits, so only
+    then the day is marked in the year calendar
+    """
+    rows = UserDailyActivity.objects.filter(user=user, day=day)
+    changes = {
+        "slots": F("slots").bitor(slots),
+        "session_count": F("session_count") + sessions,
+        "total_seconds": F("total_seconds") + seconds,
+    }
+    if slots and rows.alias(present=F("slots").bitand(slots)).exclude(present=slots).update(**changes):
+        mark_calendar_days(user, {day: slots})
+        return True
+    if rows.update(**changes):
+        return False
+    try:
+        with transaction.atomic():
+            UserDailyActivity.objects.create(
+                user=user, day=day, slots=slots, session_count=sessions, total_seconds=seconds
+            )
+    except IntegrityError:
+        return record_daily_activity(user, day, slots, seconds, sessions)
+    if slots:
+        mark_calendar_days(user, {day: slots})
+    return bool(slots)
+
+
+def lock_daily_activity(user, days):
+    """
+    Loads the user's summary rows of several days, locked for the rest of the transaction, with a
+    constant number of queries whatever the number of days
+
+    Args:
+        user (CustomUser): The user who brushed their teeth
+        days (iterable): Dates in the user's local time
+
+    Returns:
+        dict: Maps each date to its UserDailyActivity row
+
+    Note:
+    -The missing rows are inserted first so that all of them can be locked. Otherwise the new values
+    written by save_daily_activity could overwrite a concurrent update_brushtime/, which does not lock
+    the user
+    """
+    UserDailyActivity.objects.bulk_create(
+        [UserDailyActivity(user=user, day=day) for day in days], ignore_conflicts=True
+    )
+    rows = UserDailyActivity.objects.select_for_update().filter(user=user, day__in=days)
+    return {row.day: row for row in rows}
+
+
+def save_daily_activity(user, rows, added):
+    """
+    Writes summary rows returned by lock_daily_activity and changed in memory with one upsert, as
+    backfill_daily_activity does, and marks the days that gained a slot in the year calendars
+
+    Args:
+        user (CustomUser): The user who brushed their teeth
+        rows (iterable): The changed UserDailyActivity rows
+        added (dict): Maps the dates that gained a slot to their new slots
+    """
+    UserDailyActivity.objects.bulk_create(
+        [
+            UserDailyActivity(
+                user=user,
+                day=row.day,
+                slots=row.slots,
+                session_count=row.session_count,
+                total_seconds=row.total_seconds,
+                synced_sessions=row.synced_sessions,
+            )
+            for row in rows
+        ],
+        update_conflicts=True,
+        unique_fields=["user", "day"],
+        update_fields=["slots", "session_count", "total_seconds", "synced_sessions"],
+    )
+    if added:
+        mark_calendar_days(user, added)
+
+
+def slots_to_activity_type(slots):
+    """
+    Args:
+        slots (int): UserDailyActivity slots bitmask
+
+    Returns:
+        str: 'both', 'morning' or 'evening', the activity types used by the API
+    """
+    if slots & UserDailyActivity.MORNING and slots & UserDailyActivity.EVENING:
+        return "both"
+    return "morning" if slots & UserDailyActivity.MORNING else "evening"
+
+
+def calendar_bit(day):
+    """
+    Args:
+        day (date): A day
+
+    Returns:
+        int: Index of the day's bit in its year's bitmap, 0 for the 1st of January
+    """
+    return day.timetuple().tm_yday - 1
+
+
+def mark_calendar_days(user, days):
+    """
+    Sets the bits of the given days in the user's year calendars, one locked read-modify-write per year.
+
+    Args:
+        user (CustomUser): The user who brushed their teeth
+        days (dict): Maps a date to the UserDailyActivity slots bitmask of that day
+
+    Note:
+    -Called only with the days that gained a slot (see record_daily_activity), the calendar row is
+    not read at all for the other sessions
+    """
+    years = defaultdict(dict)
+    for day, slots in days.items():
+        years[day.year][day] = slots
+
+    for year, year_days in years.items():
+        # Inside the caller's transaction if there is one, the calendar is written with its sessions
+        with transaction.atomic(savepoint=False):
+            calendar, _ = UserActivityYear.objects.select_for_update().get_or_create(
+                user=user, year=year
+            )
+            morning = bytearray(calendar.morning)
+            evening = bytearray(calendar.evening)
+            for day, slots in year_days.items():
+                bit = calendar_bit(day)
+                if slots & UserDailyActivity.MORNING:
+                    morning[bit // 8] |= 1 << (bit % 8)
+                if slots & UserDailyActivity.EVENING:
+                    evening[bit // 8] |= 1 << (bit % 8)
+            if morning != calendar.morning or evening != calendar.evening:
+                calendar.morning = bytes(morning)
+                calendar.evening = bytes(evening)
+                calendar.save(update_fields=["morning", "evening"])
+
+
+def count_days(bitmap):
+    """
+    Args:
+        bitmap (bytes): A year bitmap
+
+    Returns:
+        int: Number of days set in the bitmap
+    """
+    return int.from_bytes(bitmap, "little").bit_count()
+
+
+def longest_run(bitmap):
+    """
+    Args:
+        bitmap (bytes): A year bitmap
+
+    Returns:
+        int: Length of the longest sequence of consecutive days set in the bitmap
+    """
+    bits = int.from_bytes(bitmap, "little")
+    longest = 0
+    # Each step shortens every run of set bits by one, so the number of steps is the longest run
+    while bits:
+        bits &= bits >> 1
+        longest += 1
+    return longest
+
+
+def activity_days(user, bounds):
+    """
+    Args:
+        user (CustomUser): The authenticated user
+        bounds (dict): Validated data of an ActivityRangeSerializer
+
+    Returns:
+        QuerySet: (day, slots) pairs of the user's UserDailyActivity rows within the bounds, ordered by day
+    """
+    # Days with only brushing time (no morning/evening session) are not shown in the calendar
+    days = UserDailyActivity.objects.filter(user=user, slots__gt=0)
+    if "from" in bounds:
+        days = days.filter(day__gte=bounds["from"])
+    if "to" in bounds:
+        days = days.filter(day__lte=bounds["to"])
+    if "after" in bounds:
+        days = days.filter(day__gt=bounds["after"])
+    days = days.order_by("day").values_list("day", "slots")
+    if "limit" in bounds:
+        days = days[: bounds["limit"]]
+    return days
+
+
+def calendar_summary(year, calendar):
+    """
+    Args:
+        year (int): The requested year
+        calendar (UserActivityYear): The user's row for that year, None if they have none
+
+    Returns:
+        dict: The year, the base64 encoded morning and evening bitmaps, the number of active days and the
+              longest streak of the year
+    """
+    morning = bytes(calendar.morning) if calendar else empty_calendar()
+    evening = bytes(calendar.evening) if calendar else empty_calendar()
+    active = bytes(m | e for m, e in zip(morning, evening))
+    return {
+        "year": year,
+        "morning": base64.b64encode(morning).decode(),
+        "evening": base64.b64encode(evening).decode(),
+        "days_active": count_days(active),
+        "longest_streak": longest_run(active),
+    }
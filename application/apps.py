@@ -12,3 +12,17 @@ class ApplicationConfig(AppConfig):
 
     default_auto_field = "django.db.models.BigAutoField"
     name = "application"
+
+    def ready(self):
+        """
+        Connects the signal handlers of the app, registers the background tasks, and times the
+        serializers for the request metrics
+        """
+        from django.conf import settings
+
+        from . import deletion, signals  # noqa: F401
+
+        if settings.METRICS_ENABLED:
+            from .metrics import instrument_serializers
+
+            instrument_serializers()
@@ -0,0 +1,338 @@
+"""
+Async versions of the small, database-bound API views, served when the project runs under ASGI
+(see core/asgi.py and the ASYNC_VIEWS setting). They answer the same URLs with the same JSON as the
+views in views.py, but a worker process can have many of them waiting on the database at once.
+
+Django REST framework views are synchronous, so these are plain Django views: AsyncAPIView does the
+JWT authentication and the request body parsing that APIView does for the sync views. Views that hash
+passwords or run streak updates inside a transaction are not in this module, under ASGI the sync
+versions are used for them.
+
+Classes:
+-AsyncAPIView: Base class, authenticates the request and parses the body
+-AsyncIsSignedIn, AsyncCheckIfPinIsSet, AsyncUserProfile, AsyncCheckParentPIN, AsyncUserActivities,
+AsyncActivityCalendar, AsyncUpdateLevel, AsyncUpdateLevelXP, AsyncUpdateLevelMaxXP, AsyncMiniShopPhoto,
+AsyncSetCharterName, AsyncSetParentPin: async versions of the views of the same name
+
+ASYNC_VERSIONS maps each sync view class to its async version.
+"""
+
+import json
+import math
+from asgiref.sync import sync_to_async
+from django.db.models import F
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from . import views
+from .activity import activity_days, calendar_summary, slots_to_activity_type
+from .authentication import CachedJWTAuthentication, ClaimsJWTAuthentication
+from .models import UserActivityYear
+from .serializers import ActivityRangeSerializer, CustomUserSerializer
+from .stats import update_user
+from .tokens import PROFILE_CLAIMS
+
+aupdate_user = sync_to_async(update_user)
+
+
+class AsyncAPIView(View):
+    """
+    Base class of the async views. Before the handler runs, request.user is set from the JWT in the
+    Authorization header and request.data is the parsed JSON or form body. Requests without a valid
+    token get the same 401 response as from the sync views.
+
+    Attributes:
+    authentication_class: CachedJWTAuthentication or ClaimsJWTAuthentication, like the sync view
+    throttle_scope (str): Budget of the view in THROTTLE_BUCKETS, like the sync view
+    """
+
+    authentication_class = CachedJWTAuthentication
+    throttle_scope = "default"
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Token authenticated like the REST framework views, no CSRF cookie involved
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        authentication = self.authentication_class()
+        try:
+            request.user = await self.authenticate(request, authentication)
+        except (AuthenticationFailed, InvalidToken) as e:
+            return JsonResponse(
+                e.detail if isinstance(e.detail, dict) else {"detail": e.detail},
+                status=status.HTTP_401_UNAUTHORIZED,
+                headers={"WWW-Authenticate": authentication.authenticate_header(request)},
+            )
+        try:
+            request.data = self.parse_body(request)
+        except ValueError as e:
+            return JsonResponse({"detail": f"JSON parse error - {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        wait = await sync_to_async(self.check_throttles)(request)
+        if wait is not None:
+            return JsonResponse(
+                {"detail": f"Request was throttled. Expected available in {wait} seconds."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(wait)},
+            )
+        return await super().dispatch(request, *args, **kwargs)
+
+    async def authenticate(self, request, authentication):
+        """
+        Returns the user of the request's token
+
+        Raises:
+            AuthenticationFailed: If there is no token, or its user cannot sign in
+            InvalidToken: If the token is invalid or expired
+        """
+        header = authentication.get_header(request)
+        raw_token = authentication.get_raw_token(header) if header is not None else None
+        if raw_token is None:
+            raise AuthenticationFailed("Authentication credentials were not provided.")
+        validated_token = authentication.get_validated_token(raw_token)
+        return await authentication.aget_user(validated_token)
+
+    def check_throttles(self, request):
+        """
+        Takes a token from each of the DEFAULT_THROTTLE_CLASSES buckets, like APIView does
+
+        Returns:
+            int: Seconds the client should wait if the request is throttled, otherwise None
+        """
+        waits = []
+        for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+            throttle = throttle_class()
+            if not throttle.allow_request(request, self):
+                waits.append(throttle.wait() or 0)
+        return math.ceil(max(waits)) if waits else None
+
+    def parse_body(self, request):
+        """
+        Returns the JSON body as a dict, or the form data for other content types
+
+        Raises:
+            ValueError: If the body is not valid JSON, or not a JSON object
+        """
+        if request.content_type == "application/json":
+            data = json.loads(request.body or b"{}")
+            if not isinstance(data, dict):
+                raise ValueError("the body must be a JSON object")
+            return data
+        return request.POST
+
+
+class AsyncIsSignedIn(AsyncAPIView):
+    """
+    Async version of isSignedIn
+    """
+
+    async def post(self, request):
+        return JsonResponse(CustomUserSerializer(request.user).data, status=status.HTTP_200_OK)
+
+
+class AsyncCheckIfPinIsSet(AsyncAPIView):
+    """
+    Async version of CheckIfPinIsSet
+    """
+
+    authentication_class = ClaimsJWTAuthentication
+
+    async def get(self, request):
+        return JsonResponse({"is_pin_set": request.user.is_pin_set}, status=status.HTTP_200_OK)
+
+
+class AsyncUserProfile(AsyncAPIView):
+    """
+    Async version of UserProfile
+    """
+
+    authentication_class = ClaimsJWTAuthentication
+
+    async def get(self, request):
+        user = request.user
+        return JsonResponse(
+            {name: getattr(user, name) for name in PROFILE_CLAIMS}, status=status.HTTP_200_OK
+        )
+
+
+class AsyncCheckParentPIN(AsyncAPIView):
+    """
+    Async version of CheckParentPIN
+    """
+
+    throttle_scope = "auth"
+
+    async def post(self, request):
+        if request.user.parent_pin == request.data.get("parent_pin"):
+            return JsonResponse({"message": "The PIN is correct"}, status=status.HTTP_200_OK)
+        return JsonResponse(
+            {"message": "The PIN is incorrect"}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+class AsyncUserActivities(AsyncAPIView):
+    """
+    Async version of UserActivities
+    """
+
+    async def post(self, request):
+        bounds = ActivityRangeSerializer(data=request.data)
+        if not bounds.is_valid():
+            return JsonResponse(bounds.errors, status=status.HTTP_400_BAD_REQUEST)
+        activity_pairs = [
+            {"activity_date": day, "activity_type": slots_to_activity_type(slots)}
+            async for day, slots in activity_days(request.user, bounds.validated_data)
+        ]
+        return JsonResponse(activity_pairs, status=status.HTTP_200_OK, safe=False)
+
+
+class AsyncActivityCalendar(AsyncAPIView):
+    """
+    Async version of ActivityCalendar
+    """
+
+    async def get(self, request):
+        try:
+            year = int(request.GET.get("year", timezone.localdate().year))
+        except ValueError:
+            return JsonResponse(
+                {"detail": "Invalid year. It must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        calendar = await UserActivityYear.objects.filter(user=request.user, year=year).afirst()
+        return JsonResponse(calendar_summary(year, calendar), status=status.HTTP_200_OK)
+
+
+class AsyncUpdateLevel(AsyncAPIView):
+    """
+    Async version of UpdateLevel
+    """
+
+    throttle_scope = "write"
+
+    async def post(self, request):
+        user = request.user
+        try:
+            update_level_by = int(request.data.get("update_level_by", None))
+            await aupdate_user(user, current_level=F("current_level") + update_level_by)
+        except Exception:
+            return JsonResponse({}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse(CustomUserSerializer(user).data, status=status.HTTP_200_OK)
+
+
+class AsyncUpdateLevelXP(AsyncAPIView):
+    """
+    Async version of UpdateLevelXP
+    """
+
+    throttle_scope = "write"
+
+    async def post(self, request):
+        user = request.user
+        try:
+            await aupdate_user(user, current_level_xp=int(request.data.get("current_level_xp", None)))
+        except (TypeError, ValueError):
+            return JsonResponse(
+                {"detail": 'Invalid "current_level_xp" value. It must be an integer.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return JsonResponse(CustomUserSerializer(user).data, status=status.HTTP_200_OK)
+
+
+class AsyncUpdateLevelMaxXP(AsyncAPIView):
+    """
+    Async version of UpdateLevelMaxXP
+    """
+
+    throttle_scope = "write"
+
+    async def post(self, request):
+        user = request.user
+        try:
+            await aupdate_user(
+                user, current_level_max_xp=int(request.data.get("current_level_max_xp", None))
+            )
+        except (TypeError, ValueError):
+            return JsonResponse(
+                {"detail": "Invalid XP value. It must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return JsonResponse(CustomUserSerializer(user).data, status=status.HTTP_200_OK)
+
+
+class AsyncMiniShopPhoto(AsyncAPIView):
+    """
+    Async version of MiniShopPhoto
+    """
+
+    throttle_scope = "write"
+
+    async def post(self, request):
+        user = request.user
+        try:
+            await aupdate_user(user, image_id=int(request.data.get("image_id", None)))
+        except (TypeError, ValueError):
+            return JsonResponse(
+                {"detail": "Invalid image ID. It must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return JsonResponse(CustomUserSerializer(user).data, status=status.HTTP_200_OK)
+
+
+class AsyncSetCharterName(AsyncAPIView):
+    """
+    Async version of SetCharterName
+    """
+
+    throttle_scope = "write"
+
+    async def post(self, request):
+        new_name = request.data.get("new_name")
+        try:
+            await aupdate_user(request.user, character_name=new_name, is_char_name_set=True)
+        except Exception as e:
+            return JsonResponse({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse({}, status=status.HTTP_200_OK)
+
+
+class AsyncSetParentPin(AsyncAPIView):
+    """
+    Async version of SetParentPin
+    """
+
+    throttle_scope = "write"
+
+    async def post(self, request):
+        pin = request.data.get("parent_pin")
+        if not pin or not pin.isdigit() or len(pin) != 6:
+            return JsonResponse(
+                {"error": "The PIN mist be exactly 6 digits"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        await aupdate_user(request.user, parent_pin=pin, is_pin_set=True)
+        return JsonResponse(
+            {"message": "Parent PIN was set successfully."}, status=status.HTTP_200_OK
+        )
+
+
+ASYNC_VERSIONS = {
+    views.isSignedIn: AsyncIsSignedIn,
+    views.CheckIfPinIsSet: AsyncCheckIfPinIsSet,
+    views.UserProfile: AsyncUserProfile,
+    views.CheckParentPIN: AsyncCheckParentPIN,
+    views.UserActivities: AsyncUserActivities,
+    views.ActivityCalendar: AsyncActivityCalendar,
+    views.UpdateLevel: AsyncUpdateLevel,
+    views.UpdateLevelXP: AsyncUpdateLevelXP,
+    views.UpdateLevelMaxXP: AsyncUpdateLevelMaxXP,
+    views.MiniShopPhoto: AsyncMiniShopPhoto,
+    views.SetCharterName: AsyncSetCharterName,
+    views.SetParentPin: AsyncSetParentPin,
+}
@@ -0,0 +1,205 @@
+"""
+Authentication classes used by the API views.
+
+Classes:
+-StatsJWTAuthentication: Extends simplejwt's JWTAuthentication to load the user's counters
+in the same query as the user
+-CachedJWTAuthentication: Same as StatsJWTAuthentication, but resolves the user through the per-user cache
+-ClaimsUser: request.user built from the profile claims of a ClaimsToken, loads the real user on demand
+-ClaimsJWTAuthentication: Accepts ClaimsTokens and authenticates them without loading the user
+"""
+
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .cache import aget_cached_user, aget_user_version, get_cached_user, get_user_version
+from .tokens import ClaimsToken
+
+
+class StatsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that loads request.user together with its UserStats row (one query with a join),
+    as almost every view reads or serializes the counters.
+    """
+
+    def get_user_queryset(self):
+        """
+        Returns the queryset the authenticated user is loaded from
+        """
+        return self.user_model.objects.select_related("stats")
+
+    def load_user(self, user_id):
+        """
+        Loads the user the token was issued for
+
+        Raises:
+            CustomUser.DoesNotExist: If there is no such user
+        """
+        return self.get_user_queryset().get(**{api_settings.USER_ID_FIELD: user_id})
+
+    async def aload_user(self, user_id):
+        """
+        Async version of load_user, used by the async views
+        """
+        return await self.get_user_queryset().aget(**{api_settings.USER_ID_FIELD: user_id})
+
+    def get_user(self, validated_token):
+        """
+        Attempts to find and return a user using the given validated token. Same checks as
+        JWTAuthentication.get_user, only the queryset differs.
+        """
+        user_id = self.get_user_id(validated_token)
+        try:
+            user = self.load_user(user_id)
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        return self.check_user(user, validated_token)
+
+    async def aget_user(self, validated_token):
+        """
+        Async version of get_user, used by the async views
+        """
+        user_id = self.get_user_id(validated_token)
+        try:
+            user = await self.aload_user(user_id)
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        return self.check_user(user, validated_token)
+
+    def get_user_id(self, validated_token):
+        """
+        Returns the id of the user the token was issued for
+        """
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def check_user(self, user, validated_token):
+        """
+        Rejects inactive users and, if enabled, tokens issued before the last password change
+        """
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM
+            ) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+        return user
+
+
+class CachedJWTAuthentication(StatsJWTAuthentication):
+    """
+    JWT authentication that takes request.user (with its counters) from the cache, so a request whose
+    user is cached does not query the database at all. The is_active and revoked token checks still
+    run on every request, against the cached copy.
+
+    Note:
+    -The cached copy is invalidated whenever the user or their counters are saved or deleted, see
+    application.cache and the signal handlers in application.signals
+    """
+
+    def load_user(self, user_id):
+        """
+        Returns the user from the cache, loading it from the database on a miss
+        """
+        return get_cached_user(user_id, super().load_user)
+
+    async def aload_user(self, user_id):
+        """
+        Async version of load_user, used by the async views
+        """
+        return await aget_cached_user(user_id, super().aload_user)
+
+
+class ClaimsUser:
+    """
+    Stand-in for the authenticated user of a request made with a ClaimsToken. The profile fields are
+    read from the token, any other attribute loads the real user (from the cache or the database) the
+    first time it is accessed and is then read from it.
+
+    Attributes:
+    pk/id: The user's primary key, from the token
+    is_authenticated (bool): Always True, the token was validated
+    """
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, validated_token, load_user):
+        self.pk = self.id = validated_token[api_settings.USER_ID_CLAIM]
+        self.__dict__.update(validated_token["profile"])
+        self._load_user = load_user
+        self._user = None
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not in the claims
+        if name.startswith("__") or name in ("_load_user", "_user"):
+            raise AttributeError(name)
+        if self._user is None:
+            self._user = self._load_user(self.pk)
+        return getattr(self._user, name)
+
+    def __str__(self):
+        return f"user {self.pk}"
+
+
+class ClaimsJWTAuthentication(CachedJWTAuthentication):
+    """
+    Authentication for read-mostly views that only need the PROFILE_CLAIMS fields. A request with a
+    ClaimsToken whose profile version is still current is authenticated without loading the user,
+    request.user is then a ClaimsUser. Other tokens (and stale ClaimsTokens) are handled exactly like
+    CachedJWTAuthentication does.
+
+    Note:
+    -Saving the user (which includes deactivating it or changing its password) or deleting it changes the
+    profile version, so the checks done by get_user run again for every token issued before that
+    """
+
+    def get_validated_token(self, raw_token):
+        """
+        Validates the token as a ClaimsToken, or as one of the usual access token types
+        """
+        try:
+            return ClaimsToken(raw_token)
+        except TokenError:
+            return super().get_validated_token(raw_token)
+
+    def get_user(self, validated_token):
+        """
+        Returns a ClaimsUser if the token carries current profile claims, otherwise the user itself
+        """
+        if self.is_claims_token(validated_token):
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+            if validated_token["profile_version"] == get_user_version(user_id):
+                return ClaimsUser(validated_token, self.load_user)
+        return super().get_user(validated_token)
+
+    async def aget_user(self, validated_token):
+        """
+        Async version of get_user. The ClaimsUser it returns cannot load the real user, async views
+        must only read the claims from it.
+        """
+        if self.is_claims_token(validated_token):
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+            if validated_token["profile_version"] == await aget_user_version(user_id):
+                return ClaimsUser(validated_token, self.load_user)
+        return await super().aget_user(validated_token)
+
+    def is_claims_token(self, validated_token):
+        """
+        Returns True for a ClaimsToken that has everything needed to authenticate from its claims
+        """
+        return (
+            validated_token.get(api_settings.TOKEN_TYPE_CLAIM) == ClaimsToken.token_type
+            and validated_token.get(api_settings.USER_ID_CLAIM) is not None
+            and validated_token.get("profile_version") is not None
+        )
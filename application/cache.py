@@ -0,0 +1,117 @@
+"""
+Per-user cache of the authenticated user, used by CachedJWTAuthentication so that a request with a
+valid token does not have to load the user from the database.
+
+Every user has a version token stored in the cache next to the cached instance. The instance is stored
+under a key that includes the version, and invalidating a user only replaces the version token, so an
+instance loaded before a write can never be read back after it.
+
+Functions:
+-get_cached_user(user_id, load): returns the cached user, loading and caching it on a miss
+-get_user_version(user_id): returns the user's current version token
+-aget_cached_user/aget_user_version: async versions of the two functions above, for the async views
+-invalidate_users(user_ids): makes the cached copies of the given users unreachable
+-invalidate_users_on_commit(user_ids): same as invalidate_users, once the current transaction commits
+"""
+
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = "auth-user-version:{user_id}"
+USER_KEY = "auth-user:{user_id}:{version}"
+
+
+def _version_key(user_id):
+    return VERSION_KEY.format(user_id=user_id)
+
+
+def get_user_version(user_id):
+    """
+    Returns the user's current version token, creating one if the user has none yet. The token changes
+    every time the user is invalidated.
+    """
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # add() does not overwrite a token that another request created in the meantime
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_user_version(user_id):
+    """
+    Async version of get_user_version
+    """
+    key = _version_key(user_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, uuid.uuid4().hex, timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def get_cached_user(user_id, load):
+    """
+    Returns the user with the given id from the cache, calling load(user_id) and caching the result on a miss.
+
+    Args:
+        user_id: Primary key of the user
+        load (callable): Loads the user from the database, raises DoesNotExist if it does not exist
+
+    Returns:
+        CustomUser: The user (with its counters, if load() fetched them). Every call returns a new copy,
+                    so views can change it freely.
+
+    Note:
+    -The version is read before the database, so if the user is changed while it is being loaded the
+    stale copy is cached under the old version and never used
+    """
+    version = get_user_version(user_id)
+    key = USER_KEY.format(user_id=user_id, version=version)
+    user = cache.get(key)
+    if user is None:
+        user = load(user_id)
+        if version is not None:
+            cache.set(key, user, timeout=settings.USER_CACHE_TIMEOUT)
+    return user
+
+
+async def aget_cached_user(user_id, aload):
+    """
+    Async version of get_cached_user, aload is a coroutine function loading the user
+    """
+    version = await aget_user_version(user_id)
+    key = USER_KEY.format(user_id=user_id, version=version)
+    user = await cache.aget(key)
+    if user is None:
+        user = await aload(user_id)
+        if version is not None:
+            await cache.aset(key, user, timeout=settings.USER_CACHE_TIMEOUT)
+    return user
+
+
+def invalidate_users(user_ids):
+    """
+    Gives the users new version tokens, so their cached copies are no longer used (they expire on their own).
+
+    Args:
+        user_ids (iterable): Primary keys of the users that changed
+    """
+    cache.set_many(
+        {_version_key(user_id): uuid.uuid4().hex for user_id in user_ids}, timeout=None
+    )
+
+
+def invalidate_users_on_commit(user_ids):
+    """
+    Invalidates the users after the current transaction commits (immediately outside of a transaction).
+    Invalidating earlier would let a concurrent request cache the rows as they were before the commit.
+
+    Args:
+        user_ids (iterable): Primary keys of the users that changed
+    """
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: invalidate_users(user_ids))
@@ -0,0 +1,73 @@
+"""
+Deletion of user accounts in two steps. The delete/ endpoint only deactivates the account and queues
+a purge_user job, which is cheap whatever the size of the account. The job worker (run_jobs command)
+then deletes the rows of the account in bounded batches and finally the user. The purge_deleted_users
+command purges every deactivated account that is left, e.g. if its job failed.
+
+Deleting a user in one go makes Django's collector load and delete every related row in one
+transaction, which for a user with years of activities takes long enough to time the request out and
+holds the locks of all those rows meanwhile.
+
+Functions:
+-request_deletion(user): deactivates the account and queues a job purging it
+-purge_user(user_id, batch_size): deletes a queued account, a batch of rows at a time (the purge_user task)
+"""
+
+from django.db import transaction
+from django.utils import timezone
+
+from .jobs import enqueue, task
+from .models import CustomUser, UserActivity, UserActivityYear, UserDailyActivity
+from .stats import update_user
+
+# Tables with many rows per user, emptied a batch at a time before the user is deleted
+PURGED_MODELS = (UserActivity, UserDailyActivity, UserActivityYear)
+
+
+def request_deletion(user):
+    """
+    Deactivates the account, so its tokens and credentials are refused from now on, and queues a
+    purge_user job
+
+    Args:
+        user (CustomUser): The user deleting their account
+    """
+    with transaction.atomic():
+        update_user(user, is_active=False, deletion_requested_at=timezone.now())
+        enqueue("purge_user", {"user_id": user.pk})
+
+
+@task("purge_user")
+def purge_user(user_id, batch_size=5000):
+    """
+    Deletes the rows of PURGED_MODELS of a queued account with one short DELETE statement per batch,
+    each in its own transaction, then the user with the rest of their rows.
+
+    Args:
+        user_id (int): Primary key of the user
+        batch_size (int): Maximum number of rows deleted by one statement
+
+    Returns:
+        int: Number of rows deleted, or None if the user is not queued for deletion
+
+    Note:
+    -It can be stopped and run again at any point, the rows deleted so far stay deleted
+    """
+    queued = CustomUser.objects.filter(pk=user_id, deletion_requested_at__isnull=False)
+    if not queued.exists():
+        return None
+    deleted = 0
+    for model in PURGED_MODELS:
+        rows = model.objects.filter(user_id=user_id)
+        while True:
+            ids = list(rows.values_list("pk", flat=True)[:batch_size])
+            if not ids:
+                break
+            # No signals or cascades on these models, so this is a single DELETE ... WHERE id IN (...)
+            model.objects.filter(pk__in=ids).delete()
+            deleted += len(ids)
+    with transaction.atomic():
+        user = queued.select_for_update().first()
+        if user is not None:
+            deleted += user.delete()[0]
+    return deleted
@@ -0,0 +1,319 @@
+"""
+Streaming import and export of users, shared by the import_users and export_users commands.
+
+Files are CSV (with a header line) or JSON Lines (one object per line), chosen from the file extension.
+Both are read and written one row at a time, so the memory used does not depend on the size of the file.
+
+A user row has the columns of USER_COLUMNS. On import, email, first_name, last_name and either password
+(hashed during the import) or password_hash (an existing hash, as written by the export) are required,
+the other columns are optional and take the defaults of a new user.
+
+Functions:
+-file_format(path): 'csv' or 'jsonl', from the extension of the file
+-read_rows(stream, format): yields (line number, row dict) from a file
+-RowWriter: writes row dicts to a file
+-user_row(user): the export row of a user
+-activity_rows(chunk_size): the export rows of all the brushing activities
+-parse_user_row(row): a validated CustomUser and UserStats from an import row
+-insert_users(users, method): inserts new users and their counters in one batch
+-personal_data_stream(user, chunk_size): the profile and activities of a user as NDJSON, for the export/ endpoint
+-gzip_stream(chunks): compresses a stream of bytes on the fly
+"""
+
+import csv
+import io
+import json
+import zlib
+from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.auth.hashers import identify_hasher
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import connection
+
+from .models import STATS_FIELDS, CustomUser, UserActivity, UserStats, validate_password
+
+PROFILE_COLUMNS = (
+    "is_active",
+    "date_joined",
+    "image_id",
+    "parent_pin",
+    "is_pin_set",
+    "character_name",
+    "is_char_name_set",
+)
+USER_COLUMNS = ("email", "first_name", "last_name", "password_hash", *PROFILE_COLUMNS, *STATS_FIELDS)
+ACTIVITY_COLUMNS = ("email", "activity_date", "activity_time", "activity_type")
+# Rows fetched from the database at a time by the export/ endpoint
+STREAM_CHUNK_SIZE = 2000
+# Size of the pieces of a streamed response, large enough not to send a write per line
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def file_format(path):
+    """
+    Returns:
+        str: 'jsonl' for .jsonl/.ndjson files, 'csv' otherwise
+    """
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def read_rows(stream, format):
+    """
+    Args:
+        stream (file): A text file
+        format (str): 'csv' or 'jsonl'
+
+    Yields:
+        tuple: (int: line number, dict: the row, or a str with the error for a line that cannot be parsed)
+    """
+    if format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, f"Invalid JSON: {e}"
+            continue
+        yield line_number, row if isinstance(row, dict) else "Each line must be a JSON object"
+
+
+class RowWriter:
+    """
+    Writes rows (dicts with the given columns) to a text file as CSV or JSON Lines
+    """
+
+    def __init__(self, stream, format, columns):
+        self.stream = stream
+        self.format = format
+        if format == "csv":
+            self.writer = csv.DictWriter(stream, fieldnames=columns)
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.format == "csv":
+            self.writer.writerow(row)
+        else:
+            self.stream.write(json.dumps(row, default=str) + "\n")
+
+
+def user_row(user):
+    """
+    Args:
+        user (CustomUser): A user loaded with select_related("stats")
+
+    Returns:
+        dict: The USER_COLUMNS of the user, with the password hash
+    """
+    row = {"email": user.email, "first_name": user.first_name, "last_name": user.last_name}
+    row["password_hash"] = user.password
+    for name in PROFILE_COLUMNS + STATS_FIELDS:
+        value = getattr(user, name)
+        row[name] = value.isoformat() if hasattr(value, "isoformat") else value
+    return row
+
+
+def activity_rows(chunk_size):
+    """
+    Args:
+        chunk_size (int): Number of rows fetched from the database at a time
+
+    Yields:
+        dict: The ACTIVITY_COLUMNS of every UserActivity, in the order of the users, except those of the
+              accounts waiting to be purged
+    """
+    activities = (
+        UserActivity.objects.filter(user__deletion_requested_at__isnull=True)
+        .order_by("user_id", "activity_date", "activity_time")
+        .values_list(*(("user__email",) + ACTIVITY_COLUMNS[1:]))
+        .iterator(chunk_size=chunk_size)
+    )
+    for email, day, moment, activity_type in activities:
+        yield {
+            "email": email,
+            "activity_date": day.isoformat() if day else None,
+            "activity_time": moment.isoformat() if moment else None,
+            "activity_type": activity_type,
+        }
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def parse_user_row(row):
+    """
+    Validates an import row, with the same rules as signing up
+
+    Args:
+        row (dict): The columns of the row (strings for CSV, JSON values for JSON Lines)
+
+    Returns:
+        tuple: (CustomUser, UserStats, str: the raw password to hash or None if password_hash was given)
+
+    Raises:
+        ValidationError: If a required column is missing or a value is invalid
+    """
+    email = row.get("email")
+    if _blank(email):
+        raise ValidationError("email is required")
+    email = CustomUser.objects.normalize_email(str(email).strip())
+    validate_email(email)
+    for name in ("first_name", "last_name"):
+        if _blank(row.get(name)):
+            raise ValidationError(f"{name} is required")
+
+    password, password_hash = row.get("password"), row.get("password_hash")
+    if not _blank(password_hash):
+        try:
+            identify_hasher(password_hash)
+        except ValueError:
+            raise ValidationError("password_hash is not a hash of a known hasher")
+        password = None
+    elif _blank(password):
+        raise ValidationError("password or password_hash is required")
+    else:
+        validate_password(password)
+
+    user = CustomUser(
+        email=email,
+        first_name=str(row["first_name"]).strip(),
+        last_name=str(row["last_name"]).strip(),
+        password=password_hash if password is None else "",
+    )
+    stats = UserStats(user=user)
+    for name in PROFILE_COLUMNS + STATS_FIELDS:
+        if _blank(row.get(name)):
+            continue
+        target = stats if name in STATS_FIELDS else user
+        field = target._meta.get_field(name)
+        try:
+            value = field.to_python(row[name])
+        except ValidationError as e:
+            raise ValidationError(f"{name}: {' '.join(e.messages)}")
+        setattr(target, field.attname, value)
+    user.full_clean(exclude=["password", "email"], validate_unique=False)
+    stats.full_clean(exclude=["user"], validate_unique=False)
+    return user, stats, password
+
+
+def _copy(cursor, model, objects):
+    """
+    Loads model instances into their table with COPY, much faster than INSERT for large batches
+    """
+    fields = [field for field in model._meta.concrete_fields if not (field.primary_key and field.auto_created)]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for obj in objects:
+        values = [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields]
+        writer.writerow(["\\N" if value is None else value for value in values])
+    buffer.seek(0)
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    table = connection.ops.quote_name(model._meta.db_table)
+    # copy_expert is a method of the driver's cursor, whose errors Django does not translate by itself
+    with connection.wrap_database_errors:
+        cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+
+def insert_users(users, method="bulk"):
+    """
+    Inserts new users and their counters. Must run in a transaction, if any row fails nothing is inserted.
+
+    Args:
+        users (list): (CustomUser, UserStats) pairs from parse_user_row, with the password set
+        method (str): 'bulk' for bulk_create, 'copy' for COPY (PostgreSQL only)
+    """
+    accounts = [user for user, _ in users]
+    if method == "copy":
+        with connection.cursor() as cursor:
+            _copy(cursor, CustomUser, accounts)
+            # COPY does not return the generated primary keys
+            ids = dict(
+                CustomUser.objects.filter(email__in=[user.email for user in accounts]).values_list("email", "pk")
+            )
+            for user in accounts:
+                user.pk = ids[user.email]
+            for user, stats in users:
+                stats.user = user
+            _copy(cursor, UserStats, [stats for _, stats in users])
+    else:
+        CustomUser.objects.bulk_create(accounts)
+        for user, stats in users:
+            stats.user = user
+        UserStats.objects.bulk_create([stats for _, stats in users])
+
+
+def _blocks(lines):
+    """
+    Joins the lines into blocks of about STREAM_BLOCK_SIZE bytes
+    """
+    block, size = [], 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= STREAM_BLOCK_SIZE:
+            yield b"".join(block)
+            block, size = [], 0
+    if block:
+        yield b"".join(block)
+
+
+def personal_data_stream(user, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    All the data kept about a user, one JSON object per line: first the profile
+    ({"type": "profile", ...the fields of CustomUserSerializer}), then every brushing activity, oldest first
+    ({"type": "activity", "activity_date", "activity_time", "activity_type"}).
+
+    The activities are read with iterator(chunk_size), through a server-side cursor on PostgreSQL, and sent
+    as they are read, so only a chunk of them is in memory at any time.
+
+    Args:
+        user (CustomUser): The user, with their counters loaded
+        chunk_size (int): Number of activities fetched from the database at a time
+
+    Yields:
+        bytes: Blocks of NDJSON lines
+    """
+    from .serializers import CustomUserSerializer
+
+    encoder = DjangoJSONEncoder()
+
+    def lines():
+        profile = {"type": "profile", **CustomUserSerializer(user).data}
+        yield (encoder.encode(profile) + "\n").encode()
+        activities = (
+            UserActivity.objects.filter(user_id=user.pk)
+            .order_by("activity_date", "activity_time", "pk")
+            .values_list(*ACTIVITY_COLUMNS[1:])
+            .iterator(chunk_size=chunk_size)
+        )
+        for day, moment, activity_type in activities:
+            activity = {
+                "type": "activity",
+                "activity_date": day,
+                "activity_time": moment,
+                "activity_type": activity_type,
+            }
+            yield (encoder.encode(activity) + "\n").encode()
+
+    return _blocks(lines())
+
+
+def gzip_stream(chunks):
+    """
+    Args:
+        chunks (iterable): Pieces of bytes
+
+    Yields:
+        bytes: The gzip compression of the pieces, compressed as they come
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
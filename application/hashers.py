@@ -0,0 +1,88 @@
+"""
+Password hashers whose cost parameters come from the settings, so that they can be tuned for the
+machine the API runs on (see the calibrate_hasher management command) without a code change.
+
+Classes:
+-CalibratedScryptPasswordHasher: Django's scrypt hasher, parameters from PASSWORD_HASH_PARAMS["scrypt"]
+-CalibratedArgon2PasswordHasher: Django's argon2 hasher, parameters from PASSWORD_HASH_PARAMS["argon2"]
+
+Both keep the algorithm name and hash format of the Django hasher they extend. When the configured
+parameters (or the preferred algorithm) change, the hash of a user is upgraded the next time they sign
+in: check_password() sees that the stored hash must_update() and saves a new one.
+"""
+
+import base64
+import hashlib
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, ScryptPasswordHasher
+
+
+def hash_params(algorithm):
+    """
+    Args:
+        algorithm (str): 'scrypt' or 'argon2'
+
+    Returns:
+        dict: The configured cost parameters of the algorithm, empty if none are configured
+    """
+    return getattr(settings, "PASSWORD_HASH_PARAMS", {}).get(algorithm, {})
+
+
+class CalibratedScryptPasswordHasher(ScryptPasswordHasher):
+    """
+    Scrypt with the work factor, block size and parallelism taken from the settings. Scrypt needs
+    128 * work_factor * block_size bytes of memory per hash.
+    """
+
+    @property
+    def work_factor(self):
+        return hash_params("scrypt").get("work_factor", ScryptPasswordHasher.work_factor)
+
+    @property
+    def block_size(self):
+        return hash_params("scrypt").get("block_size", ScryptPasswordHasher.block_size)
+
+    @property
+    def parallelism(self):
+        return hash_params("scrypt").get("parallelism", ScryptPasswordHasher.parallelism)
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        """
+        Same as ScryptPasswordHasher.encode, but allows hashlib to use the memory the parameters need
+        (by default it refuses to use more than 32MB). A stored hash can have other parameters than the
+        configured ones, so the limit is computed for each hash.
+        """
+        self._check_encode_args(password, salt)
+        n = n or self.work_factor
+        r = r or self.block_size
+        p = p or self.parallelism
+        hash_ = hashlib.scrypt(
+            password.encode(),
+            salt=salt.encode(),
+            n=n,
+            r=r,
+            p=p,
+            maxmem=2 * 128 * n * r * p,
+            dklen=64,
+        )
+        hash_ = base64.b64encode(hash_).decode("ascii").strip()
+        return "%s$%d$%s$%d$%d$%s" % (self.algorithm, n, salt, r, p, hash_)
+
+
+class CalibratedArgon2PasswordHasher(Argon2PasswordHasher):
+    """
+    Argon2 with the time cost, memory cost (in KiB) and parallelism taken from the settings.
+    Requires the argon2-cffi package.
+    """
+
+    @property
+    def time_cost(self):
+        return hash_params("argon2").get("time_cost", Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        return hash_params("argon2").get("memory_cost", Argon2PasswordHasher.memory_cost)
+
+    @property
+    def parallelism(self):
+        return hash_params("argon2").get("parallelism", Argon2PasswordHasher.parallelism)
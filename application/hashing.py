@@ -0,0 +1,153 @@
+"""
+Runs password hashing in a pool of worker processes, so that a burst of sign ins cannot occupy every web
+worker thread with hashing while cheap requests wait.
+
+Each web worker process owns a small process pool (PASSWORD_HASH_WORKERS processes, by default the
+number of cores divided by WEB_CONCURRENCY, so that all the pools together use every core once). The
+web workers run several threads (see the Procfile), and a thread waiting for its hash does not hold the
+GIL. At most PASSWORD_HASH_QUEUE_LIMIT passwords are hashed or waiting at the same time in a web worker,
+further requests are refused straight away with HashingOverloaded instead of queueing.
+
+Functions:
+-verify_password(user, raw_password): checks a password, upgrading its hash if needed
+-hash_password(raw_password): returns the hash to store for a new password
+-create_pool(workers): a new pool of hashing processes, also used by the import_users command
+
+Classes:
+-HashingOverloaded: Raised when the hashing queue is full, views answer it with 503
+"""
+
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+_lock = threading.Lock()
+_executor = None
+_slots = None
+
+
+class HashingOverloaded(APIException):
+    """
+    Too many passwords are being hashed, the client should retry after a short delay
+    """
+
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The server is busy, please try again shortly."
+    default_code = "hashing_overloaded"
+
+
+def _check(raw_password, encoded):
+    """
+    Verifies the password in a pool process.
+
+    Returns:
+        tuple: (bool: the password is correct, str: a new hash to store or None)
+    """
+    is_correct, must_update = hashers.verify_password(raw_password, encoded)
+    if is_correct and must_update:
+        return True, hashers.make_password(raw_password)
+    return is_correct, None
+
+
+def create_pool(workers):
+    """
+    Args:
+        workers (int): Number of processes
+
+    Returns:
+        ProcessPoolExecutor: A pool whose processes have the Django settings loaded, so they hash with
+                             the configured hashers
+    """
+    # Spawned, not forked, as the web worker may be running other threads
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=get_context("spawn"), initializer=django.setup
+    )
+
+
+def _get_executor():
+    """
+    Returns the pool of this process and the semaphore limiting the jobs in it, creating them on first use
+    """
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            _executor = create_pool(settings.PASSWORD_HASH_WORKERS)
+            _slots = threading.BoundedSemaphore(settings.PASSWORD_HASH_QUEUE_LIMIT)
+        return _executor, _slots
+
+
+def _reset_executor(executor):
+    """
+    Drops a pool whose processes died, the next job creates a new one
+    """
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def _run(function, *args):
+    """
+    Runs the function in the pool and waits for its result, or inline when PASSWORD_HASH_WORKERS is 0
+
+    Raises:
+        HashingOverloaded: If PASSWORD_HASH_QUEUE_LIMIT jobs are already running or waiting
+    """
+    if not settings.PASSWORD_HASH_WORKERS:
+        return function(*args)
+    executor, slots = _get_executor()
+    if not slots.acquire(blocking=False):
+        raise HashingOverloaded()
+    try:
+        return executor.submit(function, *args).result()
+    except BrokenProcessPool:
+        _reset_executor(executor)
+        raise HashingOverloaded()
+    finally:
+        slots.release()
+
+
+def verify_password(user, raw_password):
+    """
+    Checks the password of a user in the hashing pool. Like user.check_password(), the hash is upgraded
+    when it was made with an old hasher or old parameters.
+
+    Args:
+        user (CustomUser): The user signing in
+        raw_password (str): The password they sent
+
+    Returns:
+        bool: True if the password is correct
+
+    Raises:
+        HashingOverloaded: If the hashing queue is full
+    """
+    if not user.has_usable_password():
+        return False
+    is_correct, new_hash = _run(_check, raw_password, user.password)
+    if new_hash is not None:
+        user.password = new_hash
+        user.save(update_fields=["password"])
+    return is_correct
+
+
+def hash_password(raw_password):
+    """
+    Args:
+        raw_password (str): A new password
+
+    Returns:
+        str: The hash to store, made with the preferred hasher
+
+    Raises:
+        HashingOverloaded: If the hashing queue is full
+    """
+    return _run(hashers.make_password, raw_password)
@@ -0,0 +1,169 @@
+"""
+Background job queue stored in the application's own database, so work can leave the request path
+without an external broker. Views queue jobs with enqueue(), in the same transaction as the rest of
+their writes, and the run_jobs command runs them.
+
+A worker claims due jobs with SELECT ... FOR UPDATE SKIP LOCKED where the database supports it
+(PostgreSQL), so concurrent workers never wait for each other nor get the same job. On SQLite, which
+has no row locks, a job goes to the worker whose conditional UPDATE still finds it queued.
+
+A job that raises is queued again after an exponential backoff (JOB_RETRY_DELAY, doubled after every
+attempt up to JOB_RETRY_MAX_DELAY) and marked failed, with its traceback, after its last attempt. A job
+still running after JOB_LOCK_TIMEOUT seconds is considered lost with its worker and queued again.
+
+Functions:
+-task(name): decorator registering a function as the task of that name
+-enqueue(name, payload, run_at, max_attempts): queues a job
+-claim_jobs(worker, limit): marks due jobs as running by the worker and returns them
+-run_job(job): runs a claimed job and records its outcome
+-requeue_stale_jobs(): queues again the jobs whose worker died
+-retry_delay(attempts): seconds to wait before the next attempt
+"""
+
+import time
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .metrics import observe_job
+from .models import Job
+
+# Functions run by the jobs, by task name
+TASKS = {}
+
+
+def task(name):
+    """
+    Registers the decorated function as a task. It is called with the payload of the job as keyword
+    arguments, so the payload must be JSON serializable.
+
+    Args:
+        name (str): Name given to enqueue
+    """
+
+    def register(function):
+        TASKS[name] = function
+        return function
+
+    return register
+
+
+def enqueue(name, payload=None, run_at=None, max_attempts=None):
+    """
+    Queues a job. Called inside a transaction, the job is only visible to the workers once it commits.
+
+    Args:
+        name (str): Name of a registered task
+        payload (dict, optional): Keyword arguments of the task
+        run_at (datetime, optional): When the job may run, now by default
+        max_attempts (int, optional): Number of attempts before the job fails, JOB_MAX_ATTEMPTS by default
+
+    Returns:
+        Job: The queued job
+
+    Raises:
+        KeyError: If no task has this name
+    """
+    if name not in TASKS:
+        raise KeyError(f"No task named {name}")
+    return Job.objects.create(
+        name=name,
+        payload=payload or {},
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )
+
+
+def claim_jobs(worker, limit=1):
+    """
+    Marks up to limit due jobs as running by the worker, oldest first
+
+    Args:
+        worker (str): Name of the worker, stored on the jobs
+        limit (int): Maximum number of jobs claimed
+
+    Returns:
+        list: The claimed jobs
+    """
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by("run_at")
+    claim = {"status": Job.RUNNING, "locked_at": now, "locked_by": worker, "attempts": F("attempts") + 1}
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list("pk", flat=True)[:limit])
+            Job.objects.filter(pk__in=ids).update(**claim)
+    else:
+        ids = [
+            pk
+            for pk in due.values_list("pk", flat=True)[:limit]
+            if Job.objects.filter(pk=pk, status=Job.QUEUED).update(**claim)
+        ]
+    return list(Job.objects.filter(pk__in=ids).order_by("run_at"))
+
+
+def retry_delay(attempts):
+    """
+    Returns:
+        float: Seconds to wait after the given number of failed attempts before trying again
+    """
+    return min(settings.JOB_RETRY_DELAY * 2 ** (attempts - 1), settings.JOB_RETRY_MAX_DELAY)
+
+
+def run_job(job):
+    """
+    Runs a job returned by claim_jobs. The job is deleted if it succeeds, otherwise it is queued again
+    after retry_delay or, after its last attempt, marked failed.
+
+    Args:
+        job (Job): The claimed job
+
+    Returns:
+        str: The outcome, 'done', 'retried' or 'failed'
+    """
+    started = timezone.now()
+    start = time.perf_counter()
+    try:
+        function = TASKS.get(job.name)
+        if function is None:
+            raise KeyError(f"No task named {job.name}")
+        function(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            outcome = "failed"
+            Job.objects.filter(pk=job.pk).update(status=Job.FAILED, last_error=error)
+        else:
+            outcome = "retried"
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED,
+                run_at=timezone.now() + timedelta(seconds=retry_delay(job.attempts)),
+                locked_at=None,
+                locked_by="",
+                last_error=error,
+            )
+    else:
+        outcome = "done"
+        Job.objects.filter(pk=job.pk).delete()
+    observe_job(job.name, outcome, time.perf_counter() - start, (started - job.run_at).total_seconds())
+    return outcome
+
+
+def requeue_stale_jobs():
+    """
+    Queues again the jobs running for longer than JOB_LOCK_TIMEOUT, whose worker must have died, or marks
+    them failed if that was their last attempt
+
+    Returns:
+        int: Number of jobs found
+    """
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        locked_at__lt=timezone.now() - timedelta(seconds=settings.JOB_LOCK_TIMEOUT),
+    )
+    error = "The worker running the job stopped"
+    failed = stale.filter(attempts__gte=F("max_attempts")).update(status=Job.FAILED, last_error=error)
+    queued = stale.update(status=Job.QUEUED, locked_at=None, locked_by="", last_error=error)
+    return failed + queued
@@ -0,0 +1,118 @@
+"""
+Management command that builds the UserDailyActivity rollup from the existing UserActivity rows,
+and the UserActivityYear calendars from the rollup.
+
+Usage:
+    python manage.py backfill_daily_activity [--batch-size 500]
+"""
+
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+
+from application.activity import calendar_bit
+from application.models import (
+    CustomUser,
+    UserActivity,
+    UserActivityYear,
+    UserDailyActivity,
+    empty_calendar,
+)
+
+
+class Command(BaseCommand):
+    """
+    Walks through the users in primary key order, a batch at a time. The activities of each batch are
+    grouped per user and day by the database and written to the rollup with one upsert per batch, so
+    the command can be stopped and run again at any point.
+
+    Note:
+    -The slots and session counts of existing rollup rows are replaced by the values computed from
+    UserActivity, the brushing seconds are kept as UserActivity does not record them
+    -The year calendars of the batch are then rebuilt from the rollup, with one more upsert
+    """
+
+    help = "Builds the UserDailyActivity rollup from the UserActivity history"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of users processed per batch",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_id = 0
+        users_done = 0
+        days_written = 0
+
+        while True:
+            user_ids = list(
+                CustomUser.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+
+            days = (
+                UserActivity.objects.filter(user_id__in=user_ids, activity_date__isnull=False)
+                .values("user_id", "activity_date")
+                .annotate(
+                    mornings=Count("pk", filter=Q(activity_type__in=("morning", "both"))),
+                    evenings=Count("pk", filter=Q(activity_type__in=("evening", "both"))),
+                    sessions=Count("pk"),
+                )
+                .order_by()
+            )
+            rollup = [
+                UserDailyActivity(
+                    user_id=day["user_id"],
+                    day=day["activity_date"],
+                    slots=(UserDailyActivity.MORNING if day["mornings"] else 0)
+                    | (UserDailyActivity.EVENING if day["evenings"] else 0),
+                    session_count=day["sessions"],
+                )
+                for day in days
+            ]
+            UserDailyActivity.objects.bulk_create(
+                rollup,
+                update_conflicts=True,
+                unique_fields=["user", "day"],
+                update_fields=["slots", "session_count"],
+            )
+            self.write_calendars(user_ids)
+            users_done += len(user_ids)
+            days_written += len(rollup)
+            self.stdout.write(f"{users_done} users processed, {days_written} days written")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {days_written} days for {users_done} users"))
+
+    def write_calendars(self, user_ids):
+        """
+        Rebuilds the UserActivityYear bitmaps of the given users from their UserDailyActivity rows
+        """
+        bitmaps = defaultdict(lambda: (bytearray(empty_calendar()), bytearray(empty_calendar())))
+        days = UserDailyActivity.objects.filter(user_id__in=user_ids, slots__gt=0).values_list(
+            "user_id", "day", "slots"
+        )
+        for user_id, day, slots in days.iterator(chunk_size=5000):
+            morning, evening = bitmaps[(user_id, day.year)]
+            bit = calendar_bit(day)
+            if slots & UserDailyActivity.MORNING:
+                morning[bit // 8] |= 1 << (bit % 8)
+            if slots & UserDailyActivity.EVENING:
+                evening[bit // 8] |= 1 << (bit % 8)
+
+        UserActivityYear.objects.bulk_create(
+            [
+                UserActivityYear(user_id=user_id, year=year, morning=bytes(morning), evening=bytes(evening))
+                for (user_id, year), (morning, evening) in bitmaps.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["user", "year"],
+            update_fields=["morning", "evening"],
+        )
@@ -0,0 +1,188 @@
+"""
+Management command that measures the password hasher on the current machine and suggests the cost
+parameters that fit the per-hash latency budget.
+
+Usage:
+    python manage.py calibrate_hasher [--algorithm scrypt] [--budget-ms 100] [--max-memory-mb 64] [--samples 3]
+"""
+
+import statistics
+import time
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, ScryptPasswordHasher
+from django.core.management.base import BaseCommand, CommandError
+
+SAMPLE_PASSWORD = "Calibrati0n!Password"
+SAMPLE_SALT = "calibrationsalt0123456"
+
+
+def time_hasher(hasher, samples):
+    """
+    Args:
+        hasher (BasePasswordHasher): Hasher configured with the parameters to measure
+        samples (int): Number of hashes to compute
+
+    Returns:
+        float: Median time of one hash, in milliseconds
+    """
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.encode(SAMPLE_PASSWORD, SAMPLE_SALT)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def scrypt_hasher(work_factor, block_size=8, parallelism=1):
+    """
+    Returns a ScryptPasswordHasher using the given parameters
+    """
+    return type(
+        "CandidateScryptPasswordHasher",
+        (ScryptPasswordHasher,),
+        {
+            "work_factor": work_factor,
+            "block_size": block_size,
+            "parallelism": parallelism,
+            "maxmem": 2 * 128 * work_factor * block_size * parallelism,
+        },
+    )()
+
+
+def argon2_hasher(time_cost, memory_cost, parallelism=1):
+    """
+    Returns an Argon2PasswordHasher using the given parameters (memory_cost in KiB)
+    """
+    return type(
+        "CandidateArgon2PasswordHasher",
+        (Argon2PasswordHasher,),
+        {"time_cost": time_cost, "memory_cost": memory_cost, "parallelism": parallelism},
+    )()
+
+
+class Command(BaseCommand):
+    """
+    Hashes a sample password with increasing cost parameters and keeps the most expensive ones that still
+    take less than the budget. The parallelism is kept at 1: every gunicorn worker handles one request at
+    a time, so a hash should not compete with the other workers for cores.
+
+    For scrypt the work factor is doubled until the budget or the memory limit is reached. For argon2 the
+    memory cost is doubled first (with one pass), then the number of passes is increased.
+
+    Note:
+    -The suggested values are printed as environment variables, they are read in core/settings.py
+    -Logins per second per core is 1000 / hash time, the CPU time of the rest of the request is ignored
+    -Run it on the same machine type as the web dynos, with nothing else running
+    """
+
+    help = "Measures the password hasher and suggests cost parameters for the latency budget"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--algorithm",
+            choices=["scrypt", "argon2"],
+            default=settings.PASSWORD_HASHER,
+            help="Hasher to calibrate",
+        )
+        parser.add_argument(
+            "--budget-ms",
+            type=float,
+            default=settings.PASSWORD_HASH_BUDGET_MS,
+            help="Time one hash may take, in milliseconds",
+        )
+        parser.add_argument(
+            "--max-memory-mb",
+            type=int,
+            default=64,
+            help="Memory one hash may use, in megabytes",
+        )
+        parser.add_argument(
+            "--samples",
+            type=int,
+            default=3,
+            help="Number of hashes measured per candidate",
+        )
+
+    def handle(self, *args, **options):
+        self.samples = options["samples"]
+        budget = options["budget_ms"]
+        max_memory = options["max_memory_mb"] * 1024 * 1024
+
+        try:
+            if options["algorithm"] == "scrypt":
+                best = self.calibrate_scrypt(budget, max_memory)
+            else:
+                best = self.calibrate_argon2(budget, max_memory)
+        except ValueError as e:
+            # Raised by Django when argon2-cffi is not installed
+            raise CommandError(str(e))
+
+        if best is None:
+            raise CommandError(
+                f"Even the cheapest {options['algorithm']} parameters take more than {budget} ms on this machine"
+            )
+        env, elapsed = best
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{elapsed:.1f} ms per hash, about {1000 / elapsed:.1f} logins/sec per core. Set:"
+            )
+        )
+        self.stdout.write(f"PASSWORD_HASHER={options['algorithm']}")
+        for name, value in env.items():
+            self.stdout.write(f"{name}={value}")
+
+    def measure(self, label, hasher):
+        """
+        Times a candidate and prints the result
+        """
+        elapsed = time_hasher(hasher, self.samples)
+        self.stdout.write(f"{label}: {elapsed:.1f} ms, {1000 / elapsed:.1f} hashes/sec per core")
+        return elapsed
+
+    def calibrate_scrypt(self, budget, max_memory):
+        """
+        Returns:
+            tuple: (environment variables, ms per hash) of the largest work factor within the budget, or None
+        """
+        best = None
+        work_factor = 2**10
+        while 128 * work_factor * 8 <= max_memory:
+            elapsed = self.measure(f"scrypt N={work_factor} r=8 p=1", scrypt_hasher(work_factor))
+            if elapsed > budget:
+                break
+            best = (
+                {"SCRYPT_WORK_FACTOR": work_factor, "SCRYPT_BLOCK_SIZE": 8, "SCRYPT_PARALLELISM": 1},
+                elapsed,
+            )
+            work_factor *= 2
+        return best
+
+    def calibrate_argon2(self, budget, max_memory):
+        """
+        Returns:
+            tuple: (environment variables, ms per hash) of the most expensive parameters within the budget, or None
+        """
+        best = None
+        memory_cost = 8 * 1024
+        while memory_cost * 1024 <= max_memory:
+            elapsed = self.measure(f"argon2 m={memory_cost}KiB t=1 p=1", argon2_hasher(1, memory_cost))
+            if elapsed > budget:
+                break
+            best = ({"ARGON2_TIME_COST": 1, "ARGON2_MEMORY_COST": memory_cost, "ARGON2_PARALLELISM": 1}, elapsed)
+            memory_cost *= 2
+        if best is None:
+            return None
+
+        memory_cost = best[0]["ARGON2_MEMORY_COST"]
+        time_cost = 2
+        while True:
+            elapsed = self.measure(
+                f"argon2 m={memory_cost}KiB t={time_cost} p=1", argon2_hasher(time_cost, memory_cost)
+            )
+            if elapsed > budget:
+                return best
+            best = (
+                {"ARGON2_TIME_COST": time_cost, "ARGON2_MEMORY_COST": memory_cost, "ARGON2_PARALLELISM": 1},
+                elapsed,
+            )
+            time_cost += 1
@@ -0,0 +1,90 @@
+"""
+Management command that resets the streaks of the users who missed a day. Meant to run from cron
+shortly after midnight.
+
+Usage:
+    python manage.py expire_streaks [--batch-size 10000]
+"""
+
+import datetime
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from application.cache import invalidate_users
+from application.models import UserStats
+
+
+# UTC offsets of the timezones in use, from UTC-12 to UTC+14
+OFFSETS = [datetime.timedelta(minutes=minutes) for minutes in range(-12 * 60, 14 * 60 + 1, 15)]
+
+
+def expiry_bounds(now):
+    """
+    The users' timezones are not stored, and the views compare calendar days in the timezone of the
+    next session (see apply_day_streak and apply_slot_streak). So a streak is only broken once it is
+    broken in every timezone.
+
+    Args:
+        now (datetime): The current time
+
+    Returns:
+        tuple: (day, moment). A last_active_date before the day, or a last_active_morning/evening
+               before the moment, is at least two calendar days ago wherever the user is.
+    """
+    # The local day that is the furthest behind, in the westernmost timezone
+    yesterday = (now + OFFSETS[0]).date() - datetime.timedelta(days=1)
+    moment = min(
+        datetime.datetime.combine((now + offset).date() - datetime.timedelta(days=1), datetime.time.min)
+        - offset
+        for offset in OFFSETS
+    )
+    return yesterday, moment.replace(tzinfo=datetime.timezone.utc)
+
+
+class Command(BaseCommand):
+    """
+    A streak is broken when the user was last active before yesterday, in whatever timezone they are
+    (see expiry_bounds). The views only notice this the next time the user brushes, so rankings and
+    reports over the streak counters are wrong for inactive users until this command resets them.
+
+    Each streak (daily, morning, evening) is reset with UPDATE statements over the partial indexes on
+    UserStats, limited to --batch-size rows each so that no statement holds its locks for long. Only the
+    primary keys of each batch are read, to drop the cached copies of those users. The UPDATE checks the
+    expiry again, so a session recorded after the batch was read keeps its streak.
+    """
+
+    help = "Resets the current, morning and evening streaks of users who missed a day"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="Maximum number of rows changed by one UPDATE statement",
+        )
+
+    def handle(self, *args, **options):
+        yesterday, start_of_yesterday = expiry_bounds(timezone.now())
+
+        expired = {
+            "current_streak": UserStats.objects.filter(
+                current_streak__gt=0, last_active_date__lt=yesterday
+            ),
+            "streak_morning": UserStats.objects.filter(
+                streak_morning__gt=0, last_active_morning__lt=start_of_yesterday
+            ),
+            "streak_evening": UserStats.objects.filter(
+                streak_evening__gt=0, last_active_evening__lt=start_of_yesterday
+            ),
+        }
+        for field, queryset in expired.items():
+            total = 0
+            while True:
+                user_ids = list(queryset.values_list("pk", flat=True)[: options["batch_size"]])
+                if not user_ids:
+                    break
+                total += queryset.filter(pk__in=user_ids).update(**{field: 0})
+                invalidate_users(user_ids)
+            self.stdout.write(f"{field}: reset {total} streaks")
+
+        self.stdout.write(self.style.SUCCESS("Expired streaks reset"))
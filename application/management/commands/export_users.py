@@ -0,0 +1,82 @@
+"""
+Management command that exports the users, and optionally their brushing activities, to CSV or JSON Lines
+files, see application/exports.py for the columns. The users file can be imported again with import_users.
+
+Usage:
+    python manage.py export_users users.csv [--activities-output activities.csv] [--chunk-size 2000]
+"""
+
+from django.core.management.base import BaseCommand
+
+from application.exports import (
+    ACTIVITY_COLUMNS,
+    USER_COLUMNS,
+    RowWriter,
+    activity_rows,
+    file_format,
+    user_row,
+)
+from application.models import CustomUser
+
+
+class Command(BaseCommand):
+    """
+    Streams the rows from the database with iterator(chunk_size), which on PostgreSQL reads them through
+    a server-side cursor, and writes each row as soon as it is read, so the memory used stays the same
+    whatever the number of users.
+
+    Note:
+    -The users file contains the password hashes, keep it as safe as the database
+    -Accounts waiting to be purged are left out, with their activities
+    """
+
+    help = "Exports the users and their activities to CSV or JSON Lines files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="CSV or JSON Lines (.jsonl) file the users are written to")
+        parser.add_argument(
+            "--activities-output",
+            help="CSV or JSON Lines (.jsonl) file the brushing activities are written to",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Number of rows fetched from the database at a time",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="Format of the files, guessed from their extension by default",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        users = (
+            CustomUser.objects.filter(deletion_requested_at__isnull=True)
+            .select_related("stats")
+            .order_by("pk")
+            .iterator(chunk_size=chunk_size)
+        )
+        count = self.export(options["output"], options["format"], USER_COLUMNS, map(user_row, users))
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} users to {options['output']}"))
+
+        if options["activities_output"]:
+            path = options["activities_output"]
+            count = self.export(path, options["format"], ACTIVITY_COLUMNS, activity_rows(chunk_size))
+            self.stdout.write(self.style.SUCCESS(f"Exported {count} activities to {path}"))
+
+    def export(self, path, format, columns, rows):
+        """
+        Writes the rows to the file
+
+        Returns:
+            int: Number of rows written
+        """
+        count = 0
+        with open(path, "w", newline="", encoding="utf-8") as stream:
+            writer = RowWriter(stream, format or file_format(path), columns)
+            for row in rows:
+                writer.write(row)
+                count += 1
+        return count
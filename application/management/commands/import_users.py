@@ -0,0 +1,135 @@
+"""
+Management command that imports users from a CSV or JSON Lines file, see application/exports.py for the columns.
+
+Usage:
+    python manage.py import_users users.csv [--batch-size 1000] [--workers 4] [--format csv|jsonl]
+"""
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, connection, transaction
+
+from application.exports import file_format, insert_users, parse_user_row, read_rows
+from application.hashing import create_pool
+from application.models import CustomUser
+
+
+class Command(BaseCommand):
+    """
+    Reads the file a row at a time and collects the valid rows into batches, so the memory used does not
+    depend on the size of the file. The raw passwords of a batch are hashed in parallel by a pool of
+    processes, as hashing is by far the slowest step, then the batch is inserted in one transaction with
+    bulk_create, or COPY on PostgreSQL.
+
+    Note:
+    -A row that is invalid, or whose email already exists (in the database or earlier in the file), is
+    reported on stderr with its line number and skipped, the import carries on
+    -If a batch still fails to insert (e.g. a user signed up with one of its emails meanwhile), its rows
+    are inserted one at a time so only the conflicting ones are skipped
+    -Rows with a password_hash, as written by export_users, keep their hash and are not hashed again
+    """
+
+    help = "Imports users from a CSV or JSON Lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or JSON Lines (.jsonl) file to import")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of users inserted per transaction",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of processes hashing the passwords, one per CPU by default",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="Format of the file, guessed from its extension by default",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        batch_size = options["batch_size"]
+        self.method = "copy" if connection.vendor == "postgresql" else "bulk"
+        self.imported = 0
+        self.failed = 0
+        self.seen = set()
+        self.pool = None
+        batch = []
+
+        try:
+            with open(path, newline="", encoding="utf-8") as stream:
+                for line_number, row in read_rows(stream, options["format"] or file_format(path)):
+                    if isinstance(row, str):
+                        self.report(line_number, row)
+                        continue
+                    try:
+                        user, stats, password = parse_user_row(row)
+                    except ValidationError as e:
+                        self.report(line_number, " ".join(e.messages))
+                        continue
+                    if user.email in self.seen:
+                        self.report(line_number, f"{user.email} appears earlier in the file")
+                        continue
+                    self.seen.add(user.email)
+                    batch.append((line_number, user, stats, password))
+                    if len(batch) >= batch_size:
+                        self.import_batch(batch, options["workers"])
+                        batch = []
+            if batch:
+                self.import_batch(batch, options["workers"])
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Imported {self.imported} users, {self.failed} rows skipped")
+        )
+
+    def report(self, line_number, error):
+        self.failed += 1
+        self.stderr.write(f"line {line_number}: {error}")
+
+    def import_batch(self, batch, workers):
+        """
+        Drops the rows whose email is already taken, hashes the raw passwords and inserts the rest
+        """
+        emails = [user.email for _, user, _, _ in batch]
+        # Emails of earlier batches are found in the database, only the current batch is kept
+        self.seen.difference_update(emails)
+        existing = set(CustomUser.objects.filter(email__in=emails).values_list("email", flat=True))
+        rows = []
+        for line_number, user, stats, password in batch:
+            if user.email in existing:
+                self.report(line_number, f"{user.email} already exists")
+            else:
+                rows.append((line_number, user, stats, password))
+
+        to_hash = [row for row in rows if row[3] is not None]
+        if to_hash:
+            if self.pool is None:
+                self.pool = create_pool(workers)
+            passwords = [password for _, _, _, password in to_hash]
+            for (_, user, _, _), encoded in zip(to_hash, self.pool.map(make_password, passwords, chunksize=16)):
+                user.password = encoded
+
+        try:
+            with transaction.atomic():
+                insert_users([(user, stats) for _, user, stats, _ in rows], self.method)
+            self.imported += len(rows)
+        except IntegrityError:
+            for line_number, user, stats, _ in rows:
+                user.pk = None
+                user._state.adding = True
+                try:
+                    with transaction.atomic():
+                        insert_users([(user, stats)], "bulk")
+                    self.imported += 1
+                except IntegrityError as e:
+                    self.report(line_number, str(e))
+        self.stdout.write(f"{self.imported} users imported, {self.failed} rows skipped")
@@ -0,0 +1,52 @@
+"""
+Management command that purges the accounts deleted by their users (see application/deletion.py).
+Each deletion queues a purge_user job, this command catches up with the accounts whose job failed or
+was lost, e.g. from a daily cron.
+
+Usage:
+    python manage.py purge_deleted_users [--batch-size 5000] [--limit 100]
+"""
+
+from django.core.management.base import BaseCommand
+
+from application.deletion import purge_user
+from application.models import CustomUser
+
+
+class Command(BaseCommand):
+    """
+    Drains the queue of deleted accounts, oldest request first. The rows of each account are deleted
+    --batch-size at a time so that no statement holds its locks for long, then the user row.
+    """
+
+    help = "Purges the accounts whose deletion was requested"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Maximum number of rows deleted by one DELETE statement",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Maximum number of accounts purged by this run, all of them by default",
+        )
+
+    def handle(self, *args, **options):
+        queue = CustomUser.objects.filter(deletion_requested_at__isnull=False).order_by(
+            "deletion_requested_at"
+        )
+        users = 0
+        rows = 0
+        while options["limit"] is None or users < options["limit"]:
+            user_id = queue.values_list("pk", flat=True).first()
+            if user_id is None:
+                break
+            rows += purge_user(user_id, options["batch_size"]) or 0
+            users += 1
+            self.stdout.write(f"{users} accounts purged, {rows} rows deleted")
+
+        self.stdout.write(self.style.SUCCESS(f"Purged {users} accounts, {rows} rows deleted"))
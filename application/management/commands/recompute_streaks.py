@@ -0,0 +1,186 @@
+"""
+Management command that recomputes the streak counters of every user from their activity history.
+
+Usage:
+    python manage.py recompute_streaks [--batch-size 1000] [--workers 4] [--dry-run] [--verbose]
+"""
+
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from application.cache import invalidate_users_on_commit
+from application.models import UserDailyActivity, UserStats
+from application.stats import RECOMPUTED_FIELDS, compute_streaks
+
+
+def recompute_batch(user_ids, today, dry_run):
+    """
+    Recomputes and (unless dry_run) saves the streak counters of a batch of users. Runs in the
+    worker processes, so it only takes and returns plain values.
+
+    Args:
+        user_ids (list): Primary keys of the users in the batch
+        today (date): The day the streaks are computed for
+        dry_run (bool): Only report the differences, do not write them
+
+    Returns:
+        tuple: (Counter of field name -> number of users whose stored value was different,
+                list of (user id, field, stored, computed) for every difference)
+
+    Note:
+    -The UserStats rows of the batch are locked before the rollup is read and until the fixes are
+    written, so a session recorded meanwhile waits instead of being overwritten
+    -Only the fields that drifted are written
+    """
+    with transaction.atomic():
+        stats_rows = UserStats.objects.filter(pk__in=user_ids).order_by("pk").only("pk", *RECOMPUTED_FIELDS)
+        if not dry_run:
+            stats_rows = stats_rows.select_for_update()
+        stats_rows = list(stats_rows)
+
+        days = defaultdict(list)
+        rows = (
+            UserDailyActivity.objects.filter(user_id__in=user_ids, slots__gt=0)
+            .order_by("user_id", "day")
+            .values_list("user_id", "day", "slots")
+        )
+        for user_id, day, slots in rows.iterator(chunk_size=10000):
+            days[user_id].append((day, slots))
+
+        drift = Counter()
+        differences = []
+        # Drifted fields -> users with exactly these fields to fix
+        changed = defaultdict(list)
+        for stats in stats_rows:
+            computed = compute_streaks(days[stats.pk], today)
+            fields = []
+            for field, value in computed.items():
+                stored = getattr(stats, field)
+                if isinstance(value, float) and round(stored, 6) == round(value, 6):
+                    continue
+                if stored != value:
+                    drift[field] += 1
+                    differences.append((stats.pk, field, stored, value))
+                    setattr(stats, field, value)
+                    fields.append(field)
+            if fields:
+                changed[tuple(fields)].append(stats)
+
+        if changed and not dry_run:
+            for fields, group in changed.items():
+                UserStats.objects.bulk_update(group, fields)
+            invalidate_users_on_commit(stats.pk for group in changed.values() for stats in group)
+    return drift, differences
+
+
+class Command(BaseCommand):
+    """
+    Streams the users in primary key order, in batches, and recomputes their streak counters from the
+    UserDailyActivity rollup (run backfill_daily_activity first on a database that does not have it).
+    The batches are spread over a pool of processes, each with its own database connection.
+
+    Note:
+    -The incrementally maintained counters drift when a request fails halfway, this command
+    resets them to the values implied by the recorded activity
+    -With --dry-run nothing is written, the command only reports how many users drifted per counter
+    """
+
+    help = "Recomputes the streak counters of all users from their activity history"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of users per batch",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of worker processes, 1 runs everything in this process",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the drift without writing anything",
+        )
+        parser.add_argument(
+            "--verbose",
+            action="store_true",
+            help="Print every counter that differs",
+        )
+
+    def handle(self, *args, **options):
+        self.verbose = options["verbose"]
+        self.drift = Counter()
+        self.users_done = 0
+        self.users_drifted = 0
+        today = timezone.localdate()
+        batches = self.user_batches(options["batch_size"])
+
+        if options["workers"] <= 1:
+            for user_ids in batches:
+                self.report(len(user_ids), *recompute_batch(user_ids, today, options["dry_run"]))
+        else:
+            # Spawned workers start without the parent's database connections
+            with ProcessPoolExecutor(
+                max_workers=options["workers"],
+                mp_context=get_context("spawn"),
+                initializer=django.setup,
+            ) as pool:
+                pending = {}
+                for user_ids in batches:
+                    future = pool.submit(recompute_batch, user_ids, today, options["dry_run"])
+                    pending[future] = len(user_ids)
+                    # Keep a bounded number of batches in flight
+                    if len(pending) >= options["workers"] * 2:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self.report(pending.pop(future), *future.result())
+                for future in wait(pending).done:
+                    self.report(pending[future], *future.result())
+
+        action = "Found" if options["dry_run"] else "Fixed"
+        summary = ", ".join(f"{field}: {count}" for field, count in sorted(self.drift.items()))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{action} drift in {self.users_drifted} of {self.users_done} users"
+                + (f" ({summary})" if summary else "")
+            )
+        )
+
+    def user_batches(self, batch_size):
+        """
+        Yields lists of user ids in primary key order, using keyset pagination
+        """
+        last_id = 0
+        while True:
+            user_ids = list(
+                UserStats.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not user_ids:
+                return
+            last_id = user_ids[-1]
+            yield user_ids
+
+    def report(self, batch_size, drift, differences):
+        """
+        Adds the result of a batch to the totals
+        """
+        self.users_done += batch_size
+        self.drift.update(drift)
+        self.users_drifted += len({user_id for user_id, *_ in differences})
+        if self.verbose:
+            for user_id, field, stored, computed in differences:
+                self.stdout.write(f"user {user_id}: {field} {stored} -> {computed}")
+        self.stdout.write(f"{self.users_done} users processed")
@@ -0,0 +1,174 @@
+"""
+Management command running the background jobs queued with application.jobs.enqueue, the worker
+process of the Procfile.
+
+Usage:
+    python manage.py run_jobs [--concurrency 4] [--poll-interval 1] [--burst] [--metrics-port 9100]
+"""
+
+import signal
+import threading
+import time
+from collections import Counter
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+
+from application.jobs import claim_jobs, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    """
+    Runs --concurrency threads, each with its own database connection, that claim one due job at a time
+    and run it. A thread that finds no due job waits --poll-interval seconds before looking again, or
+    with --burst stops, so the command exits once the queue is drained.
+
+    Note:
+    -The number of jobs done, retried and failed and the throughput are written every --report-interval
+    seconds and when the command stops. The jobs are also recorded in the Prometheus job metrics
+    (application/metrics.py), served on --metrics-port if given
+    -SIGTERM and SIGINT let the running jobs finish and then stop the worker
+    -Jobs left running by a worker that died are queued again at start and every minute
+    -A database error is written to stderr and the thread carries on after --poll-interval, a job it
+    left running is queued again once it is stale
+    """
+
+    help = "Runs the background jobs of the database queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Number of jobs run at the same time",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait before looking for jobs again when the queue is empty",
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Stop once there is no due job instead of waiting for more",
+        )
+        parser.add_argument(
+            "--report-interval",
+            type=float,
+            default=60.0,
+            help="Seconds between two throughput reports",
+        )
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            default=None,
+            help="Serve the Prometheus metrics of the worker on this port",
+        )
+
+    def handle(self, *args, **options):
+        if options["metrics_port"]:
+            from prometheus_client import start_http_server
+
+            start_http_server(options["metrics_port"])
+        self.options = options
+        self.stopping = threading.Event()
+        self.lock = threading.RLock()
+        self.counts = Counter()
+        self.started = self.last_report = time.monotonic()
+        self.reported = 0
+        self.last_requeue = 0.0
+
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                previous_handlers[signum] = signal.signal(signum, self.stop)
+        try:
+            if options["concurrency"] == 1:
+                # In this thread, so the jobs use the caller's connection (and see its transaction)
+                self.work("worker-1")
+            else:
+                threads = [
+                    threading.Thread(target=self.work_in_thread, args=(f"worker-{number}",), daemon=True)
+                    for number in range(1, options["concurrency"] + 1)
+                ]
+                for thread in threads:
+                    thread.start()
+                while any(thread.is_alive() for thread in threads):
+                    for thread in threads:
+                        # A timeout keeps the main thread responsive to signals
+                        thread.join(timeout=0.5)
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+        self.stdout.write(self.style.SUCCESS(self.report(final=True)))
+
+    def stop(self, signum, frame):
+        self.stdout.write("Stopping once the running jobs finish")
+        self.stopping.set()
+
+    def work_in_thread(self, worker):
+        try:
+            self.work(worker)
+        finally:
+            connection.close()
+
+    def work(self, worker):
+        """
+        Claims and runs jobs until the worker is stopped, or the queue is empty with --burst
+        """
+        while not self.stopping.is_set():
+            try:
+                self.housekeeping()
+                jobs = claim_jobs(worker)
+                if not jobs:
+                    if self.options["burst"]:
+                        return
+                    self.stopping.wait(self.options["poll_interval"])
+                    continue
+                for job in jobs:
+                    outcome = run_job(job)
+                    with self.lock:
+                        self.counts[outcome] += 1
+            except DatabaseError as e:
+                self.stderr.write(f"{worker}: {e}")
+                self.stopping.wait(self.options["poll_interval"])
+
+    def housekeeping(self):
+        """
+        Requeues the jobs of dead workers and writes the throughput report when they are due, from
+        whichever thread gets here first
+        """
+        now = time.monotonic()
+        with self.lock:
+            requeue = now - self.last_requeue >= 60
+            if requeue:
+                self.last_requeue = now
+            report = self.report() if now - self.last_report >= self.options["report_interval"] else None
+        if requeue:
+            found = requeue_stale_jobs()
+            if found:
+                self.stdout.write(f"{found} jobs of stopped workers queued again or failed")
+        if report:
+            self.stdout.write(report)
+
+    def report(self, final=False):
+        """
+        Args:
+            final (bool): Whether the worker is stopping
+
+        Returns:
+            str: The jobs run so far by outcome, and the number of jobs run per second since the last
+                 report, or since the start for the final report
+        """
+        now = time.monotonic()
+        with self.lock:
+            counts = dict(self.counts)
+            total = sum(counts.values())
+            since, run = (self.started, total) if final else (self.last_report, total - self.reported)
+            self.last_report, self.reported = now, total
+        rate = run / max(now - since, 1e-9)
+        return (
+            f"{total} jobs run: {counts.get('done', 0)} done, {counts.get('retried', 0)} retried, "
+            f"{counts.get('failed', 0)} failed ({rate:.1f} jobs/s)"
+        )
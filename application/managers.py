@@ -31,6 +31,7 @@ class CustomUserManager(BaseUserManager):
         total_brushes=0,
         is_staff=False,
         is_superuser=False,
+        password_hash=None,
     ):
         """
         Create and save a user with the provided email and password
@@ -50,6 +51,8 @@ class CustomUserManager(BaseUserManager):
             total_brushes (int): Total number of brushes completed by a user
             is_staff (Boolean, optional): can the user access the admin site
             is_superuser: is the user a superuser with all privilleges
+            password_hash (str, optional): The already hashed password (see application.hashing), stored
+                                           instead of hashing the password here
 
         Returns:
             CustomUser: The created user instance.
@@ -64,7 +67,7 @@ class CustomUserManager(BaseUserManager):
             raise ValueError("The user must have a first name.")
         if not last_name:
             raise ValueError("The user must have a last name.")
-        if not password:
+        if not password and not password_hash:
             raise ValueError("The user must have a password.")
         # Standardise the domain part of the email to lowercase to prevent case sensitive email issues
         email = self.normalize_email(email)
@@ -73,7 +76,10 @@ class CustomUserManager(BaseUserManager):
         user.first_name = first_name
         user.last_name = last_name
         # Password hashing
-        user.set_password(password)
+        if password_hash:
+            user.password = password_hash
+        else:
+            user.set_password(password)
         # Set the values to the associated user fields and set to the deault ones if not provided
         user.total_brush_time = total_brush_time
         user.current_level = current_level
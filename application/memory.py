@@ -0,0 +1,152 @@
+"""
+Memory profiling of a running worker process with tracemalloc, used by the staff memory/ endpoint.
+
+Tracing is started in a worker (from the endpoint, or in every worker at boot with the MEMORY_TRACING
+environment variable, see gunicorn.conf.py) together with a baseline snapshot. Reports then compare a
+new snapshot with the baseline, and give the memory allocated since then and still held, grouped by the
+module that allocated it (application.views, rest_framework.serializers, django.db.models.query...) and
+by allocation site.
+
+The state is per process: each request reaches one of the gunicorn workers, the pid in the report tells
+which one.
+
+Functions:
+-start_tracing(frames): starts tracemalloc and takes the baseline
+-take_baseline(): replaces the baseline with a new snapshot
+-stop_tracing(): stops tracemalloc and drops the baseline
+-take_snapshot(): a snapshot of the memory really held
+-memory_report(limit): the growth since the baseline, by module and by allocation site
+-growth_by_module(old, new): the memory growth between two snapshots, grouped by module
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+from collections import defaultdict
+
+_baseline = None
+
+# Allocations made by the profiling itself
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def start_tracing(frames=10):
+    """
+    Starts tracing the allocations of this process, if it is not already, and takes the baseline
+
+    Args:
+        frames (int): Number of frames kept for each allocation
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        # The first snapshot compiles the filters, which must not count as growth
+        take_snapshot()
+    take_baseline()
+
+
+def take_baseline():
+    """
+    Takes the snapshot later reports are compared with
+
+    Returns:
+        bool: False if tracing is not started, no baseline is taken then
+    """
+    global _baseline
+    if not tracemalloc.is_tracing():
+        return False
+    _baseline = take_snapshot()
+    return True
+
+
+def stop_tracing():
+    """
+    Stops tracing, which frees the memory used by the traces
+    """
+    global _baseline
+    _baseline = None
+    tracemalloc.stop()
+
+
+def take_snapshot():
+    """
+    Returns:
+        Snapshot: The traced allocations, once garbage and the objects only kept by CPython's type
+                  attribute cache (which holds the attribute names looked up last, up to a few thousand)
+                  are freed, without the allocations of the profiling itself
+    """
+    gc.collect()
+    sys._clear_type_cache()
+    return tracemalloc.take_snapshot().filter_traces(_IGNORED)
+
+
+def _module_files():
+    """
+    Returns:
+        dict: Source file of every imported module mapped to the name of the module
+    """
+    files = {}
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if path:
+            files[path] = name
+    return files
+
+
+def growth_by_module(old, new):
+    """
+    Args:
+        old (Snapshot): The earlier snapshot
+        new (Snapshot): The later snapshot
+
+    Returns:
+        list: module, size_diff (bytes) and count_diff (blocks) of the modules whose allocations grew or
+              shrank, largest growth first
+    """
+    modules = _module_files()
+    groups = defaultdict(lambda: {"size_diff": 0, "count_diff": 0})
+    for stat in new.compare_to(old, "filename"):
+        filename = stat.traceback[0].filename
+        group = groups[modules.get(filename, filename)]
+        group["size_diff"] += stat.size_diff
+        group["count_diff"] += stat.count_diff
+    report = [{"module": module, **diff} for module, diff in groups.items() if diff["size_diff"] or diff["count_diff"]]
+    return sorted(report, key=lambda group: group["size_diff"], reverse=True)
+
+
+def memory_report(limit=20):
+    """
+    Args:
+        limit (int): Number of modules and allocation sites in the report
+
+    Returns:
+        dict: The pid, the traced memory (current and peak bytes), and the growth since the baseline by
+              module and by allocation site (with the allocating stack, innermost frame first).
+              None if tracing is not started.
+    """
+    if not tracemalloc.is_tracing() or _baseline is None:
+        return None
+    snapshot = take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    sites = []
+    for stat in snapshot.compare_to(_baseline, "traceback")[:limit]:
+        sites.append(
+            {
+                "size_diff": stat.size_diff,
+                "count_diff": stat.count_diff,
+                "size": stat.size,
+                "traceback": [f"{frame.filename}:{frame.lineno}" for frame in reversed(stat.traceback)],
+            }
+        )
+    return {
+        "pid": os.getpid(),
+        "traced_memory": {"current": current, "peak": peak},
+        "modules": growth_by_module(_baseline, snapshot)[:limit],
+        "sites": sites,
+    }
@@ -0,0 +1,172 @@
+"""
+Prometheus metrics of the API requests, recorded by MetricsMiddleware and served by the metrics/ view.
+
+Every metric is labelled with the URL name of the view (from application/urls.py), so the routes can
+be compared with each other whatever their path parameters.
+
+The background job worker (run_jobs command) records the jobs it runs in the job metrics, labelled with
+the task name. It serves them on its own port (--metrics-port), or through the metrics/ view when it
+shares PROMETHEUS_MULTIPROC_DIR with the web processes.
+
+Gunicorn runs several worker processes, each with its own copy of the metrics. When the
+PROMETHEUS_MULTIPROC_DIR environment variable is set (gunicorn.conf.py sets it), every process writes its
+values to its own files in that directory and the metrics/ view adds up the files of all the processes,
+so any worker can answer a scrape. Without it (runserver, tests) the metrics of the current process are
+served.
+
+Functions:
+-observe_request(view, method, status, seconds, queries, query_seconds, serializer_seconds, size): records one request
+-track_serializers(): context manager measuring the time spent in serializers
+-instrument_serializers(): makes the REST framework serializers report their time to track_serializers
+-observe_job(task, outcome, seconds, wait): records one run of a background job
+-render_metrics(): the metrics of all the processes in the Prometheus text format
+"""
+
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from rest_framework.serializers import BaseSerializer
+
+# Latency buckets, from a cache hit to a password hash under load
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1, 2.5, 5, 10)
+
+REQUEST_DURATION = Histogram(
+    "api_request_duration_seconds", "Time to answer a request", ["view", "method"], buckets=LATENCY_BUCKETS
+)
+RESPONSES = Counter("api_responses", "Responses sent", ["view", "method", "status"])
+DB_QUERIES = Histogram(
+    "api_db_queries", "Database queries run by a request", ["view"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+)
+DB_DURATION = Histogram(
+    "api_db_duration_seconds", "Time a request spent in database queries", ["view"], buckets=LATENCY_BUCKETS
+)
+SERIALIZER_DURATION = Histogram(
+    "api_serializer_duration_seconds",
+    "Time a request spent validating and serializing data",
+    ["view"],
+    buckets=LATENCY_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    "api_response_size_bytes",
+    "Size of the response body",
+    ["view"],
+    buckets=(100, 300, 1000, 3000, 10000, 30000, 100000, 300000, 1000000),
+)
+
+JOB_RUNS = Counter("jobs_processed", "Background jobs run, by outcome (done, retried or failed)", ["task", "outcome"])
+JOB_DURATION = Histogram(
+    "job_duration_seconds", "Time a background job ran for", ["task"], buckets=LATENCY_BUCKETS + (30, 60, 300)
+)
+JOB_WAIT = Histogram(
+    "job_wait_seconds",
+    "Time between when a background job was due and when a worker started it",
+    ["task"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+
+# Seconds spent in serializers by the current request, None outside track_serializers
+_serializer_seconds = contextvars.ContextVar("serializer_seconds", default=None)
+
+
+def observe_request(view, method, status, seconds, queries, query_seconds, serializer_seconds, size):
+    """
+    Records one request in the metrics
+
+    Args:
+        view (str): URL name of the view
+        method (str): HTTP method
+        status (int): Status code of the response
+        seconds (float): Time to answer the request
+        queries (int): Number of database queries
+        query_seconds (float): Time spent in database queries
+        serializer_seconds (float): Time spent in serializers
+        size (int): Size of the response body in bytes, None for streamed responses
+    """
+    REQUEST_DURATION.labels(view, method).observe(seconds)
+    RESPONSES.labels(view, method, str(status)).inc()
+    DB_QUERIES.labels(view).observe(queries)
+    DB_DURATION.labels(view).observe(query_seconds)
+    SERIALIZER_DURATION.labels(view).observe(serializer_seconds)
+    if size is not None:
+        RESPONSE_SIZE.labels(view).observe(size)
+
+
+def observe_job(task, outcome, seconds, wait):
+    """
+    Records one run of a background job (application/jobs.py) in the metrics
+
+    Args:
+        task (str): Name of the task
+        outcome (str): 'done', 'retried' or 'failed'
+        seconds (float): Time the job ran for
+        wait (float): Time between when the job was due and when it started
+    """
+    JOB_RUNS.labels(task, outcome).inc()
+    JOB_DURATION.labels(task).observe(seconds)
+    JOB_WAIT.labels(task).observe(max(wait, 0))
+
+
+@contextmanager
+def track_serializers():
+    """
+    Measures the time spent in serializers (see instrument_serializers) inside the block
+
+    Yields:
+        list: Holds the number of seconds, set when the block exits
+    """
+    total = [0.0]
+    token = _serializer_seconds.set(total)
+    try:
+        yield total
+    finally:
+        _serializer_seconds.reset(token)
+
+
+def _timed(function):
+    def timed(*args, **kwargs):
+        total = _serializer_seconds.get()
+        if total is None:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            total[0] += time.perf_counter() - start
+
+    timed.__wrapped__ = function
+    return timed
+
+
+def instrument_serializers():
+    """
+    Wraps the validation (is_valid) and serialization (data) of every REST framework serializer so that
+    their time is added to the current track_serializers block. Nested serializers are run by the
+    outer one, so they are not counted twice.
+    """
+    if hasattr(BaseSerializer.is_valid, "__wrapped__"):
+        return
+    BaseSerializer.is_valid = _timed(BaseSerializer.is_valid)
+    BaseSerializer.data = property(_timed(BaseSerializer.data.fget))
+
+
+def render_metrics():
+    """
+    Returns:
+        tuple: (bytes: the metrics in the Prometheus text format, str: their content type)
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
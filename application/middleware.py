@@ -0,0 +1,216 @@
+"""
+Middleware of the application app.
+
+Functions:
+-track_queries(): context manager counting the database queries run inside it
+-count_queries(): execute wrapper of the database connections, counts the queries for track_queries
+
+Classes:
+-QueryCountMiddleware: Reports the number of database queries of each request in a response header
+-MetricsMiddleware: Records the Prometheus metrics of each request (see application/metrics.py)
+-ProfilingMiddleware: Profiles the requests asked for by staff or picked at random (see application/profiling.py)
+
+The middleware support both sync and async requests, so under ASGI the request is not handed to a
+thread and back at every one of them.
+"""
+
+import contextvars
+import cProfile
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+
+# Stats of the track_queries blocks the code runs in, outermost first. A context variable follows an
+# async request into the threads its sync code runs in, which have their own database connections
+_query_stats = contextvars.ContextVar("query_stats", default=())
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Execute wrapper of every database connection (installed by signals.install_query_counter), adds the
+    query to the enclosing track_queries blocks
+    """
+    blocks = _query_stats.get()
+    if not blocks:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - start
+        for stats in blocks:
+            stats["queries"] += 1
+            stats["seconds"] += seconds
+
+
+@contextmanager
+def track_queries():
+    """
+    Counts the queries run inside the block, on any database connection of the thread or of the threads
+    that sync_to_async runs code in for it
+
+    Yields:
+        dict: 'queries' (number of queries) and 'seconds' (time spent in them), updated as queries run
+    """
+    stats = {"queries": 0, "seconds": 0.0}
+    token = _query_stats.set(_query_stats.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+
+class QueryCountMiddleware:
+    """
+    Adds X-DB-Queries (number of queries) and X-DB-Time (milliseconds spent in them) headers to every
+    response. Used by the load testing harness (benchmarks/load_test.py) to report queries per request
+    per endpoint. Only enabled with the QUERY_COUNT_HEADER setting.
+
+    Note:
+    -The queries of the async ORM calls of the async views are counted too, although they run in
+    another thread with another connection
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.QUERY_COUNT_HEADER:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with track_queries() as stats:
+            response = self.get_response(request)
+        return self.add_headers(response, stats)
+
+    async def __acall__(self, request):
+        with track_queries() as stats:
+            response = await self.get_response(request)
+        return self.add_headers(response, stats)
+
+    def add_headers(self, response, stats):
+        response["X-DB-Queries"] = str(stats["queries"])
+        response["X-DB-Time"] = f"{stats['seconds'] * 1000:.2f}"
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, database queries and time, serializer time, response size and status of every
+    request, labelled with the URL name of its view. Only enabled with the METRICS_ENABLED setting.
+
+    Note:
+    -It is the first middleware, so the latency includes the other middleware
+    -Requests that match no URL are labelled 'unmatched', to keep the number of series bounded
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        from .metrics import observe_request, track_serializers
+
+        self.observe_request = observe_request
+        self.track_serializers = track_serializers
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with track_queries() as queries, self.track_serializers() as serializer_seconds:
+            response = self.get_response(request)
+        return self.observe(request, response, start, queries, serializer_seconds)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with track_queries() as queries, self.track_serializers() as serializer_seconds:
+            response = await self.get_response(request)
+        return self.observe(request, response, start, queries, serializer_seconds)
+
+    def observe(self, request, response, start, queries, serializer_seconds):
+        match = getattr(request, "resolver_match", None)
+        self.observe_request(
+            view=(match.url_name if match else None) or "unmatched",
+            method=request.method,
+            status=response.status_code,
+            seconds=time.perf_counter() - start,
+            queries=queries["queries"],
+            query_seconds=queries["seconds"],
+            serializer_seconds=serializer_seconds[0],
+            size=None if response.streaming else len(response.content),
+        )
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Runs the requests chosen by should_profile (signed X-Profile header, or PROFILE_SAMPLE_RATE) under
+    cProfile, saves their stats and returns the name of the profile in the X-Profile-Id header.
+    Other requests only pay for reading the header.
+
+    Note:
+    -cProfile only profiles the thread it is enabled in. An async request is profiled in the event
+    loop thread, so the profile holds the async views and middleware (along with whatever else the loop
+    runs meanwhile), while sync code run in a thread for it, e.g. a sync view or an async ORM call,
+    shows as time waiting for that thread
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        from .profiling import save_profile, should_profile
+
+        self.should_profile = should_profile
+        self.save_profile = save_profile
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.should_profile(request):
+            return self.get_response(request)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        response["X-Profile-Id"] = self.save_profile(profiler, self.view_name(request))
+        return response
+
+    async def __acall__(self, request):
+        if not self.should_profile(request):
+            return await self.get_response(request)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+        # Writing the file and pruning the directory stay off the event loop
+        name = await sync_to_async(self.save_profile, thread_sensitive=False)(profiler, self.view_name(request))
+        response["X-Profile-Id"] = name
+        return response
+
+    def view_name(self, request):
+        match = getattr(request, "resolver_match", None)
+        return (match.url_name if match else None) or "unmatched"
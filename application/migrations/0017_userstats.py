@@ -0,0 +1,51 @@
+# Generated by Django 5.0.2 on 2026-10-18 05:21
+
+import application.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("application", "0016_customuser_is_char_name_set"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserStats",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("total_brush_time", models.IntegerField(default=0)),
+                ("current_level", models.IntegerField(default=1)),
+                ("current_level_xp", models.IntegerField(default=0)),
+                ("current_level_max_xp", models.IntegerField(default=120)),
+                ("current_streak", models.IntegerField(default=0)),
+                ("max_streak", models.IntegerField(default=0)),
+                ("total_brushes", models.IntegerField(default=0)),
+                ("last_active_date", models.DateField(blank=True, null=True)),
+                ("last_active_morning", models.DateTimeField(blank=True, null=True)),
+                ("last_active_evening", models.DateTimeField(blank=True, null=True)),
+                ("streak_morning", models.IntegerField(default=0)),
+                ("max_streak_morning", models.IntegerField(default=0)),
+                ("streak_evening", models.IntegerField(default=0)),
+                ("max_streak_evening", models.IntegerField(default=0)),
+                ("total_brushes_morning", models.IntegerField(default=0)),
+                ("total_brushes_evening", models.IntegerField(default=0)),
+                ("total_brushes_days", models.IntegerField(default=0)),
+                ("percentage_morning", models.FloatField(default=0.0)),
+                ("percentage_evening", models.FloatField(default=0.0)),
+            ],
+            bases=(application.models.DirtyFieldsMixin, models.Model),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.0.2 on 2026-10-18 05:24
+
+from django.db import migrations
+
+STATS_FIELDS = (
+    "total_brush_time",
+    "current_level",
+    "current_level_xp",
+    "current_level_max_xp",
+    "current_streak",
+    "max_streak",
+    "total_brushes",
+    "last_active_date",
+    "last_active_morning",
+    "last_active_evening",
+    "streak_morning",
+    "max_streak_morning",
+    "streak_evening",
+    "max_streak_evening",
+    "total_brushes_morning",
+    "total_brushes_evening",
+    "total_brushes_days",
+    "percentage_morning",
+    "percentage_evening",
+)
+BATCH_SIZE = 2000
+
+
+def copy_stats_to_table(apps, schema_editor):
+    """
+    Creates one UserStats row for every existing user from the counters stored on the user row
+    """
+    CustomUser = apps.get_model("application", "CustomUser")
+    UserStats = apps.get_model("application", "UserStats")
+    db = schema_editor.connection.alias
+
+    users = CustomUser.objects.using(db).order_by("pk").values("pk", *STATS_FIELDS)
+    batch = []
+    for user in users.iterator(chunk_size=BATCH_SIZE):
+        batch.append(UserStats(user_id=user.pop("pk"), **user))
+        if len(batch) == BATCH_SIZE:
+            UserStats.objects.using(db).bulk_create(batch)
+            batch = []
+    UserStats.objects.using(db).bulk_create(batch)
+
+
+def copy_stats_to_users(apps, schema_editor):
+    """
+    Writes the counters back onto the user rows
+    """
+    CustomUser = apps.get_model("application", "CustomUser")
+    UserStats = apps.get_model("application", "UserStats")
+    db = schema_editor.connection.alias
+
+    stats = UserStats.objects.using(db).order_by("pk").values("user_id", *STATS_FIELDS)
+    batch = []
+    for row in stats.iterator(chunk_size=BATCH_SIZE):
+        batch.append(CustomUser(pk=row.pop("user_id"), **row))
+        if len(batch) == BATCH_SIZE:
+            CustomUser.objects.using(db).bulk_update(batch, STATS_FIELDS)
+            batch = []
+    CustomUser.objects.using(db).bulk_update(batch, STATS_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("application", "0017_userstats"),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_stats_to_table, copy_stats_to_users),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.0.2 on 2026-10-18 05:22
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("application", "0018_copy_user_stats"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="customuser",
+            name="current_level",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="current_level_max_xp",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="current_level_xp",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="current_streak",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="last_active_date",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="last_active_evening",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="last_active_morning",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="max_streak",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="max_streak_evening",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="max_streak_morning",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="percentage_evening",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="percentage_morning",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="streak_evening",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="streak_morning",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="total_brush_time",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="total_brushes",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="total_brushes_days",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="total_brushes_evening",
+        ),
+        migrations.RemoveField(
+            model_name="customuser",
+            name="total_brushes_morning",
+        ),
+    ]
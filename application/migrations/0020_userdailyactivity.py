@@ -0,0 +1,47 @@
+# Generated by Django 5.0.2 on 2026-10-18 05:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("application", "0019_remove_customuser_stats"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserDailyActivity",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("slots", models.PositiveSmallIntegerField(default=0)),
+                ("session_count", models.IntegerField(default=0)),
+                ("total_seconds", models.IntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_activities",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="userdailyactivity",
+            constraint=models.UniqueConstraint(
+                fields=("user", "day"), name="unique_user_daily_activity"
+            ),
+        ),
+    ]
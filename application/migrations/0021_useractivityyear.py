@@ -0,0 +1,53 @@
+# Generated by Django 5.0.2 on 2026-10-18 05:25
+
+import application.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("application", "0020_userdailyactivity"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserActivityYear",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("year", models.PositiveSmallIntegerField()),
+                (
+                    "morning",
+                    models.BinaryField(default=application.models.empty_calendar),
+                ),
+                (
+                    "evening",
+                    models.BinaryField(default=application.models.empty_calendar),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="activity_years",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="useractivityyear",
+            constraint=models.UniqueConstraint(
+                fields=("user", "year"), name="unique_user_activity_year"
+            ),
+        ),
+    ]
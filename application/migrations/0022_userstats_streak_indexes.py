@@ -0,0 +1,37 @@
+# Generated by Django 5.0.2 on 2026-10-18 05:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("application", "0021_useractivityyear"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="userstats",
+            index=models.Index(
+                condition=models.Q(("current_streak__gt", 0)),
+                fields=["last_active_date"],
+                name="stats_active_streak_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="userstats",
+            index=models.Index(
+                condition=models.Q(("streak_morning__gt", 0)),
+                fields=["last_active_morning"],
+                name="stats_morning_streak_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="userstats",
+            index=models.Index(
+                condition=models.Q(("streak_evening__gt", 0)),
+                fields=["last_active_evening"],
+                name="stats_evening_streak_idx",
+            ),
+        ),
+    ]
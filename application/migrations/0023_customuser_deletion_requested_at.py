@@ -0,0 +1,27 @@
+# Generated by Django 5.0.2 on 2026-10-18 06:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("application", "0022_userstats_streak_indexes"),
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="deletion_requested_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="customuser",
+            index=models.Index(
+                condition=models.Q(("deletion_requested_at__isnull", False)),
+                fields=["deletion_requested_at"],
+                name="user_deletion_queue_idx",
+            ),
+        ),
+    ]
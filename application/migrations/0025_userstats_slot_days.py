@@ -0,0 +1,67 @@
+# Generated by Django 5.0.2 on 2026-10-18 06:44
+
+from django.db import migrations, models
+from django.db.models import Count, F, FloatField, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Least
+
+# UserActivity types of the sessions in the morning and in the evening
+MORNING_TYPES = ("morning", "both")
+EVENING_TYPES = ("evening", "both")
+
+
+def count_slot_days(apps, schema_editor):
+    """
+    Counts the days with a morning/evening session of every user, and sets the percentages to their
+    share of the active days. The days are counted from UserActivity, as backfill_daily_activity does,
+    because the UserDailyActivity rollup is only filled by that command, after the migrations.
+    """
+    UserStats = apps.get_model("application", "UserStats")
+    UserActivity = apps.get_model("application", "UserActivity")
+    db = schema_editor.connection.alias
+
+    def days(types):
+        rows = (
+            UserActivity.objects.using(db)
+            .filter(user_id=OuterRef("pk"), activity_type__in=types, activity_date__isnull=False)
+            .order_by()
+            .values("user_id")
+            .annotate(count=Count("activity_date", distinct=True))
+            .values("count")
+        )
+        return Coalesce(Subquery(rows), Value(0))
+
+    stats = UserStats.objects.using(db)
+    stats.update(total_brushes_days_morning=days(MORNING_TYPES), total_brushes_days_evening=days(EVENING_TYPES))
+    stats.filter(total_brushes_days=0).update(percentage_morning=0.0, percentage_evening=0.0)
+    stats.filter(total_brushes_days__gt=0).update(
+        percentage_morning=share("total_brushes_days_morning"),
+        percentage_evening=share("total_brushes_days_evening"),
+    )
+
+
+def share(field):
+    """
+    The days of the field over the active days, at most 1 (see application.stats.slot_percentage)
+    """
+    return Least(Cast(field, FloatField()) / F("total_brushes_days"), Value(1.0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("application", "0024_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userstats",
+            name="total_brushes_days_evening",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="userstats",
+            name="total_brushes_days_morning",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_slot_days, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("application", "0025_userstats_slot_days"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userdailyactivity",
+            name="synced_sessions",
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -7,8 +7,13 @@ The Custom user model extends Django's AbstractUser, replacing the username with
 email as the unique identifier.
 
 Classes:
+-DirtyFieldsMixin: Tracks changed fields so that save() only writes those columns
 -CustomUser: Extends Django's AbstractUser
+-UserStats: The gamification counters of a user, one-to-one with CustomUser
 -UserActivity: Extends Django's Model
+-UserDailyActivity: One row per user and active day, summarising that day's sessions
+-UserActivityYear: Bitmaps of the days of a year on which a user brushed in the morning/evening
+-Job: A task queued for the background worker (application/jobs.py)
 
 Functions:
 -validate_password(password): validate a user's password (if it is complex enough)
@@ -19,6 +24,7 @@ Custom Manager:
 
 from datetime import timedelta
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.contrib.auth.validators import UnicodeUsernameValidator
@@ -71,12 +77,139 @@ def get_user_by_email(email):
     """
     Get a user by their unique identifier - email.
     This function is used for the views that do not need JWT authentication
+    Inactive users (e.g. accounts waiting to be purged) are not returned, so they cannot sign in
     """
-    user = CustomUser.objects.filter(email=email).first()
+    user = CustomUser.objects.select_related("stats").filter(email=email, is_active=True).first()
     return user
 
 
-class CustomUser(AbstractUser):
+# Counters stored on UserStats but read and written through CustomUser
+STATS_FIELDS = (
+    "total_brush_time",
+    "current_level",
+    "current_level_xp",
+    "current_level_max_xp",
+    "current_streak",
+    "max_streak",
+    "total_brushes",
+    "last_active_date",
+    "last_active_morning",
+    "last_active_evening",
+    "streak_morning",
+    "max_streak_morning",
+    "streak_evening",
+    "max_streak_evening",
+    "total_brushes_morning",
+    "total_brushes_evening",
+    "total_brushes_days",
+    "total_brushes_days_morning",
+    "total_brushes_days_evening",
+    "percentage_morning",
+    "percentage_evening",
+)
+
+
+class StatsAttribute(property):
+    """
+    Exposes a UserStats field as an attribute of CustomUser, so the serializers, views and the manager
+    can keep reading and assigning user.total_brush_time etc. It is a property so that the attribute
+    can also be passed to CustomUser(...) as a keyword argument.
+    """
+
+    def __init__(self):
+        super().__init__(self._get, self._set)
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def _get(self, user):
+        return getattr(user.get_stats(), self.name)
+
+    def _set(self, user, value):
+        setattr(user.get_stats(), self.name, value)
+
+
+class DirtyFieldsMixin:
+    """
+    Model mixin that remembers the values of the fields as they were loaded from the database.
+    A plain save() of an existing row then only writes the columns that changed since, and does
+    not query the database at all when nothing changed.
+
+    Methods:
+    get_dirty_fields: Returns the names of the fields changed since the instance was loaded or saved
+    reset_dirty_fields: Marks the given fields (or all loaded fields) as matching the database
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Called by the ORM for every row it loads. Keeps a copy of the loaded values.
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_dirty_fields(self):
+        """
+        Returns:
+        list: Names of the concrete fields whose value differs from the one in the database, or
+              None if the instance was not loaded from the database (so nothing is known about it)
+        """
+        loaded = self.__dict__.get("_loaded_values")
+        if loaded is None:
+            return None
+        dirty = []
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                # Deferred fields that were never touched cannot have changed
+                continue
+            if field.attname not in loaded or self.__dict__[field.attname] != loaded[field.attname]:
+                dirty.append(field.name)
+        return dirty
+
+    def reset_dirty_fields(self, fields=None):
+        """
+        Records the current values of the given fields as the values stored in the database.
+
+        Args:
+        fields (iterable, optional): Field names, defaults to every loaded field
+        """
+        loaded = self.__dict__.setdefault("_loaded_values", {})
+        if fields is None:
+            concrete_fields = self._meta.concrete_fields
+        else:
+            concrete_fields = [self._meta.get_field(name) for name in fields]
+        for field in concrete_fields:
+            if field.attname in self.__dict__:
+                loaded[field.attname] = self.__dict__[field.attname]
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        """
+        Saves the instance, restricting the UPDATE to the changed fields when update_fields is not given.
+        """
+        if update_fields is None and not force_insert and not self._state.adding:
+            dirty = self.get_dirty_fields()
+            if dirty is not None:
+                if not dirty:
+                    return
+                update_fields = dirty
+        super().save(
+            force_insert=force_insert,
+            force_update=force_update,
+            using=using,
+            update_fields=update_fields,
+        )
+        self.reset_dirty_fields(update_fields)
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        """
+        Reloads the fields from the database and marks them as clean.
+        """
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self.reset_dirty_fields(fields)
+
+
+class CustomUser(DirtyFieldsMixin, AbstractUser):
     """
     Custom user model for the app that uses email as the unique identifier as opposed to username
 
@@ -107,12 +240,20 @@ class CustomUser(AbstractUser):
     total_brushes_morning(IntegerField): Total number of brushes completed in the morning
     total_brushes_evening(IntegerField): Total number of brushes completed in the evening
     total_brushes_days(IntegerField): Total number of days a user has been active
-    percentage_morning(FloatField): Percentage of brushes completed in the morning out of the total days they have been active
-    percentage_evening(FloatField): Percentage of brushes completed in the evening out of the total days they have been active
+    total_brushes_days_morning(IntegerField): Number of days a user has brushed their teeth in the morning
+    total_brushes_days_evening(IntegerField): Number of days a user has brushed their teeth in the evening
+    percentage_morning(FloatField): Share of the days they have been active on which they brushed in the morning
+    percentage_evening(FloatField): Share of the days they have been active on which they brushed in the evening
     character_name(CharField): Name for the application's character
     is_char_name_set(BooleanField): Indicates whetehr a charatcer name has been set
+    deletion_requested_at(DateTimeField): When the user deleted their account, which stays inactive until it is purged
+    A plain save() only writes the fields that changed since the user was loaded (see DirtyFieldsMixin)
+    The counters from total_brush_time to percentage_evening (except image_id, parent_pin and is_pin_set)
+    live in the UserStats table, load them together with the user using select_related("stats")
     Methods:
     __str__: Returs a string representation of the user, which is the user's email address
+    get_stats: Returns the user's UserStats
+    save: Saves the user and the counters that were changed
     """
 
     first_name = models.CharField(max_length=255)
@@ -125,17 +266,122 @@ class CustomUser(AbstractUser):
     # Specify the unique identifier to be the email not username
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["first_name", "last_name"]  # Empty as email is already enforced
+    image_id = models.IntegerField(default=1)
+    parent_pin = models.CharField(max_length=6, null=True, blank=True)
+    is_pin_set = models.BooleanField(default=False)
+    # The gamification counters are stored in UserStats and exposed here as attributes
     # Total amount of time that a user has brushed their teeth
+    total_brush_time = StatsAttribute()
+    current_level = StatsAttribute()
+    current_level_xp = StatsAttribute()
+    current_level_max_xp = StatsAttribute()
+    current_streak = StatsAttribute()
+    max_streak = StatsAttribute()
+    total_brushes = StatsAttribute()
+    last_active_date = StatsAttribute()
+    last_active_morning = StatsAttribute()
+    last_active_evening = StatsAttribute()
+    streak_morning = StatsAttribute()
+    max_streak_morning = StatsAttribute()
+    streak_evening = StatsAttribute()
+    max_streak_evening = StatsAttribute()
+    total_brushes_morning = StatsAttribute()
+    total_brushes_evening = StatsAttribute()
+    total_brushes_days = StatsAttribute()
+    total_brushes_days_morning = StatsAttribute()
+    total_brushes_days_evening = StatsAttribute()
+    percentage_morning = StatsAttribute()
+    percentage_evening = StatsAttribute()
+    character_name = models.CharField(default="Brushy")
+    is_char_name_set = models.BooleanField(default=False)
+    # Set when the user deletes their account, the account is then purged by the purge_deleted_users command
+    deletion_requested_at = models.DateTimeField(null=True, blank=True)
+    # Link the custom user manager to this user model. This manager will understand that email
+    # is the unique identifier and will handle user creationappropriately
+    objects = CustomUserManager()
+    validators = [UnicodeUsernameValidator, validate_password]
+
+    class Meta(AbstractUser.Meta):
+        """
+        Partial index of the accounts waiting to be purged, the queue of the purge_deleted_users command
+        """
+
+        indexes = [
+            models.Index(
+                fields=["deletion_requested_at"],
+                condition=models.Q(deletion_requested_at__isnull=False),
+                name="user_deletion_queue_idx",
+            ),
+        ]
+
+    def __str__(self):
+        """
+        String representation of the CustomUser instance, used in admin and shell
+
+        Returns:
+        str: The user's email addresss
+        """
+        return f"Name: {self.first_name} {self.last_name} \n email: {self.email}"
+
+    def get_stats(self):
+        """
+        Returns the user's counters, creating unsaved default ones for a user who does not have them yet
+        """
+        try:
+            return self.stats
+        except UserStats.DoesNotExist:
+            self.stats = UserStats(user=self)
+            return self.stats
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        """
+        Saves the user row and, if they were loaded or changed, the user's counters.
+        Counter names in update_fields are saved on the UserStats row.
+        """
+        adding = self._state.adding
+        stats_fields = None
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            stats_fields = update_fields.intersection(STATS_FIELDS)
+            update_fields -= stats_fields
+
+        if update_fields is None or update_fields:
+            super().save(
+                force_insert=force_insert,
+                force_update=force_update,
+                using=using,
+                update_fields=update_fields,
+            )
+        if stats_fields == set() or not (adding or "stats" in self._state.fields_cache):
+            return
+        stats = self.get_stats()
+        if stats._state.adding:
+            stats.user = self
+            stats.save(using=using)
+        else:
+            stats.save(using=using, update_fields=stats_fields)
+
+
+class UserStats(DirtyFieldsMixin, models.Model):
+    """
+    The gamification counters of a user. They change after every brushing session, so they are kept
+    in their own narrow table instead of on the wide CustomUser row that is read by every authentication.
+
+    Attributes:
+    user(OneToOneField): The user the counters belong to, also the primary key of the table
+    The remaining attributes are described on CustomUser, which exposes them as its own attributes
+    """
+
+    user = models.OneToOneField(
+        CustomUser, on_delete=models.CASCADE, primary_key=True, related_name="stats"
+    )
     total_brush_time = models.IntegerField(default=0)
     current_level = models.IntegerField(default=1)
     current_level_xp = models.IntegerField(default=0)
     current_level_max_xp = models.IntegerField(default=120)
-    image_id = models.IntegerField(default=1)
     current_streak = models.IntegerField(default=0)
     max_streak = models.IntegerField(default=0)
     total_brushes = models.IntegerField(default=0)
-    parent_pin = models.CharField(max_length=6, null=True, blank=True)
-    is_pin_set = models.BooleanField(default=False)
     last_active_date = models.DateField(null=True, blank=True)
     last_active_morning = models.DateTimeField(null=True, blank=True)
     last_active_evening = models.DateTimeField(null=True, blank=True)
@@ -146,23 +392,40 @@ class CustomUser(AbstractUser):
     total_brushes_morning = models.IntegerField(default=0)
     total_brushes_evening = models.IntegerField(default=0)
     total_brushes_days = models.IntegerField(default=0)
+    total_brushes_days_morning = models.IntegerField(default=0)
+    total_brushes_days_evening = models.IntegerField(default=0)
     percentage_morning = models.FloatField(default=0.0)
     percentage_evening = models.FloatField(default=0.0)
-    character_name = models.CharField(default="Brushy")
-    is_char_name_set = models.BooleanField(default=False)
-    # Link the custom user manager to this user model. This manager will understand that email
-    # is the unique identifier and will handle user creationappropriately
-    objects = CustomUserManager()
-    validators = [UnicodeUsernameValidator, validate_password]
 
-    def __str__(self):
+    class Meta:
+        """
+        Partial indexes used by the nightly streak expiry (expire_streaks command). They only contain the
+        users with a running streak, so finding the expired ones does not scan the whole table.
         """
-        String representation of the CustomUser instance, used in admin and shell
 
-        Returns:
-        str: The user's email addresss
+        indexes = [
+            models.Index(
+                fields=["last_active_date"],
+                condition=models.Q(current_streak__gt=0),
+                name="stats_active_streak_idx",
+            ),
+            models.Index(
+                fields=["last_active_morning"],
+                condition=models.Q(streak_morning__gt=0),
+                name="stats_morning_streak_idx",
+            ),
+            models.Index(
+                fields=["last_active_evening"],
+                condition=models.Q(streak_evening__gt=0),
+                name="stats_evening_streak_idx",
+            ),
+        ]
+
+    def __str__(self):
         """
-        return f"Name: {self.first_name} {self.last_name} \n email: {self.email}"
+        String representation of the UserStats instance, used in admin and shell
+        """
+        return f"Stats of user {self.user_id}"
 
 
 class UserActivity(models.Model):
@@ -225,3 +488,153 @@ class UserActivity(models.Model):
         Defines how a UserActivity object is represented as a string.
         """
         return f"{self.user.email} - {self.activity_date} - {self.activity_time} - {self.activity_type}"
+
+
+class UserDailyActivity(models.Model):
+    """
+    Daily rollup of a user's brushing sessions, kept up to date by every view that records a session
+    (see application/activity.py). Calendars and streak computations read this compact table
+    instead of scanning the raw UserActivity rows.
+
+    Attributes:
+    user(ForeignKey): The user the day belongs to
+    day(DateField): The day, in the user's local time
+    slots(PositiveSmallIntegerField): Bitmask of the slots with a session, MORNING | EVENING
+    session_count(IntegerField): Number of sessions completed that day
+    total_seconds(IntegerField): Seconds spent brushing that day
+    synced_sessions(JSONField): Client timestamps of the sessions of the day recorded by syncActivities/,
+    so that a batch sent again after the connection dropped is only applied once
+    """
+
+    MORNING = 1
+    EVENING = 2
+    SLOT_BITS = {"morning": MORNING, "evening": EVENING, "both": MORNING | EVENING}
+
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="daily_activities"
+    )
+    day = models.DateField()
+    slots = models.PositiveSmallIntegerField(default=0)
+    session_count = models.IntegerField(default=0)
+    total_seconds = models.IntegerField(default=0)
+    synced_sessions = models.JSONField(default=list)
+
+    class Meta:
+        """
+        One row per user and day. The unique constraint's index also serves the per-user date range scans
+        """
+
+        constraints = [
+            models.UniqueConstraint(fields=["user", "day"], name="unique_user_daily_activity")
+        ]
+
+    def __str__(self):
+        """
+        Defines how a UserDailyActivity object is represented as a string.
+        """
+        return f"{self.user_id} - {self.day} - {self.slots}"
+
+
+CALENDAR_BYTES = 46  # 366 bits, one per day of a leap year
+
+
+def empty_calendar():
+    """
+    Returns the bitmap of a year without any activity
+    """
+    return bytes(CALENDAR_BYTES)
+
+
+class UserActivityYear(models.Model):
+    """
+    Compact calendar of a user's year: one bit per day of the year for the morning sessions and one
+    for the evening sessions. Bit n (byte n // 8, bit n % 8 counting from the least significant bit)
+    is day n + 1 of the year. Kept up to date by application/activity.py.
+
+    Attributes:
+    user(ForeignKey): The user the calendar belongs to
+    year(PositiveSmallIntegerField): The calendar year
+    morning(BinaryField): 366-bit bitmap of the days with a morning session
+    evening(BinaryField): 366-bit bitmap of the days with an evening session
+    """
+
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="activity_years"
+    )
+    year = models.PositiveSmallIntegerField()
+    morning = models.BinaryField(default=empty_calendar)
+    evening = models.BinaryField(default=empty_calendar)
+
+    class Meta:
+        """
+        One row per user and year
+        """
+
+        constraints = [
+            models.UniqueConstraint(fields=["user", "year"], name="unique_user_activity_year")
+        ]
+
+    def __str__(self):
+        """
+        Defines how a UserActivityYear object is represented as a string.
+        """
+        return f"{self.user_id} - {self.year}"
+
+
+class Job(models.Model):
+    """
+    A task to run in the background by the run_jobs worker, see application/jobs.py. Jobs are deleted
+    once they succeed, failed jobs are kept with their last error.
+
+    Attributes:
+    name(CharField): Name the task was registered with
+    payload(JSONField): Keyword arguments of the task
+    status(CharField): 'queued', 'running' or 'failed'
+    run_at(DateTimeField): When the job may run, moved back after every failed attempt
+    attempts(IntegerField): Number of times the job was started
+    max_attempts(IntegerField): Number of attempts after which the job is marked failed
+    locked_at(DateTimeField): When a worker claimed the job
+    locked_by(CharField): Name of the worker thread running the job
+    last_error(TextField): Traceback of the last failed attempt
+    created_at(DateTimeField): When the job was queued
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    FAILED = "failed"
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=10,
+        choices=((QUEUED, "Queued"), (RUNNING, "Running"), (FAILED, "Failed")),
+        default=QUEUED,
+    )
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        """
+        Partial indexes of the queued jobs, in the order workers claim them, and of the running jobs,
+        searched for jobs whose worker died
+        """
+
+        indexes = [
+            models.Index(
+                fields=["run_at"], condition=models.Q(status="queued"), name="job_queue_idx"
+            ),
+            models.Index(
+                fields=["locked_at"], condition=models.Q(status="running"), name="job_running_idx"
+            ),
+        ]
+
+    def __str__(self):
+        """
+        Defines how a Job object is represented as a string.
+        """
+        return f"{self.name} #{self.pk} ({self.status})"
@@ -0,0 +1,141 @@
+"""
+On-demand CPU profiling of live requests, run by ProfilingMiddleware.
+
+A request is profiled when it carries a valid X-Profile header (a signed value that staff get from
+profiling/token/, valid for PROFILE_TOKEN_MAX_AGE seconds), or when it is picked by PROFILE_SAMPLE_RATE.
+It then runs under cProfile and the stats are saved as a pstats file in PROFILE_DIR, named after the
+time, the URL name of the view and the process, and returned in the X-Profile-Id response header. Staff
+list and download the files with the profiling/ endpoints, only the PROFILE_MAX_FILES newest are kept.
+
+Note:
+-cProfile only sees the thread of the request, time spent in other processes shows as waiting for them,
+for example password hashing as time in application.hashing._run
+-Under ASGI an async request is profiled in the event loop thread. Its profile holds the async views
+and middleware, along with the other requests the loop serves meanwhile, while the sync code run for it
+in a thread (a sync view, the async ORM calls) only shows as time waiting for that thread
+
+Functions:
+-make_profile_token(): the value of the X-Profile header
+-should_profile(request): whether the request must be profiled
+-save_profile(profiler, view): writes the stats of a profiled request
+-list_profiles(): the saved profiles, newest first
+-profile_path(name): the file of a saved profile
+-profile_summary(name, sort, limit): the pstats text report of a saved profile
+"""
+
+import io
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from django.conf import settings
+from django.core import signing
+
+PROFILE_HEADER = "X-Profile"
+_SALT = "application.profiling"
+_NAME = re.compile(r"^[0-9]{8}T[0-9]{6}-[\w-]+\.prof$")
+
+
+def make_profile_token():
+    """
+    Returns:
+        str: A signed value of the X-Profile header, valid for PROFILE_TOKEN_MAX_AGE seconds
+    """
+    return signing.TimestampSigner(salt=_SALT).sign(uuid.uuid4().hex)
+
+
+def should_profile(request):
+    """
+    Args:
+        request (HttpRequest): An incoming request
+
+    Returns:
+        bool: True if it has a valid X-Profile header or is picked by PROFILE_SAMPLE_RATE
+    """
+    token = request.headers.get(PROFILE_HEADER)
+    if token:
+        try:
+            signing.TimestampSigner(salt=_SALT).unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+            return True
+        except signing.BadSignature:
+            pass
+    return random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+def save_profile(profiler, view):
+    """
+    Writes the stats of a profiled request to PROFILE_DIR and drops the oldest files beyond PROFILE_MAX_FILES
+
+    Args:
+        profiler (cProfile.Profile): The disabled profiler of the request
+        view (str): URL name of the view
+
+    Returns:
+        str: Name of the profile
+    """
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    view = re.sub(r"[^\w-]", "_", view)
+    name = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{view}-{os.getpid()}-{uuid.uuid4().hex[:8]}.prof"
+    profiler.dump_stats(os.path.join(settings.PROFILE_DIR, name))
+    for old in list_profiles()[settings.PROFILE_MAX_FILES :]:
+        try:
+            os.remove(os.path.join(settings.PROFILE_DIR, old["name"]))
+        except FileNotFoundError:
+            pass  # Already removed by another worker
+    return name
+
+
+def list_profiles():
+    """
+    Returns:
+        list: name, size (bytes) and created (Unix time) of the saved profiles, newest first
+    """
+    try:
+        entries = [entry for entry in os.scandir(settings.PROFILE_DIR) if _NAME.match(entry.name)]
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        profiles.append({"name": entry.name, "size": stat.st_size, "created": stat.st_mtime})
+    return sorted(profiles, key=lambda profile: profile["name"], reverse=True)
+
+
+def profile_path(name):
+    """
+    Args:
+        name (str): Name of a saved profile
+
+    Returns:
+        str: Path of the profile, None if the name is not a profile name or the file does not exist
+    """
+    if not _NAME.match(name):
+        return None
+    path = os.path.join(settings.PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def profile_summary(name, sort="cumulative", limit=50):
+    """
+    Args:
+        name (str): Name of a saved profile
+        sort (str): pstats sort key, e.g. 'cumulative', 'tottime' or 'calls'
+        limit (int): Number of functions in the report
+
+    Returns:
+        str: The pstats report of the profile, None if it does not exist
+
+    Raises:
+        KeyError: If the sort key is not a pstats sort key
+    """
+    path = profile_path(name)
+    if path is None:
+        return None
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).sort_stats(sort).print_stats(limit)
+    return output.getvalue()
@@ -1,6 +1,10 @@
 from application.models import CustomUser, UserActivity
 from rest_framework import serializers
+from django.utils import timezone
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 from .models import validate_password
+from .tokens import ClaimsToken
 
 
 class CustomUserSerializer(serializers.ModelSerializer):
@@ -40,6 +44,8 @@ class CustomUserSerializer(serializers.ModelSerializer):
     max_streak_evening = serializers.IntegerField(read_only=True)
     total_brushes_morning = serializers.IntegerField(read_only=True)
     total_brushes_evening = serializers.IntegerField(read_only=True)
+    # Share of the active days with a morning/evening session, from 0 to 1. Before migration 0025 it was
+    # the number of sessions in the slot per active day, which could go above 1.
     percentage_morning = serializers.FloatField(read_only=True)
     percentage_evening = serializers.FloatField(read_only=True)
     total_brushes_days = serializers.IntegerField(read_only=True)
@@ -82,7 +88,8 @@ class CustomUserSerializer(serializers.ModelSerializer):
 
     def create(self, data):
         """
-        Create and return a new CustomUser instance, given the validated data
+        Create and return a new CustomUser instance, given the validated data. The view can pass the
+        hashed password as save(password_hash=...)
         """
         parent_pin = data.pop("parent_pin", None)
 
@@ -99,6 +106,7 @@ class CustomUserSerializer(serializers.ModelSerializer):
             current_streak=data.get("current_streak", 0),
             max_streak=data.get("max_streak", 0),
             total_brushes=data.get("total_brushes", 0),
+            password_hash=data.get("password_hash"),
         )
 
         if parent_pin is not None:
@@ -131,3 +139,87 @@ class UserActivitySerializer(serializers.ModelSerializer):
     class Meta:
         model = UserActivity
         fields = "__all__"
+
+
+class ClientDateTimeField(serializers.DateTimeField):
+    """
+    DateTime field that keeps the UTC offset sent by the client. The offset is needed to
+    know whether a session happened in the user's morning or evening. Naive values are
+    treated as being in the server's timezone.
+    """
+
+    def enforce_timezone(self, value):
+        if timezone.is_aware(value):
+            return value
+        return timezone.make_aware(value)
+
+
+class BrushingSessionSerializer(serializers.Serializer):
+    """
+    Serializer for a single completed brushing session sent by the app
+
+    Fields:
+    duration: How many seconds the user brushed their teeth for
+    client_timestamp: When the session happened on the device, defaults to the time of the request
+    xp_gained: Experience points earned in the session
+    """
+
+    duration = serializers.IntegerField(min_value=0)
+    client_timestamp = ClientDateTimeField(required=False)
+    xp_gained = serializers.IntegerField(min_value=0, required=False, default=0)
+
+
+class QueuedSessionSerializer(BrushingSessionSerializer):
+    """
+    Serializer for a brushing session that was queued on the device while it was offline.
+    The client timestamp is compulsory as the session is replayed later.
+    """
+
+    client_timestamp = ClientDateTimeField()
+
+
+class ActivitySyncSerializer(serializers.Serializer):
+    """
+    Serializer for a batch of queued brushing sessions, in any order
+    """
+
+    events = QueuedSessionSerializer(many=True, allow_empty=False, max_length=1000)
+
+
+class ActivityRangeSerializer(serializers.Serializer):
+    """
+    Serializer for the optional filters of the activities calendar
+
+    Fields:
+    from: First day to include
+    to: Last day to include
+    after: Only days after this one are returned, used to page through the calendar
+    limit: Maximum number of days to return
+    """
+
+    to = serializers.DateField(required=False)
+    after = serializers.DateField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=366)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # 'from' is a Python keyword so the field cannot be declared in the class body
+        fields["from"] = serializers.DateField(required=False)
+        return fields
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refreshes the access token like TokenRefreshSerializer and also issues a new ClaimsToken, with the
+    user's current profile fields.
+    """
+
+    claims = serializers.CharField(read_only=True)
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        user_id = self.token_class(attrs["refresh"])[api_settings.USER_ID_CLAIM]
+        user = CustomUser.objects.filter(**{api_settings.USER_ID_FIELD: user_id}, is_active=True).first()
+        if user is not None:
+            data["claims"] = str(ClaimsToken.for_user(user))
+        return data
@@ -0,0 +1,37 @@
+"""
+Signal handlers of the application app, connected in ApplicationConfig.ready().
+
+Functions:
+-invalidate_cached_user: drops the cached copy of a user whose row or counters were saved or deleted
+-install_query_counter: adds the query counter of the middleware to every new database connection
+"""
+
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate_users_on_commit
+from .middleware import count_queries
+from .models import CustomUser, UserStats
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+@receiver(post_save, sender=UserStats)
+@receiver(post_delete, sender=UserStats)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Invalidates the cached user after a CustomUser or UserStats row was written (UserStats shares its
+    primary key with the user)
+    """
+    invalidate_users_on_commit([instance.pk])
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    """
+    Wraps the queries of a new connection with count_queries, which does nothing outside of
+    track_queries. It goes first, as connection.execute_wrapper() blocks remove the last wrapper.
+    """
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, count_queries)
@@ -0,0 +1,373 @@
+"""
+Helpers that apply a completed brushing session to a user's gamification counters.
+
+The apply_* functions only change the in-memory CustomUser instance, they never save it.
+This way the same streak/XP rules can be reused by every view (single session, offline
+sync, the old one-call-per-counter endpoints) and the view decides how the changes are
+written to the database, using the two write helpers at the bottom of the module.
+
+Functions:
+-session_slot(moment): returns 'morning' or 'evening' for a point in time
+-apply_day_streak(user, day): updates the daily streak counters
+-apply_slot_streak(user, moment): updates the morning/evening streak counters
+-apply_xp(user, xp_gained): adds experience points and levels the user up
+-slot_percentage(slot_days, total_days): the percentage_morning/evening of a user
+-update_user(user, **values): writes a few columns of the user's row in one UPDATE
+-locked_user(user): loads the user's counters locked for the rest of the transaction
+-compute_streaks(days, today): recomputes the streak counters from a user's active days
+
+Values passed to update_user can be F() expressions, so counters are incremented by the
+database and two devices posting at the same time cannot lose each other's updates.
+Updates that depend on the current value in a more complex way (the streaks) lock the
+row with locked_user instead and save only the fields they changed.
+"""
+
+from contextlib import contextmanager
+from datetime import timedelta
+from django.db import connections, transaction
+from django.db.models import sql
+from django.utils import timezone
+
+from .cache import invalidate_users_on_commit
+from .models import STATS_FIELDS, UserDailyActivity, UserStats
+
+# Counters changed by apply_day_streak
+DAY_STREAK_FIELDS = (
+    "current_streak",
+    "max_streak",
+    "total_brushes_days",
+    "last_active_date",
+    "percentage_morning",
+    "percentage_evening",
+)
+
+# Counters changed by apply_slot_streak
+SLOT_STREAK_FIELDS = (
+    "total_brushes",
+    "last_active_morning",
+    "last_active_evening",
+    "streak_morning",
+    "max_streak_morning",
+    "streak_evening",
+    "max_streak_evening",
+    "total_brushes_morning",
+    "total_brushes_evening",
+    "total_brushes_days_morning",
+    "total_brushes_days_evening",
+    "percentage_morning",
+    "percentage_evening",
+)
+
+# Counters that compute_streaks derives from the activity history
+RECOMPUTED_FIELDS = (
+    "current_streak",
+    "max_streak",
+    "streak_morning",
+    "max_streak_morning",
+    "streak_evening",
+    "max_streak_evening",
+    "total_brushes_days",
+    "total_brushes_days_morning",
+    "total_brushes_days_evening",
+    "percentage_morning",
+    "percentage_evening",
+)
+
+# Every counter that a brushing session can change. Used with save(update_fields=...)
+SESSION_FIELDS = (
+    "total_brush_time",
+    "current_level",
+    "current_level_xp",
+    "current_streak",
+    "max_streak",
+    "total_brushes",
+    "last_active_date",
+    "last_active_morning",
+    "last_active_evening",
+    "streak_morning",
+    "max_streak_morning",
+    "streak_evening",
+    "max_streak_evening",
+    "total_brushes_morning",
+    "total_brushes_evening",
+    "total_brushes_days",
+    "total_brushes_days_morning",
+    "total_brushes_days_evening",
+    "percentage_morning",
+    "percentage_evening",
+)
+
+
+def session_slot(moment):
+    """
+    Activities are classified into morning (before 12:00 PM) and evening (after 12:00 PM)
+
+    Args:
+        moment (datetime): The time of the brushing session, in the user's local time
+
+    Returns:
+        str: 'morning' or 'evening'
+    """
+    return "morning" if moment.hour < 12 else "evening"
+
+
+def apply_day_streak(user, day):
+    """
+    Updates the user's daily streak based on their last active date.
+
+    Args:
+        user (CustomUser): The user whose counters are updated
+        day (date): The day on which the user brushed their teeth
+
+    Logic:
+        - If the difference between the last active date and the day is exactly one day,
+        the current streak is incremented.
+        - If the difference is more than one day the streak is reset to 1.
+        - Sessions on the same day (or replayed sessions from an earlier day) do not change the streak.
+        - The max streak and last active date are updated at the end.
+    """
+    if user.last_active_date is not None and user.current_streak != 0:
+        if day - user.last_active_date == timedelta(days=1):
+            # 1 day so we up the streak
+            user.current_streak += 1
+            user.total_brushes_days += 1
+        elif day - user.last_active_date > timedelta(days=1):
+            # longer than 1 day so reset the streak
+            user.current_streak = 1
+            user.total_brushes_days += 1
+    else:
+        user.current_streak = 1
+        user.total_brushes_days += 1
+
+    if user.current_streak > user.max_streak:
+        user.max_streak = user.current_streak
+    if user.last_active_date is None or day > user.last_active_date:
+        user.last_active_date = day
+    _apply_percentages(user)
+
+
+def apply_slot_streak(user, moment):
+    """
+    Updates the morning or evening streak of the user, depending on when the session happened.
+
+    Args:
+        user (CustomUser): The user whose counters are updated
+        moment (datetime): The aware time of the brushing session, in the user's local time
+
+    Returns:
+        bool: True if the session continued or restarted the streak, i.e. it is the first session of
+              the slot on a later day than the last one. The views record an activity for the first
+              session of a slot on any day, as told by record_daily_activity
+    """
+    slot = session_slot(moment)
+    last_active = getattr(user, f"last_active_{slot}")
+    streak = getattr(user, f"streak_{slot}")
+    first_of_slot = False
+    # Compare calendar days in the timezone the session happened in
+    days_between = moment.date() - timezone.localtime(last_active, moment.tzinfo).date() if last_active else None
+
+    if last_active is not None and streak != 0:
+        if days_between == timedelta(days=1):
+            streak += 1
+            first_of_slot = True
+        elif days_between > timedelta(days=1):
+            streak = 1
+            first_of_slot = True
+    else:
+        streak = 1
+        first_of_slot = True
+
+    setattr(user, f"streak_{slot}", streak)
+    if streak > getattr(user, f"max_streak_{slot}"):
+        setattr(user, f"max_streak_{slot}", streak)
+    if last_active is None or moment > last_active:
+        setattr(user, f"last_active_{slot}", moment)
+
+    # Like total_brushes_days, only a later day than the last one of the slot counts as a new day
+    if days_between is None or days_between > timedelta(0):
+        setattr(user, f"total_brushes_days_{slot}", getattr(user, f"total_brushes_days_{slot}") + 1)
+    setattr(user, f"total_brushes_{slot}", getattr(user, f"total_brushes_{slot}") + 1)
+    user.total_brushes += 1
+    _apply_percentages(user)
+    return first_of_slot
+
+
+def apply_xp(user, xp_gained):
+    """
+    Adds experience points to the user's current level and carries any overflow into
+    the next levels. The maximum XP of a level is left unchanged.
+
+    Args:
+        user (CustomUser): The user whose counters are updated
+        xp_gained (int): The experience points earned in the session
+    """
+    user.current_level_xp += xp_gained
+    while user.current_level_max_xp > 0 and user.current_level_xp >= user.current_level_max_xp:
+        user.current_level_xp -= user.current_level_max_xp
+        user.current_level += 1
+
+
+def slot_percentage(slot_days, total_days):
+    """
+    Args:
+        slot_days (int): Number of days with a session in the slot (total_brushes_days_morning/evening)
+        total_days (int): Number of days the user has been active (total_brushes_days)
+
+    Returns:
+        float: The share of the active days with a session in the slot, the value of percentage_morning/evening
+    """
+    return min(slot_days / total_days, 1.0) if total_days else 0.0
+
+
+def _apply_percentages(user):
+    user.percentage_morning = slot_percentage(user.total_brushes_days_morning, user.total_brushes_days)
+    user.percentage_evening = slot_percentage(user.total_brushes_days_evening, user.total_brushes_days)
+
+
+def _supports_update_returning(connection):
+    """
+    UPDATE ... RETURNING is available on PostgreSQL and SQLite 3.35+ (MariaDB and MySQL only
+    support it for INSERT/DELETE, if at all)
+    """
+    return connection.vendor in ("postgresql", "sqlite") and (
+        connection.features.can_return_columns_from_insert
+    )
+
+
+def _update_row(instance, values):
+    """
+    Writes the given columns of the instance's row with a single UPDATE statement and copies the
+    values stored by the database back onto the instance.
+    """
+    model = type(instance)
+    queryset = model._default_manager.filter(pk=instance.pk)
+    connection = connections[queryset.db]
+    fields = [model._meta.get_field(name) for name in values]
+
+    if not _supports_update_returning(connection):
+        if not queryset.update(**values):
+            raise model.DoesNotExist
+        instance.refresh_from_db(fields=[field.attname for field in fields])
+        return
+
+    query = queryset.query.chain(sql.UpdateQuery)
+    query.add_update_values(values)
+    update_sql, params = query.get_compiler(queryset.db).as_sql()
+    returning = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.execute(f"{update_sql} RETURNING {returning}", params)
+        row = cursor.fetchone()
+    if row is None:
+        raise model.DoesNotExist
+
+    for field, value in zip(fields, row):
+        # Apply the same conversions the ORM would apply when loading the column
+        column = field.get_col(model._meta.db_table)
+        for converter in connection.ops.get_db_converters(column) + field.get_db_converters(connection):
+            value = converter(value, column, connection)
+        setattr(instance, field.attname, value)
+    instance.reset_dirty_fields(values)
+
+
+def update_user(user, **values):
+    """
+    Writes the given columns of the user's row with a single UPDATE statement and copies the
+    values stored by the database back onto the instance. Counters are written to the user's
+    UserStats row, so an update that only touches counters never rewrites the user row.
+
+    Args:
+        user (CustomUser): The user to update, only its primary key is used to find the row
+        **values: Field names mapped to new values or expressions, e.g. current_level=F("current_level") + 1
+
+    Raises:
+        CustomUser.DoesNotExist/UserStats.DoesNotExist: If the row no longer exists
+
+    Note:
+    -Where the database supports it the stored values are read back with RETURNING, otherwise
+    they are reloaded with a second narrow SELECT
+    """
+    stats_values = {name: value for name, value in values.items() if name in STATS_FIELDS}
+    user_values = {name: value for name, value in values.items() if name not in STATS_FIELDS}
+    if user_values:
+        _update_row(user, user_values)
+    if stats_values:
+        stats = user.get_stats()
+        if stats._state.adding:
+            # The counters were never loaded for this instance
+            stats = user.stats = UserStats.objects.get(pk=user.pk)
+        _update_row(stats, stats_values)
+    # Queryset updates do not send post_save, so the cached copy is dropped here
+    invalidate_users_on_commit([user.pk])
+    return user
+
+
+@contextmanager
+def locked_user(user):
+    """
+    Opens a transaction and loads a fresh copy of the user's counters with SELECT ... FOR UPDATE, so
+    read-modify-write updates of the streaks cannot interleave with another request.
+
+    Args:
+        user (CustomUser): The authenticated user
+
+    Yields:
+        CustomUser: The user with the locked counters, to be saved with update_fields before the block ends
+    """
+    with transaction.atomic():
+        user.stats = UserStats.objects.select_for_update().get(pk=user.pk)
+        yield user
+
+
+def _runs(ordinals, today):
+    """
+    Args:
+        ordinals (list): Sorted day ordinals (date.toordinal()) without duplicates
+        today (int): Ordinal of today
+
+    Returns:
+        tuple: (current run, longest run). The last run only counts as current if it reaches yesterday or today.
+    """
+    longest = run = 0
+    previous = None
+    for ordinal in ordinals:
+        run = run + 1 if previous is not None and ordinal - previous == 1 else 1
+        longest = max(longest, run)
+        previous = ordinal
+    current = run if previous is not None and today - previous <= 1 else 0
+    return current, longest
+
+
+def compute_streaks(days, today):
+    """
+    Recomputes the streak counters of a user from their activity history.
+
+    Args:
+        days (list): (date, slots) pairs from UserDailyActivity, sorted by date, days without a
+                     morning or evening session excluded
+        today (date): The current day, a streak is current if its last day is today or yesterday
+
+    Returns:
+        dict: Values of the RECOMPUTED_FIELDS counters
+    """
+    today = today.toordinal()
+    all_days = [day.toordinal() for day, _ in days]
+    mornings = [day.toordinal() for day, slots in days if slots & UserDailyActivity.MORNING]
+    evenings = [day.toordinal() for day, slots in days if slots & UserDailyActivity.EVENING]
+
+    current_streak, max_streak = _runs(all_days, today)
+    streak_morning, max_streak_morning = _runs(mornings, today)
+    streak_evening, max_streak_evening = _runs(evenings, today)
+    total_days = len(all_days)
+    return {
+        "current_streak": current_streak,
+        "max_streak": max_streak,
+        "streak_morning": streak_morning,
+        "max_streak_morning": max_streak_morning,
+        "streak_evening": streak_evening,
+        "max_streak_evening": max_streak_evening,
+        "total_brushes_days": total_days,
+        "total_brushes_days_morning": len(mornings),
+        "total_brushes_days_evening": len(evenings),
+        "percentage_morning": slot_percentage(len(mornings), total_days),
+        "percentage_evening": slot_percentage(len(evenings), total_days),
+    }
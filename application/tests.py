@@ -1,7 +1,37 @@
-from django.test import TestCase
+import base64
+import cProfile
+import datetime
+import gzip
+import importlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from unittest import mock, skipUnless
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.utils import timezone
+from django.db import OperationalError, connection
+from django.db.backends.utils import CursorWrapper
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient  # Import this for API testing
-from application.models import CustomUser
+from rest_framework_simplejwt.tokens import RefreshToken
+from application import async_views, deletion, hashing, jobs, memory, profiling, throttling
+from application.models import CustomUser, Job, UserActivity, UserActivityYear, UserDailyActivity, UserStats
+from application.tokens import ClaimsToken
 
+@override_settings(THROTTLE_BUCKETS={})
 class Testsignup(TestCase):
     def setUp(self):
         self.client = APIClient()  # Create a test client instance
@@ -205,3 +235,1604 @@ class Testsignup(TestCase):
 
         self.assertEqual(response.status_code, 204)
         self.assertFalse(CustomUser.objects.filter(pk=self.user.id).exists())
+
+
+class TestCompleteSession(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.client.force_authenticate(user=self.user)
+
+    def test_session_updates_all_counters(self):
+        """
+        One call should apply brush time, streaks, the activity and the XP
+        """
+        data = {"duration": 120, "client_timestamp": "2024-04-10T08:15:00+02:00", "xp_gained": 30}
+        response = self.client.post('/application/completeSession/', data)
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_brush_time, 120)
+        self.assertEqual(self.user.current_streak, 1)
+        self.assertEqual(self.user.streak_morning, 1)
+        self.assertEqual(self.user.total_brushes, 1)
+        self.assertEqual(self.user.current_level_xp, 30)
+        self.assertEqual(self.user.activities.get().activity_type, 'morning')
+        self.assertEqual(response.data["total_brush_time"], 120)
+
+    def test_consecutive_days_and_level_up(self):
+        """
+        Sessions on consecutive evenings extend the streaks and XP overflow levels the user up
+        """
+        self.client.post('/application/completeSession/', {"duration": 100, "client_timestamp": "2024-04-10T20:00:00+00:00", "xp_gained": 100})
+        response = self.client.post('/application/completeSession/', {"duration": 100, "client_timestamp": "2024-04-11T20:00:00+00:00", "xp_gained": 50})
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_streak, 2)
+        self.assertEqual(self.user.streak_evening, 2)
+        self.assertEqual(self.user.total_brushes_days, 2)
+        self.assertEqual(self.user.current_level, 2)
+        self.assertEqual(self.user.current_level_xp, 30)
+        self.assertEqual(self.user.activities.count(), 2)
+
+    def test_missing_duration(self):
+        """
+        The duration of the session is required
+        """
+        response = self.client.post('/application/completeSession/', {"xp_gained": 10})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestSyncActivities(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.client.force_authenticate(user=self.user)
+
+    def test_sync_out_of_order_events(self):
+        """
+        Queued events are applied in the order they happened, not the order they were sent
+        """
+        events = [
+            {"duration": 60, "client_timestamp": "2024-04-12T07:30:00+00:00"},
+            {"duration": 60, "client_timestamp": "2024-04-10T07:30:00+00:00"},
+            {"duration": 60, "client_timestamp": "2024-04-11T07:30:00+00:00", "xp_gained": 10},
+            {"duration": 60, "client_timestamp": "2024-04-11T19:30:00+00:00"},
+        ]
+        response = self.client.post('/application/syncActivities/', {"events": events}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_brush_time, 240)
+        self.assertEqual(self.user.current_streak, 3)
+        self.assertEqual(self.user.streak_morning, 3)
+        self.assertEqual(self.user.streak_evening, 1)
+        self.assertEqual(self.user.total_brushes, 4)
+        self.assertEqual(self.user.current_level_xp, 10)
+        self.assertEqual(self.user.last_active_date.isoformat(), "2024-04-12")
+        self.assertEqual(self.user.activities.count(), 4)
+
+    def test_retried_batch_applied_once(self):
+        """
+        A batch sent again after the connection dropped only adds the sessions that were not recorded yet
+        """
+        events = [
+            {"duration": 60, "client_timestamp": "2024-04-10T07:30:00+00:00", "xp_gained": 10},
+            {"duration": 60, "client_timestamp": "2024-04-10T07:45:00+00:00"},
+        ]
+        self.client.post('/application/syncActivities/', {"events": events}, format='json')
+        events.append({"duration": 90, "client_timestamp": "2024-04-10T19:30:00+00:00"})
+        response = self.client.post('/application/syncActivities/', {"events": events}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_brush_time, 210)
+        self.assertEqual(self.user.total_brushes, 3)
+        self.assertEqual(self.user.total_brushes_morning, 2)
+        self.assertEqual(self.user.current_level_xp, 10)
+        # The first morning and the first evening session of the day
+        self.assertEqual(self.user.activities.count(), 2)
+        day = UserDailyActivity.objects.get(user=self.user)
+        self.assertEqual((day.session_count, day.total_seconds), (3, 210))
+
+    def test_older_session_recorded(self):
+        """
+        A session older than the last one of its slot still gets its activity
+        """
+        self.client.post('/application/syncActivities/', {"events": [{"duration": 60, "client_timestamp": "2024-04-12T07:30:00+00:00"}]}, format='json')
+        self.client.post('/application/syncActivities/', {"events": [{"duration": 60, "client_timestamp": "2024-04-10T07:30:00+00:00"}]}, format='json')
+        self.assertEqual(
+            sorted(self.user.activities.values_list("activity_date", flat=True)),
+            [datetime.date(2024, 4, 10), datetime.date(2024, 4, 12)],
+        )
+
+    def test_same_activities_online_and_synced(self):
+        """
+        The same sessions give the same activities whether they were sent one by one or synced later,
+        one per slot and day
+        """
+        events = [
+            {"duration": 60, "client_timestamp": "2024-04-10T07:30:00+00:00"},
+            {"duration": 60, "client_timestamp": "2024-04-10T08:30:00+00:00"},
+            {"duration": 60, "client_timestamp": "2024-04-10T19:30:00+00:00"},
+            {"duration": 60, "client_timestamp": "2024-04-11T07:30:00+00:00"},
+        ]
+        online = CustomUser.objects.create_user(email='online@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        client = APIClient()
+        client.force_authenticate(user=online)
+        for event in events:
+            self.assertEqual(client.post('/application/completeSession/', event).status_code, 200)
+        self.client.post('/application/syncActivities/', {"events": events}, format='json')
+
+        def activities(user):
+            return sorted(user.activities.values_list("activity_date", "activity_time", "activity_type"))
+
+        self.assertEqual(len(activities(self.user)), 3)
+        self.assertEqual(activities(self.user), activities(online))
+
+    def test_sync_writes_rollup_and_calendars(self):
+        """
+        The days of a batch, here across two years, are added to the rollup and the calendars together
+        """
+        UserDailyActivity.objects.create(user=self.user, day=datetime.date(2023, 12, 31), slots=UserDailyActivity.MORNING, session_count=1, total_seconds=30)
+        events = [
+            {"duration": 60, "client_timestamp": "2023-12-31T07:30:00+00:00"},
+            {"duration": 60, "client_timestamp": "2023-12-31T19:30:00+00:00"},
+            {"duration": 90, "client_timestamp": "2024-01-01T07:30:00+00:00"},
+        ]
+        response = self.client.post('/application/syncActivities/', {"events": events}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(UserDailyActivity.objects.filter(user=self.user).order_by("day").values_list("slots", "session_count", "total_seconds")),
+            [(UserDailyActivity.MORNING | UserDailyActivity.EVENING, 3, 150), (UserDailyActivity.MORNING, 1, 90)],
+        )
+        self.assertEqual(self.client.get('/application/activityCalendar/', {"year": 2023}).data["days_active"], 1)
+        calendar = self.client.get('/application/activityCalendar/', {"year": 2024}).data
+        self.assertEqual(base64.b64decode(calendar["morning"])[0], 1)
+
+    def test_sync_requires_timestamps(self):
+        """
+        Queued events must carry the time they happened on the device
+        """
+        response = self.client.post('/application/syncActivities/', {"events": [{"duration": 60}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/application/syncActivities/', {"events": []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestNarrowUpdates(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.client.force_authenticate(user=self.user)
+
+    def test_character_name_single_narrow_update(self):
+        """
+        Changing the character name should not rewrite the rest of the row
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/application/updateCharacterName/', {"new_name": "Sparkle"})
+        self.assertEqual(response.status_code, 200)
+        updates = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn("password", updates[0])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.character_name, "Sparkle")
+        self.assertTrue(self.user.is_char_name_set)
+
+    def test_brush_time_uses_stored_value(self):
+        """
+        The increment is applied to the value in the database, not to the stale request.user
+        """
+        UserStats.objects.filter(pk=self.user.pk).update(total_brush_time=500)
+        response = self.client.post('/application/update_brushtime/', {"added_time": 30})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["total_brush_time"], 530)
+
+    def test_invalid_values(self):
+        """
+        Non numeric values are rejected
+        """
+        response = self.client.post('/application/levelUp/', {"update_level_by": "abc"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/application/miniShop/', {"image_id": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestConcurrentUpdates(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("Needs a database that can be shared between threads")
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+
+    def test_parallel_increments_all_land(self):
+        """
+        N devices adding brush time at the same time should all be counted
+        """
+        requests = 10
+        responses = []
+
+        def post():
+            client = APIClient()
+            client.force_authenticate(user=self.user)
+            responses.append(client.post('/application/update_brushtime/', {"added_time": 10}))
+            connection.close()
+
+        threads = [threading.Thread(target=post) for _ in range(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(all(response.status_code == 200 for response in responses))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_brush_time, requests * 10)
+
+
+class TestDirtyFieldTracking(TestCase):
+    def setUp(self):
+        CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.user = CustomUser.objects.get(email='test@example.com')
+
+    def test_save_writes_changed_columns_only(self):
+        """
+        Only the changed column should be in the UPDATE
+        """
+        self.user.character_name = "Sparkle"
+        with CaptureQueriesContext(connection) as queries:
+            self.user.save()
+        self.assertEqual(len(queries), 1)
+        self.assertIn("character_name", queries[0]["sql"])
+        self.assertNotIn("password", queries[0]["sql"])
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).character_name, "Sparkle")
+
+    def test_save_without_changes_skips_query(self):
+        """
+        Nothing changed so nothing should be sent to the database
+        """
+        with self.assertNumQueries(0):
+            self.user.save()
+        self.user.image_id = 3
+        self.user.save()
+        with self.assertNumQueries(0):
+            self.user.save()
+
+    def test_new_password_is_saved(self):
+        """
+        set_password changes the hash, so it has to be written
+        """
+        self.user.set_password("NewPassword1!")
+        self.user.save()
+        self.assertTrue(CustomUser.objects.get(pk=self.user.pk).check_password("NewPassword1!"))
+
+
+class TestUserStats(TestCase):
+    def setUp(self):
+        cache.clear()  # A user cached by another test can have the same primary key
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D', total_brush_time=50)
+
+    def test_counters_stored_in_stats_table(self):
+        """
+        Creating a user creates its counters row, and the counters are reachable from the user
+        """
+        stats = UserStats.objects.get(pk=self.user.pk)
+        self.assertEqual(stats.total_brush_time, 50)
+        user = CustomUser.objects.get(pk=self.user.pk)
+        user.current_streak = 4
+        user.save()
+        self.assertEqual(UserStats.objects.get(pk=self.user.pk).current_streak, 4)
+
+    def test_authenticated_user_loaded_with_stats(self):
+        """
+        The JWT user load brings the counters with it, so serializing the user needs no extra query
+        """
+        access = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with self.assertNumQueries(1):
+            response = self.client.post('/application/authenticated/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["total_brush_time"], 50)
+
+
+class TestUserActivities(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.client.force_authenticate(user=self.user)
+        start = datetime.date(2024, 4, 1)
+        activities = []
+        for day in range(10):
+            date = start + datetime.timedelta(days=day)
+            activities.append(UserActivity(user=self.user, activity_date=date, activity_type='morning'))
+            if day % 2 == 0:
+                activities.append(UserActivity(user=self.user, activity_date=date, activity_type='evening'))
+        UserActivity.objects.bulk_create(activities)
+        call_command("backfill_daily_activity", stdout=io.StringIO())
+
+    def test_days_collapsed_in_one_query(self):
+        """
+        Days with both sessions are reported as 'both', using a single query
+        """
+        with self.assertNumQueries(1):
+            response = self.client.post('/application/activities/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 10)
+        self.assertEqual(response.data[0]["activity_type"], "both")
+        self.assertEqual(response.data[1]["activity_type"], "morning")
+
+    def test_date_range_and_pages(self):
+        """
+        The calendar can be restricted to a range and fetched page by page
+        """
+        response = self.client.post('/application/activities/', {"from": "2024-04-03", "to": "2024-04-06"})
+        self.assertEqual([str(day["activity_date"]) for day in response.data], ["2024-04-03", "2024-04-04", "2024-04-05", "2024-04-06"])
+        response = self.client.post('/application/activities/', {"after": "2024-04-08", "limit": 5})
+        self.assertEqual([str(day["activity_date"]) for day in response.data], ["2024-04-09", "2024-04-10"])
+        response = self.client.post('/application/activities/', {"from": "not a date"})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestPersonalDataExport(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D', total_brushes=3)
+        self.client.force_authenticate(user=self.user)
+        start = datetime.date(2024, 4, 1)
+        UserActivity.objects.bulk_create(
+            [UserActivity(user=self.user, activity_date=start + datetime.timedelta(days=day), activity_type='morning') for day in range(3000)]
+        )
+        other = CustomUser.objects.create_user(email='other@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        UserActivity.objects.create(user=other, activity_date=start, activity_type='evening')
+
+    def read_lines(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content)
+        if response.get("Content-Encoding") == "gzip":
+            content = gzip.decompress(content)
+        return [json.loads(line) for line in content.decode().splitlines()]
+
+    def test_streams_profile_and_activities(self):
+        with mock.patch("application.exports.STREAM_BLOCK_SIZE", 1024):
+            response = self.client.get('/application/export/')
+            self.assertEqual(response["Content-Type"], "application/x-ndjson")
+            self.assertNotIn("Content-Encoding", response)
+            self.assertGreater(len(list(response.streaming_content)), 1)
+        lines = self.read_lines(self.client.get('/application/export/'))
+        self.assertEqual(lines[0]["type"], "profile")
+        self.assertEqual((lines[0]["email"], lines[0]["total_brushes"]), ('test@example.com', 3))
+        self.assertNotIn("password", lines[0])
+        self.assertEqual(len(lines), 3001)
+        self.assertEqual(lines[1], {"type": "activity", "activity_date": "2024-04-01", "activity_time": None, "activity_type": "morning"})
+        self.assertEqual(lines[-1]["activity_date"], str(datetime.date(2024, 4, 1) + datetime.timedelta(days=2999)))
+
+    def test_gzip(self):
+        response = self.client.get('/application/export/', HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(len(self.read_lines(response)), 3001)
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get('/application/export/').status_code, 401)
+
+
+class TestDailyActivity(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.client.force_authenticate(user=self.user)
+
+    def test_sessions_maintain_rollup(self):
+        """
+        Every session adds to the day's row, and the slots are combined
+        """
+        self.client.post('/application/completeSession/', {"duration": 100, "client_timestamp": "2024-04-10T08:00:00+00:00"})
+        self.client.post('/application/completeSession/', {"duration": 90, "client_timestamp": "2024-04-10T09:00:00+00:00"})
+        self.client.post('/application/completeSession/', {"duration": 80, "client_timestamp": "2024-04-10T20:00:00+00:00"})
+        day = UserDailyActivity.objects.get(user=self.user)
+        self.assertEqual(day.slots, UserDailyActivity.MORNING | UserDailyActivity.EVENING)
+        self.assertEqual(day.session_count, 3)
+        self.assertEqual(day.total_seconds, 270)
+
+    def test_backfill_is_repeatable(self):
+        """
+        Running the backfill twice gives the same rollup
+        """
+        UserActivity.objects.create(user=self.user, activity_date=datetime.date(2024, 4, 1), activity_type='evening')
+        call_command("backfill_daily_activity", stdout=io.StringIO())
+        call_command("backfill_daily_activity", stdout=io.StringIO())
+        day = UserDailyActivity.objects.get(user=self.user)
+        self.assertEqual((day.slots, day.session_count), (UserDailyActivity.EVENING, 1))
+
+
+class TestActivityCalendar(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.client.force_authenticate(user=self.user)
+
+    def test_sessions_set_calendar_bits(self):
+        """
+        Sessions on the 1st, 2nd and 3rd of January set the first three bits of the year
+        """
+        for day in (1, 2, 3):
+            self.client.post('/application/completeSession/', {"duration": 100, "client_timestamp": f"2024-01-0{day}T08:00:00+00:00"})
+        self.client.post('/application/completeSession/', {"duration": 100, "client_timestamp": "2024-01-05T20:00:00+00:00"})
+        response = self.client.get('/application/activityCalendar/', {"year": 2024})
+        self.assertEqual(response.status_code, 200)
+        morning = base64.b64decode(response.data["morning"])
+        evening = base64.b64decode(response.data["evening"])
+        self.assertEqual(len(morning), 46)
+        self.assertEqual(morning[0], 0b111)
+        self.assertEqual(evening[0], 0b10000)
+        self.assertEqual(response.data["days_active"], 4)
+        self.assertEqual(response.data["longest_streak"], 3)
+
+    def test_calendar_only_read_for_a_new_slot(self):
+        """
+        The second session of a slot on a day does not read or lock the year calendar
+        """
+        self.client.post('/application/completeSession/', {"duration": 100, "client_timestamp": "2024-01-01T08:00:00+00:00"})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/application/completeSession/', {"duration": 100, "client_timestamp": "2024-01-01T09:00:00+00:00"})
+        self.assertFalse([query for query in queries if "application_useractivityyear" in query["sql"]])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/application/completeSession/', {"duration": 100, "client_timestamp": "2024-01-01T20:00:00+00:00"})
+        self.assertTrue([query for query in queries if "application_useractivityyear" in query["sql"]])
+        self.assertEqual(UserDailyActivity.objects.get(user=self.user).slots, UserDailyActivity.MORNING | UserDailyActivity.EVENING)
+
+    def test_backfill_builds_calendar(self):
+        """
+        The backfill fills the calendars of existing users
+        """
+        UserActivity.objects.create(user=self.user, activity_date=datetime.date(2023, 12, 31), activity_type='evening')
+        call_command("backfill_daily_activity", stdout=io.StringIO())
+        response = self.client.get('/application/activityCalendar/', {"year": 2023})
+        evening = base64.b64decode(response.data["evening"])
+        self.assertEqual(evening[364 // 8], 1 << (364 % 8))
+        response = self.client.get('/application/activityCalendar/', {"year": 2022})
+        self.assertEqual(response.data["days_active"], 0)
+
+
+class TestRecomputeStreaks(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        today = timezone.localdate()
+        days = [today - datetime.timedelta(days=offset) for offset in (9, 8, 7, 1, 0)]
+        UserDailyActivity.objects.bulk_create(
+            [UserDailyActivity(user=self.user, day=day, slots=UserDailyActivity.MORNING, session_count=1) for day in days]
+        )
+        UserDailyActivity.objects.filter(day=today).update(slots=UserDailyActivity.MORNING | UserDailyActivity.EVENING)
+
+    def test_dry_run_reports_without_writing(self):
+        """
+        The drift is reported but the stored counters are left alone
+        """
+        out = io.StringIO()
+        call_command("recompute_streaks", "--dry-run", "--workers", "1", stdout=out)
+        self.assertIn("Found drift in 1 of 1 users", out.getvalue())
+        self.assertEqual(UserStats.objects.get(pk=self.user.pk).max_streak, 0)
+
+    def test_recompute_fixes_counters(self):
+        """
+        The counters are rebuilt from the rollup
+        """
+        call_command("recompute_streaks", "--workers", "1", stdout=io.StringIO())
+        stats = UserStats.objects.get(pk=self.user.pk)
+        self.assertEqual(stats.current_streak, 2)
+        self.assertEqual(stats.max_streak, 3)
+        self.assertEqual(stats.streak_morning, 2)
+        self.assertEqual(stats.streak_evening, 1)
+        self.assertEqual(stats.total_brushes_days, 5)
+        self.assertAlmostEqual(stats.percentage_evening, 0.2)
+        out = io.StringIO()
+        call_command("recompute_streaks", "--dry-run", "--workers", "1", stdout=out)
+        self.assertIn("Found drift in 0 of 1 users", out.getvalue())
+
+    def test_only_drifted_fields_written(self):
+        call_command("recompute_streaks", "--workers", "1", stdout=io.StringIO())
+        UserStats.objects.filter(pk=self.user.pk).update(streak_evening=5)
+        with CaptureQueriesContext(connection) as queries:
+            call_command("recompute_streaks", "--workers", "1", stdout=io.StringIO())
+        updates = [query["sql"] for query in queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"streak_evening"', updates[0])
+        self.assertNotIn('"current_streak"', updates[0])
+        self.assertEqual(UserStats.objects.get(pk=self.user.pk).streak_evening, 1)
+
+    def test_sessions_agree_with_recompute(self):
+        """
+        The sessions keep the percentages with the same definition as the recomputation, the share of
+        the active days with a session in the slot
+        """
+        user = CustomUser.objects.create_user(email='other@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        start = timezone.localtime().replace(hour=8, minute=0, second=0, microsecond=0) - datetime.timedelta(days=2)
+        hours = (0, 1, 24, 36)  # Two mornings on the first day, a morning and an evening on the second
+        for hour in hours:
+            moment = start + datetime.timedelta(hours=hour)
+            response = client.post('/application/completeSession/', {"duration": 60, "client_timestamp": moment.isoformat()})
+            self.assertEqual(response.status_code, 200)
+        stats = UserStats.objects.get(pk=user.pk)
+        self.assertEqual((stats.total_brushes_morning, stats.total_brushes_days_morning), (3, 2))
+        self.assertAlmostEqual(stats.percentage_morning, 1.0)
+        self.assertAlmostEqual(stats.percentage_evening, 0.5)
+        out = io.StringIO()
+        call_command("recompute_streaks", "--dry-run", "--verbose", "--workers", "1", stdout=out)
+        self.assertNotIn(f"user {user.pk}:", out.getvalue())
+
+    def test_migration_counts_slot_days_from_activities(self):
+        """
+        Migration 0025 runs before backfill_daily_activity, so it counts the days from UserActivity
+        """
+        migration = importlib.import_module("application.migrations.0025_userstats_slot_days")
+        user = CustomUser.objects.create_user(email='other@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        today = timezone.localdate()
+        now = timezone.now()
+        UserActivity.objects.bulk_create([
+            UserActivity(user=user, activity_date=today, activity_time=now, activity_type="morning"),
+            UserActivity(user=user, activity_date=today, activity_time=now + datetime.timedelta(hours=1), activity_type="both"),
+            UserActivity(user=user, activity_date=today - datetime.timedelta(days=1), activity_time=now - datetime.timedelta(days=1), activity_type="evening"),
+        ])
+        UserStats.objects.filter(pk=user.pk).update(total_brushes_days=2)
+        migration.count_slot_days(django_apps, mock.Mock(connection=connection))
+        stats = UserStats.objects.get(pk=user.pk)
+        self.assertEqual((stats.total_brushes_days_morning, stats.total_brushes_days_evening), (1, 2))
+        self.assertAlmostEqual(stats.percentage_morning, 0.5)
+        self.assertAlmostEqual(stats.percentage_evening, 1.0)
+
+
+class TestExpireStreaks(TestCase):
+    def test_only_broken_streaks_reset(self):
+        """
+        Users who brushed yesterday or today keep their streaks, the others are reset
+        """
+        today = timezone.localdate()
+        now = timezone.now()
+        active = CustomUser.objects.create_user(email='active@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        inactive = CustomUser.objects.create_user(email='inactive@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        UserStats.objects.filter(pk=active.pk).update(
+            current_streak=3, streak_morning=3, streak_evening=2, max_streak=3,
+            last_active_date=today - datetime.timedelta(days=1), last_active_morning=now, last_active_evening=now - datetime.timedelta(days=1),
+        )
+        UserStats.objects.filter(pk=inactive.pk).update(
+            current_streak=5, streak_morning=5, streak_evening=4, max_streak=5,
+            last_active_date=today - datetime.timedelta(days=3), last_active_morning=now - datetime.timedelta(days=3), last_active_evening=now - datetime.timedelta(days=3),
+        )
+        call_command("expire_streaks", "--batch-size", "1", stdout=io.StringIO())
+        active_stats = UserStats.objects.get(pk=active.pk)
+        inactive_stats = UserStats.objects.get(pk=inactive.pk)
+        self.assertEqual((active_stats.current_streak, active_stats.streak_morning, active_stats.streak_evening), (3, 3, 2))
+        self.assertEqual((inactive_stats.current_streak, inactive_stats.streak_morning, inactive_stats.streak_evening), (0, 0, 0))
+        self.assertEqual(inactive_stats.max_streak, 5)
+
+    def test_streaks_kept_in_the_users_timezone(self):
+        """
+        At 02:00 UTC it is still the previous afternoon at UTC-10, where a user who brushed the
+        morning before can still keep their streaks
+        """
+        user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        now = datetime.datetime(2026, 1, 3, 2, 0, tzinfo=datetime.timezone.utc)
+        last_morning = datetime.datetime(2026, 1, 1, 8, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=-10)))
+        UserStats.objects.filter(pk=user.pk).update(
+            current_streak=3, streak_morning=3, last_active_date=last_morning.date(), last_active_morning=last_morning,
+        )
+        with mock.patch.object(timezone, "now", return_value=now):
+            call_command("expire_streaks", stdout=io.StringIO())
+        stats = UserStats.objects.get(pk=user.pk)
+        self.assertEqual((stats.current_streak, stats.streak_morning), (3, 3))
+        with mock.patch.object(timezone, "now", return_value=now + datetime.timedelta(days=1)):
+            call_command("expire_streaks", stdout=io.StringIO())
+        stats = UserStats.objects.get(pk=user.pk)
+        self.assertEqual((stats.current_streak, stats.streak_morning), (0, 0))
+
+    def test_update_checks_the_expiry_again(self):
+        """
+        A session recorded between reading a batch and resetting it keeps its streak
+        """
+        user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        UserStats.objects.filter(pk=user.pk).update(current_streak=5, last_active_date=timezone.localdate() - datetime.timedelta(days=5))
+        with CaptureQueriesContext(connection) as queries:
+            call_command("expire_streaks", stdout=io.StringIO())
+        updates = [query["sql"] for query in queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"last_active_date" <', updates[0])
+        self.assertIn('"current_streak" >', updates[0])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}, THROTTLE_BUCKETS={})
+class TestCachedAuthentication(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_cache_hit_runs_no_queries(self):
+        """
+        Only the first request loads the user, the next ones are served without touching the database
+        """
+        with CaptureQueriesContext(connection) as first:
+            self.client.get('/application/isPinSet/')
+        self.assertEqual(len(first), 1)
+        for _ in range(3):
+            with self.assertNumQueries(0):
+                response = self.client.get('/application/isPinSet/')
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.data["is_pin_set"])
+
+    def test_save_invalidates_cached_user(self):
+        """
+        Saving the user or writing through update_user drops the cached copy
+        """
+        self.client.get('/application/isPinSet/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_pin_set = True
+            self.user.save()
+        response = self.client.get('/application/isPinSet/')
+        self.assertTrue(response.data["is_pin_set"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/application/updateCharacterName/', {"new_name": "Brushy"})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/application/isPinSet/')
+        self.assertEqual(len(queries), 1)
+
+    def test_deleted_user_is_rejected(self):
+        """
+        A deleted user is not served from the cache
+        """
+        self.client.get('/application/isPinSet/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        response = self.client.get('/application/isPinSet/')
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}, THROTTLE_BUCKETS={})
+class TestClaimsAuthentication(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.user.character_name = "Brushy"
+        self.user.save()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {ClaimsToken.for_user(self.user)}")
+
+    def test_profile_served_from_claims(self):
+        """
+        A current claims token is authenticated and answered without any query
+        """
+        with self.assertNumQueries(0):
+            response = self.client.get('/application/profile/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["character_name"], "Brushy")
+        with self.assertNumQueries(0):
+            response = self.client.get('/application/isPinSet/')
+        self.assertFalse(response.data["is_pin_set"])
+
+    def test_stale_claims_fall_back_to_user(self):
+        """
+        After the user is saved the claims are no longer trusted and the stored values are returned
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_pin_set = True
+            self.user.save()
+        response = self.client.get('/application/isPinSet/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["is_pin_set"])
+
+    def test_claims_token_rejected_by_other_views(self):
+        """
+        Views that need the full user do not accept claims tokens
+        """
+        response = self.client.post('/application/authenticated/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_refresh_returns_claims(self):
+        """
+        token/refresh/ issues a new claims token together with the access token
+        """
+        refresh = RefreshToken.for_user(self.user)
+        response = self.client.post('/application/token/refresh/', {"refresh": str(refresh)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ClaimsToken(response.data["claims"])["profile"]["character_name"], "Brushy")
+
+
+class TestPasswordHashing(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+
+    def test_new_passwords_use_scrypt(self):
+        self.assertTrue(self.user.password.startswith("scrypt$"))
+
+    def test_old_hash_upgraded_on_sign_in(self):
+        """
+        A PBKDF2 hash is replaced with the preferred hasher the next time the user signs in
+        """
+        CustomUser.objects.filter(pk=self.user.pk).update(password=make_password('testpassword1!D', hasher="pbkdf2_sha256"))
+        response = self.client.post('/application/signin/', {"email": "test@example.com", "password": 'testpassword1!D'})
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("scrypt$"))
+        self.assertTrue(self.user.check_password('testpassword1!D'))
+
+    def test_hash_upgraded_when_parameters_change(self):
+        """
+        Changing the configured work factor rehashes the password on the next successful check
+        """
+        with override_settings(PASSWORD_HASH_PARAMS={"scrypt": {"work_factor": 2**12}}):
+            self.assertTrue(self.user.check_password('testpassword1!D'))
+            self.user.refresh_from_db()
+            self.assertTrue(self.user.password.startswith("scrypt$4096$"))
+
+    def test_calibrate_hasher(self):
+        out = io.StringIO()
+        call_command("calibrate_hasher", "--algorithm", "scrypt", "--budget-ms", "10000", "--max-memory-mb", "2", "--samples", "1", stdout=out)
+        self.assertIn("SCRYPT_WORK_FACTOR=2048", out.getvalue())
+        self.assertIn("logins/sec per core", out.getvalue())
+
+
+class TestHashingPool(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+
+    def test_sign_in_through_pool(self):
+        response = self.client.post('/application/reauthenticate/', {"email": "test@example.com", "password": 'testpassword1!D'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/application/reauthenticate/', {"email": "test@example.com", "password": 'wrongpassword1!D'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_full_queue_sheds_with_503(self):
+        """
+        When every hashing slot is taken new sign ins are refused at once instead of waiting
+        """
+        _, slots = hashing._get_executor()
+        held = 0
+        while slots.acquire(blocking=False):
+            held += 1
+        try:
+            response = self.client.post('/application/signin/', {"email": "test@example.com", "password": 'testpassword1!D'})
+        finally:
+            for _ in range(held):
+                slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+
+    @override_settings(PASSWORD_HASH_WORKERS=0)
+    def test_inline_hashing(self):
+        self.assertTrue(hashing.verify_password(self.user, 'testpassword1!D'))
+        self.assertTrue(hashing.hash_password('testpassword1!D').startswith("scrypt$"))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}, THROTTLE_BUCKETS={})
+class TestAsyncViews(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = AsyncRequestFactory()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.auth = {"headers": {"Authorization": f"Bearer {RefreshToken.for_user(self.user).access_token}"}}
+        UserDailyActivity.objects.create(user=self.user, day=datetime.date(2024, 3, 1), slots=UserDailyActivity.MORNING, session_count=1)
+
+    async def test_is_signed_in(self):
+        request = self.factory.post('/application/authenticated/', **self.auth)
+        response = await async_views.AsyncIsSignedIn.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["email"], 'test@example.com')
+
+    async def test_missing_token_rejected(self):
+        request = self.factory.get('/application/isPinSet/')
+        response = await async_views.AsyncCheckIfPinIsSet.as_view()(request)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_activities_match_sync_view(self):
+        request = self.factory.post('/application/activities/', {"from": "2024-01-01"}, content_type="application/json", **self.auth)
+        response = await async_views.AsyncUserActivities.as_view()(request)
+        self.assertEqual(json.loads(response.content), [{"activity_date": "2024-03-01", "activity_type": "morning"}])
+
+    async def test_update_level(self):
+        request = self.factory.post('/application/levelUp/', {"update_level_by": 2}, content_type="application/json", **self.auth)
+        response = await async_views.AsyncUpdateLevel.as_view()(request)
+        self.assertEqual(json.loads(response.content)["current_level"], 3)
+        stats = await UserStats.objects.aget(pk=self.user.pk)
+        self.assertEqual(stats.current_level, 3)
+
+    async def test_body_must_be_an_object(self):
+        for body in ('[1, 2]', '"2"', '{'):
+            request = self.factory.post('/application/levelUp/', body, content_type="application/json", **self.auth)
+            response = await async_views.AsyncUpdateLevel.as_view()(request)
+            self.assertEqual(response.status_code, 400)
+
+
+class TestThrottling(TestCase):
+    def setUp(self):
+        caches[settings.THROTTLE_CACHE].clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+
+    @override_settings(THROTTLE_BUCKETS={"auth": {"user": "2/min", "ip": "100/min"}})
+    def test_sign_in_limited_per_account(self):
+        """
+        Only a burst of 2 attempts per account, the next one is refused with Retry-After
+        """
+        credentials = {"email": "test@example.com", "password": 'wrongpassword1!D'}
+        for _ in range(2):
+            self.assertEqual(self.client.post('/application/signin/', credentials).status_code, 400)
+        response = self.client.post('/application/signin/', credentials)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response["Retry-After"]), 0)
+        # Another account from the same address still has its own budget
+        response = self.client.post('/application/signin/', {"email": "other@example.com", "password": 'wrongpassword1!D'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(THROTTLE_BUCKETS={"default": {"user": "3/min"}})
+    def test_user_bucket_refills(self):
+        self.client.force_authenticate(user=self.user)
+        start = 1700000040.0  # The start of a minute
+        with mock.patch("application.throttling.BucketThrottle.timer", return_value=start):
+            for _ in range(3):
+                self.assertEqual(self.client.get('/application/isPinSet/').status_code, 200)
+            response = self.client.get('/application/isPinSet/')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(int(response["Retry-After"]), 80)
+        # 20 seconds into the next minute, 2 of the previous minute's requests still count
+        with mock.patch("application.throttling.BucketThrottle.timer", return_value=start + 80):
+            self.assertEqual(self.client.get('/application/isPinSet/').status_code, 200)
+            response = self.client.get('/application/isPinSet/')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(int(response["Retry-After"]), 20)
+
+    @override_settings(THROTTLE_BUCKETS={"default": {"global": "5/min"}})
+    def test_concurrent_requests(self):
+        """
+        Requests counted at the same time never get more than the budget between them
+        """
+        throttle = throttling.GlobalBucketThrottle()
+        request = RequestFactory().get('/application/isPinSet/')
+        view = mock.Mock(throttle_scope="default")
+        barrier = threading.Barrier(20)
+        allowed = []
+
+        def send():
+            barrier.wait()
+            allowed.append(throttle.allow_request(request, view))
+
+        threads = [threading.Thread(target=send) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(allowed.count(True), 5)
+
+    @override_settings(THROTTLE_BUCKETS={"default": {"global": "1/min"}}, THROTTLE_CACHE="unavailable")
+    def test_fallback_cache(self):
+        """
+        Without the shared cache the buckets are kept in memory instead of failing the request
+        """
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get('/application/isPinSet/').status_code, 200)
+        self.assertEqual(self.client.get('/application/isPinSet/').status_code, 429)
+
+
+@override_settings(THROTTLE_BUCKETS={}, QUERY_COUNT_HEADER=True)
+class TestQueryCountMiddleware(TestCase):
+    def setUp(self):
+        self.client = APIClient()  # Loads the middleware with QUERY_COUNT_HEADER set
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.client.force_authenticate(user=self.user)
+
+    def test_headers(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/application/levelUp/', {"update_level_by": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response["X-DB-Queries"]), len(queries))
+        self.assertGreaterEqual(float(response["X-DB-Time"]), 0)
+
+    @override_settings(QUERY_COUNT_HEADER=False)
+    def test_disabled(self):
+        response = APIClient().post('/application/signin/', {"email": "test@example.com", "password": 'wrongpassword1!D'})
+        self.assertNotIn("X-DB-Queries", response)
+
+    @override_settings(
+        MIDDLEWARE=[name for name in settings.MIDDLEWARE if "whitenoise" not in name],
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    )
+    async def test_async_requests(self):
+        """
+        Under ASGI, where WhiteNoise is left out of the middleware, no middleware hands the request to a
+        thread and back, and the queries the view runs in a thread are still counted
+        """
+        await cache.aclear()
+        with self.assertNoLogs("django.request", "DEBUG"):
+            ASGIHandler().load_middleware(is_async=True)
+        access = RefreshToken.for_user(self.user).access_token
+        response = await AsyncClient().post("/application/levelUp/", {"update_level_by": 1}, content_type="application/json", headers={"Authorization": f"Bearer {access}"})
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(int(response["X-DB-Queries"]), 0)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    THROTTLE_BUCKETS={},
+    PASSWORD_HASH_WORKERS=0,
+)
+class TestQueryBudgets(TestCase):
+    """
+    Pins the number of queries and the maximum number of rows fetched by every view, for a user with
+    three years of history (and another user with the same history), so that an N+1, an extra save()
+    or a scan of the whole history fails the build. The user cache is empty at the start of each
+    test, so the budgets include loading the user from the token.
+    """
+
+    HISTORY_DAYS = 3 * 365
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        cls.other = CustomUser.objects.create_user(email='other@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        start = timezone.localdate() - datetime.timedelta(days=cls.HISTORY_DAYS)
+        activities = []
+        for user in (cls.user, cls.other):
+            for day in range(cls.HISTORY_DAYS):
+                date = start + datetime.timedelta(days=day)
+                activities.append(UserActivity(user=user, activity_date=date, activity_type='morning'))
+                activities.append(UserActivity(user=user, activity_date=date, activity_type='evening'))
+        UserActivity.objects.bulk_create(activities, batch_size=1000)
+        call_command("backfill_daily_activity", stdout=io.StringIO())
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.refresh.access_token}")
+
+    @contextmanager
+    def assertQueryBudget(self, queries, rows):
+        """
+        Fails if the block does not run exactly the given number of queries, or fetches more rows
+        """
+        fetched = []
+
+        def counting(name):
+            def fetch(cursor_wrapper, *args):
+                result = getattr(cursor_wrapper.cursor, name)(*args)
+                if name == "fetchone":
+                    fetched.append(int(result is not None))
+                else:
+                    fetched.append(len(result))
+                return result
+
+            return fetch
+
+        with ExitStack() as stack:
+            for name in ("fetchone", "fetchmany", "fetchall"):
+                stack.enter_context(mock.patch.object(CursorWrapper, name, counting(name), create=True))
+            captured = stack.enter_context(CaptureQueriesContext(connection))
+            yield
+        sql = "\n".join(query["sql"] for query in captured)
+        self.assertEqual(len(captured), queries, f"Queries run:\n{sql}")
+        self.assertLessEqual(sum(fetched), rows, f"Queries run:\n{sql}")
+
+    def test_signup(self):
+        data = {
+            "first_name": "Test", "last_name": "User", "email": "new@example.com", "password": "password1!D",
+            "total_brush_time": 0, "current_level": 1, "current_level_xp": 0, "current_level_max_xp": 120,
+            "character_name": "Brushy", "image_id": 1, "current_streak": 0, "max_streak": 0, "total_brushes": 0,
+        }
+        with self.assertQueryBudget(queries=3, rows=1):
+            response = APIClient().post('/application/signup/', data)
+        self.assertEqual(response.status_code, 201)
+
+    def test_signin(self):
+        with self.assertQueryBudget(queries=1, rows=1):
+            response = APIClient().post('/application/signin/', {"email": "test@example.com", "password": 'testpassword1!D'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_reauthenticate(self):
+        with self.assertQueryBudget(queries=1, rows=1):
+            response = APIClient().post('/application/reauthenticate/', {"email": "test@example.com", "password": 'testpassword1!D'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_token_refresh(self):
+        with self.assertQueryBudget(queries=1, rows=1):
+            response = APIClient().post('/application/token/refresh/', {"refresh": str(self.refresh)})
+        self.assertEqual(response.status_code, 200)
+
+    def test_authenticated(self):
+        with self.assertQueryBudget(queries=1, rows=1):
+            response = self.client.post('/application/authenticated/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_reads(self):
+        """
+        Answered from the claims token alone
+        """
+        claims = ClaimsToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {claims}")
+        with self.assertQueryBudget(queries=0, rows=0):
+            self.assertEqual(self.client.get('/application/isPinSet/').status_code, 200)
+            self.assertEqual(self.client.get('/application/profile/').status_code, 200)
+
+    def test_pin(self):
+        with self.captureOnCommitCallbacks(execute=True), self.assertQueryBudget(queries=2, rows=2):
+            response = self.client.post('/application/setPin/', {"parent_pin": "123456"})
+        self.assertEqual(response.status_code, 200)
+        with self.assertQueryBudget(queries=1, rows=1):
+            response = self.client.post('/application/checkPin/', {"parent_pin": "123456"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_counter_updates(self):
+        """
+        The user, then a single UPDATE ... RETURNING (update_brushtime also adds the time to the day's row)
+        """
+        updates = [
+            ('/application/update_brushtime/', {"added_time": 120}, 8, 3),
+            ('/application/levelUp/', {"update_level_by": 1}, 2, 2),
+            ('/application/updateUserXP/', {"current_level_xp": 10}, 2, 2),
+            ('/application/updateCurrentLevelMaxXP/', {"current_level_max_xp": 120}, 2, 2),
+            ('/application/miniShop/', {"image_id": 2}, 2, 2),
+            ('/application/updateCharacterName/', {"new_name": "Brushy"}, 2, 2),
+        ]
+        for path, data, queries, rows in updates:
+            cache.clear()
+            with self.subTest(path=path), self.assertQueryBudget(queries=queries, rows=rows):
+                response = self.client.post(path, data)
+                self.assertEqual(response.status_code, 200)
+
+    def test_update_streak(self):
+        with self.assertQueryBudget(queries=5, rows=2):
+            response = self.client.post('/application/updateStreak/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_activity(self):
+        with self.assertQueryBudget(queries=13, rows=5):
+            response = self.client.post('/application/updateActivity/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_complete_session(self):
+        with self.assertQueryBudget(queries=13, rows=5):
+            response = self.client.post('/application/completeSession/', {"duration": 120, "xp_gained": 10})
+        self.assertEqual(response.status_code, 200)
+        # Another session of the same slot and day neither records an activity nor reads the calendar
+        cache.clear()
+        with self.assertQueryBudget(queries=7, rows=3):
+            response = self.client.post('/application/completeSession/', {"duration": 120, "xp_gained": 10})
+        self.assertEqual(response.status_code, 200)
+
+    def test_sync_activities(self):
+        """
+        The same number of queries whatever the number of days in the batch, here days without history
+        that all get their activities and calendar bits. Only the rows of the batch's days are read.
+        """
+        for year, days in ((2020, 3), (2021, 100)):
+            start = datetime.datetime(year, 1, 1, tzinfo=datetime.timezone.utc)
+            events = [
+                {"duration": 120, "client_timestamp": (start + datetime.timedelta(days=day, hours=hour)).isoformat()}
+                for day in range(days)
+                for hour in (8, 20)
+            ]
+            cache.clear()
+            with self.subTest(days=days), self.assertQueryBudget(queries=14, rows=2 * days + 3):
+                response = self.client.post('/application/syncActivities/', {"events": events}, format="json")
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual(UserActivity.objects.filter(user=self.user, activity_date__year=year).count(), 2 * days)
+
+    def test_activities(self):
+        """
+        Only the requested page of the rollup is read, not the whole history
+        """
+        with self.assertQueryBudget(queries=2, rows=32):
+            response = self.client.post('/application/activities/', {"limit": 31})
+        self.assertEqual(len(response.data), 31)
+
+    def test_activity_calendar(self):
+        with self.assertQueryBudget(queries=2, rows=2):
+            response = self.client.get('/application/activityCalendar/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_signout(self):
+        with self.assertQueryBudget(queries=1, rows=1):
+            response = self.client.post('/application/signout/', {"refresh": str(self.refresh)})
+        self.assertEqual(response.status_code, 200)
+
+    def test_delete(self):
+        """
+        The account is only deactivated and a job purging its history is queued, in one transaction
+        """
+        with self.assertQueryBudget(queries=5, rows=3):
+            response = self.client.post('/application/delete/')
+        self.assertEqual(response.status_code, 204)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}, THROTTLE_BUCKETS={})
+class TestAccountDeletion(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        start = datetime.date(2024, 4, 1)
+        UserActivity.objects.bulk_create(
+            [UserActivity(user=self.user, activity_date=start + datetime.timedelta(days=day), activity_type='morning') for day in range(25)]
+        )
+        call_command("backfill_daily_activity", stdout=io.StringIO())
+        self.other = CustomUser.objects.create_user(email='other@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        UserActivity.objects.create(user=self.other, activity_date=start, activity_type='evening')
+
+    def test_delete_deactivates_at_once(self):
+        self.assertEqual(self.client.post('/application/authenticated/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/application/delete/')
+        self.assertEqual(response.status_code, 204)
+        user = CustomUser.objects.get(pk=self.user.pk)
+        self.assertFalse(user.is_active)
+        self.assertIsNotNone(user.deletion_requested_at)
+        self.assertEqual(UserActivity.objects.filter(user=self.user).count(), 25)
+        self.assertEqual(self.client.post('/application/authenticated/').status_code, 401)
+        self.client.credentials()
+        response = self.client.post('/application/signin/', {"email": "test@example.com", "password": 'testpassword1!D'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_purge_in_batches(self):
+        self.assertIsNone(deletion.purge_user(self.user.pk))
+        deletion.request_deletion(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            stdout = io.StringIO()
+            call_command("purge_deleted_users", "--batch-size", "10", stdout=stdout)
+        self.assertIn("Purged 1 accounts", stdout.getvalue())
+        deletes = [query["sql"] for query in queries if query["sql"].startswith('DELETE FROM "application_useractivity"')]
+        # Three batches, then the cascade of the user row, which finds nothing left
+        self.assertEqual(len(deletes), 4)
+        self.assertFalse(CustomUser.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(UserActivity.objects.filter(user_id=self.user.pk).exists())
+        self.assertFalse(UserDailyActivity.objects.filter(user_id=self.user.pk).exists())
+        self.assertFalse(UserActivityYear.objects.filter(user_id=self.user.pk).exists())
+        self.assertFalse(UserStats.objects.filter(pk=self.user.pk).exists())
+        self.assertEqual(UserActivity.objects.filter(user=self.other).count(), 1)
+
+    @skipUnless(os.environ.get("LARGE_TESTS"), "set LARGE_TESTS=1 to run the tests with a million rows")
+    def test_million_activities(self):
+        """
+        Deleting an account with a million activities answers at once, the purge deletes them in batches
+        """
+        start = timezone.make_aware(datetime.datetime(2000, 1, 1))
+        activities = (
+            UserActivity(user=self.user, activity_time=start + datetime.timedelta(minutes=minute), activity_type='morning')
+            for minute in range(1_000_000)
+        )
+        UserActivity.objects.bulk_create(activities, batch_size=10000)
+
+        began = time.perf_counter()
+        with self.assertNumQueries(5):
+            response = self.client.post('/application/delete/')
+        self.assertEqual(response.status_code, 204)
+        self.assertLess(time.perf_counter() - began, 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            call_command("purge_deleted_users", "--batch-size", "10000", stdout=io.StringIO())
+        deletes = [query["sql"] for query in queries if query["sql"].startswith('DELETE FROM "application_useractivity"')]
+        # 1,000,025 rows with those of setUp: 101 batches, then the cascade of the user row
+        self.assertEqual(len(deletes), 102)
+        self.assertFalse(CustomUser.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(UserActivity.objects.filter(user_id=self.user.pk).exists())
+
+
+@override_settings(JOB_MAX_ATTEMPTS=3, JOB_RETRY_DELAY=10, JOB_RETRY_MAX_DELAY=15)
+class TestJobs(TestCase):
+    def setUp(self):
+        self.ran = []
+        tasks = mock.patch.dict(jobs.TASKS, {"record": lambda value: self.ran.append(value), "fail": self.fail_task})
+        tasks.start()
+        self.addCleanup(tasks.stop)
+
+    def fail_task(self):
+        raise ValueError("boom")
+
+    def run_worker(self, *args):
+        stdout = io.StringIO()
+        call_command("run_jobs", "--burst", "--concurrency", "1", *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_jobs_run_in_order_and_are_deleted(self):
+        later = jobs.enqueue("record", {"value": 2})
+        jobs.enqueue("record", {"value": 1}, run_at=later.run_at - datetime.timedelta(seconds=1))
+        jobs.enqueue("record", {"value": 3}, run_at=timezone.now() + datetime.timedelta(hours=1))
+        self.assertIn("2 jobs run: 2 done, 0 retried, 0 failed", self.run_worker())
+        self.assertEqual(self.ran, [1, 2])
+        self.assertEqual(list(Job.objects.values_list("payload", flat=True)), [{"value": 3}])
+        with self.assertRaises(KeyError):
+            jobs.enqueue("unknown")
+
+    def test_worker_survives_database_errors(self):
+        jobs.enqueue("record", {"value": 1})
+        claim = jobs.claim_jobs
+        failures = [OperationalError("database is locked")]
+
+        def flaky_claim(worker, limit=1):
+            if failures:
+                raise failures.pop()
+            return claim(worker, limit)
+
+        with mock.patch("application.management.commands.run_jobs.claim_jobs", flaky_claim):
+            stdout, stderr = io.StringIO(), io.StringIO()
+            call_command("run_jobs", "--burst", "--concurrency", "1", "--poll-interval", "0", stdout=stdout, stderr=stderr)
+        self.assertIn("worker-1: database is locked", stderr.getvalue())
+        self.assertIn("1 jobs run: 1 done", stdout.getvalue())
+        self.assertEqual(self.ran, [1])
+
+    def test_retries_with_backoff_then_fails(self):
+        job = jobs.enqueue("fail")
+        delays = []
+        for attempt in range(1, 4):
+            before = timezone.now()
+            self.run_worker()
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempt)
+            self.assertIn("ValueError: boom", job.last_error)
+            if attempt < 3:
+                self.assertEqual(job.status, Job.QUEUED)
+                delays.append(round((job.run_at - before).total_seconds()))
+                Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertEqual(delays, [10, 15])
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("0 jobs run", self.run_worker())
+
+    def test_claimed_once(self):
+        jobs.enqueue("record", {"value": 1})
+        claimed = jobs.claim_jobs("worker-1", limit=5)
+        self.assertEqual([job.locked_by for job in claimed], ["worker-1"])
+        self.assertEqual(jobs.claim_jobs("worker-2", limit=5), [])
+
+    @override_settings(JOB_LOCK_TIMEOUT=60)
+    def test_stale_jobs_requeued(self):
+        lost = jobs.enqueue("record", {"value": 1})
+        last = jobs.enqueue("record", {"value": 2}, max_attempts=1)
+        jobs.claim_jobs("worker-1", limit=2)
+        self.assertEqual(jobs.requeue_stale_jobs(), 0)
+        Job.objects.update(locked_at=timezone.now() - datetime.timedelta(minutes=5))
+        self.assertEqual(jobs.requeue_stale_jobs(), 2)
+        self.assertEqual(Job.objects.get(pk=lost.pk).status, Job.QUEUED)
+        self.assertEqual(Job.objects.get(pk=last.pk).status, Job.FAILED)
+
+    def test_metrics(self):
+        from prometheus_client import REGISTRY
+
+        def runs(outcome):
+            return REGISTRY.get_sample_value("jobs_processed_total", {"task": "record", "outcome": outcome}) or 0
+
+        before = runs("done")
+        jobs.enqueue("record", {"value": 1})
+        self.run_worker()
+        self.assertEqual(runs("done"), before + 1)
+
+    def test_deleted_account_purged_by_worker(self):
+        user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        UserActivity.objects.create(user=user, activity_date=datetime.date(2024, 4, 1), activity_type='morning')
+        deletion.request_deletion(user)
+        self.assertEqual(Job.objects.get().payload, {"user_id": user.pk})
+        with mock.patch.dict(jobs.TASKS, {"purge_user": deletion.purge_user}):
+            self.run_worker()
+        self.assertFalse(CustomUser.objects.filter(pk=user.pk).exists())
+        self.assertFalse(Job.objects.exists())
+
+
+class TestJobWorkerConcurrency(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("Needs a database that can be shared between threads")
+
+    def test_each_job_runs_once(self):
+        ran = []
+        lock = threading.Lock()
+
+        def record(value):
+            time.sleep(0.01)
+            with lock:
+                ran.append(value)
+
+        with mock.patch.dict(jobs.TASKS, {"record": record}):
+            for value in range(40):
+                jobs.enqueue("record", {"value": value})
+            stdout = io.StringIO()
+            call_command("run_jobs", "--burst", "--concurrency", "4", stdout=stdout)
+        self.assertEqual(sorted(ran), list(range(40)))
+        self.assertIn("40 jobs run: 40 done", stdout.getvalue())
+        self.assertFalse(Job.objects.exists())
+
+
+@override_settings(THROTTLE_BUCKETS={}, METRICS_ENABLED=True, METRICS_TOKEN="scraper-token")
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.client.force_authenticate(user=self.user)
+
+    def sample(self, name, **labels):
+        from prometheus_client import REGISTRY
+
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_request_recorded_per_view(self):
+        labels = {"view": "update_level", "method": "POST"}
+        before = self.sample("api_request_duration_seconds_count", **labels)
+        ok_before = self.sample("api_responses_total", status="200", **labels)
+        queries_before = self.sample("api_db_queries_sum", view="update_level")
+        serializer_before = self.sample("api_serializer_duration_seconds_sum", view="update_level")
+        response = self.client.post('/application/levelUp/', {"update_level_by": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.sample("api_request_duration_seconds_count", **labels), before + 1)
+        self.assertEqual(self.sample("api_responses_total", status="200", **labels), ok_before + 1)
+        self.assertGreaterEqual(self.sample("api_db_queries_sum", view="update_level"), queries_before + 1)
+        self.assertGreater(self.sample("api_serializer_duration_seconds_sum", view="update_level"), serializer_before)
+        self.assertGreater(self.sample("api_response_size_bytes_sum", view="update_level"), 0)
+
+    def test_endpoint_needs_token(self):
+        self.client.post('/application/levelUp/', {"update_level_by": 1})
+        self.assertEqual(self.client.get('/application/metrics/').status_code, 401)
+        response = self.client.get('/application/metrics/', HTTP_AUTHORIZATION="Bearer scraper-token")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('api_request_duration_seconds_count{method="POST",view="update_level"}', response.content.decode())
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_endpoint_disabled_without_token(self):
+        self.assertEqual(self.client.get('/application/metrics/').status_code, 404)
+
+
+@override_settings(THROTTLE_BUCKETS={})
+class TestProfiling(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_override = override_settings(PROFILE_DIR=directory, PROFILE_MAX_FILES=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.staff = APIClient()
+        self.staff.force_authenticate(user=CustomUser.objects.create_user(email='staff@example.com',first_name="test",last_name="test", password='testpassword1!D', is_staff=True))
+
+    def test_signed_header_profiles_request(self):
+        token = self.staff.post('/application/profiling/token/').data["value"]
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/application/levelUp/', {"update_level_by": 1}, HTTP_X_PROFILE=token)
+        name = response["X-Profile-Id"]
+        self.assertIn("update_level", name)
+        self.assertEqual([profile["name"] for profile in self.staff.get('/application/profiling/').data], [name])
+
+        report = self.staff.get(f'/application/profiling/{name}/', {"output": "text", "sort": "tottime"})
+        self.assertEqual(report.status_code, 200)
+        self.assertIn("function calls", report.content.decode())
+        download = self.staff.get(f'/application/profiling/{name}/')
+        self.assertEqual(download.status_code, 200)
+        self.assertGreater(len(b"".join(download.streaming_content)), 0)
+
+    def test_unsigned_header_not_profiled(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/application/levelUp/', {"update_level_by": 1}, HTTP_X_PROFILE="forged")
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(self.staff.get('/application/profiling/').data, [])
+
+    def test_sampling_keeps_newest_files(self):
+        with override_settings(PROFILE_SAMPLE_RATE=1.0):
+            for _ in range(3):
+                self.client.post('/application/signin/', {"email": "test@example.com", "password": 'wrongpassword1!D'})
+        self.assertEqual(len(self.staff.get('/application/profiling/').data), 2)
+
+    @override_settings(
+        MIDDLEWARE=[name for name in settings.MIDDLEWARE if "whitenoise" not in name],
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    )
+    async def test_async_request_profiled(self):
+        """
+        Under ASGI the request is profiled in the event loop thread
+        """
+        await cache.aclear()
+        token = profiling.make_profile_token()
+        access = RefreshToken.for_user(self.user).access_token
+        response = await AsyncClient().post(
+            "/application/levelUp/",
+            {"update_level_by": 1},
+            content_type="application/json",
+            headers={"Authorization": f"Bearer {access}", "X-Profile": token},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("update_level", response["X-Profile-Id"])
+        self.assertEqual([profile["name"] for profile in profiling.list_profiles()], [response["X-Profile-Id"]])
+
+    def test_pruning_tolerates_removed_files(self):
+        """
+        An old profile already removed by another worker does not fail the request
+        """
+        gone = {"name": "20240101T000000-gone-1-0123abcd.prof", "size": 0, "created": 0}
+        with mock.patch("application.profiling.list_profiles", return_value=[gone] * 3):
+            self.assertTrue(profiling.save_profile(cProfile.Profile(), "view").endswith(".prof"))
+
+    def test_staff_only(self):
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.post('/application/profiling/token/').status_code, 403)
+        self.assertEqual(self.client.get('/application/profiling/').status_code, 403)
+        self.assertEqual(self.staff.get('/application/profiling/..%2Fsecret.prof/').status_code, 404)
+
+
+@override_settings(THROTTLE_BUCKETS={})
+class TestMemoryProfile(TestCase):
+    def setUp(self):
+        self.addCleanup(memory.stop_tracing)
+        self.client = APIClient()
+        self.client.force_authenticate(user=CustomUser.objects.create_user(email='staff@example.com',first_name="test",last_name="test", password='testpassword1!D', is_staff=True))
+
+    def test_report_since_baseline(self):
+        self.assertEqual(self.client.get('/application/memory/').status_code, 400)
+        self.assertEqual(self.client.post('/application/memory/', {"action": "start", "frames": 5}).status_code, 200)
+        retained = [bytearray(1024) for _ in range(100)]
+        response = self.client.get('/application/memory/', {"limit": 100})
+        self.assertEqual(response.status_code, 200)
+        growth = {group["module"]: group["size_diff"] for group in response.data["modules"]}
+        self.assertGreaterEqual(growth.get(__name__, 0), 100 * 1024)
+        response = self.client.get('/application/memory/', {"limit": 5})
+        self.assertLessEqual(len(response.data["modules"]), 5)
+        self.assertLessEqual(len(response.data["sites"]), 5)
+        del retained
+        self.assertEqual(self.client.post('/application/memory/', {"action": "stop"}).status_code, 200)
+        self.assertEqual(self.client.post('/application/memory/', {"action": "baseline"}).status_code, 400)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(user=CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D'))
+        self.assertEqual(self.client.get('/application/memory/').status_code, 403)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}},
+    THROTTLE_BUCKETS={},
+    PASSWORD_HASH_WORKERS=0,
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class TestMemoryGrowth(TransactionTestCase):
+    """
+    Repeated requests to each endpoint must not keep memory: after warming up, REQUESTS more requests
+    may retain at most THRESHOLD bytes (a leak of 150 bytes per request is above it).
+
+    The requests go through WSGIHandler like in a gunicorn worker, the test client and TestCase's
+    transaction keep references of their own between requests.
+
+    Allocations made in the database backends are left out: the driver keeps a cache of statements
+    (every savepoint name is a new one) and its cursors on the connection, bounded but larger than the
+    warm-up. They are dropped when the request closes the connection, except on the in-memory SQLite
+    test database, whose connection is kept for the whole run.
+    """
+
+    IGNORED = (tracemalloc.Filter(False, "*/django/db/backends/*"),)
+
+    REQUESTS = 30
+    THRESHOLD = 4096
+
+    def setUp(self):
+        cache.clear()
+        self.handler = WSGIHandler()
+        self.factory = RequestFactory()
+        self.user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        self.refresh = RefreshToken.for_user(self.user)
+        self.access = str(self.refresh.access_token)
+        start = datetime.date(2024, 1, 1)
+        UserActivity.objects.bulk_create(
+            UserActivity(user=self.user, activity_date=start + datetime.timedelta(days=day), activity_type='morning')
+            for day in range(365)
+        )
+        call_command("backfill_daily_activity", stdout=io.StringIO())
+
+    def send(self, method, path, data=None, token=None):
+        """
+        Returns the status code of the request, sent to the WSGI handler
+        """
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"} if token else {}
+        if method == "GET":
+            request = self.factory.get(path, data, **headers)
+        else:
+            request = self.factory.post(path, json.dumps(data or {}), content_type="application/json", **headers)
+        statuses = []
+        response = self.handler(request.environ, lambda status, headers: statuses.append(status))
+        b"".join(response)
+        response.close()
+        return int(statuses[0].split()[0])
+
+    def assertNoGrowth(self, send):
+        for _ in range(5):
+            send()
+        memory.start_tracing(10)
+        self.addCleanup(memory.stop_tracing)
+        before = memory.take_snapshot()
+        for _ in range(self.REQUESTS):
+            send()
+        after = memory.take_snapshot()
+        memory.stop_tracing()
+        growth = memory.growth_by_module(before.filter_traces(self.IGNORED), after.filter_traces(self.IGNORED))
+        self.assertLessEqual(sum(group["size_diff"] for group in growth), self.THRESHOLD, growth[:5])
+
+    def test_endpoints(self):
+        claims = str(ClaimsToken.for_user(self.user))
+        credentials = {"email": "test@example.com", "password": 'testpassword1!D'}
+        requests = {
+            "authenticated": ("POST", '/application/authenticated/', None, self.access),
+            "isPinSet": ("GET", '/application/isPinSet/', None, claims),
+            "profile": ("GET", '/application/profile/', None, claims),
+            "activities": ("POST", '/application/activities/', {"limit": 100}, self.access),
+            "activityCalendar": ("GET", '/application/activityCalendar/', {"year": 2024}, self.access),
+            "completeSession": ("POST", '/application/completeSession/', {"duration": 120, "xp_gained": 10}, self.access),
+            "update_brushtime": ("POST", '/application/update_brushtime/', {"added_time": 120}, self.access),
+            "updateStreak": ("POST", '/application/updateStreak/', None, self.access),
+            "levelUp": ("POST", '/application/levelUp/', {"update_level_by": 1}, self.access),
+            "updateUserXP": ("POST", '/application/updateUserXP/', {"current_level_xp": 10}, self.access),
+            "miniShop": ("POST", '/application/miniShop/', {"image_id": 2}, self.access),
+            "updateCharacterName": ("POST", '/application/updateCharacterName/', {"new_name": "Brushy"}, self.access),
+            "checkPin": ("POST", '/application/checkPin/', {"parent_pin": "123456"}, self.access),
+            "signin": ("POST", '/application/signin/', credentials, None),
+            "token/refresh": ("POST", '/application/token/refresh/', {"refresh": str(self.refresh)}, None),
+        }
+        for name, request in requests.items():
+            with self.subTest(endpoint=name):
+                self.assertLess(self.send(*request), 500)
+                self.assertNoGrowth(lambda: self.send(*request))
+
+
+class TestImportExportUsers(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = f"{self.directory}/{name}"
+        with open(path, "w") as stream:
+            stream.write(content)
+        return path
+
+    def test_import_csv_reports_bad_rows(self):
+        CustomUser.objects.create_user(email='taken@example.com',first_name="test",last_name="test", password='testpassword1!D')
+        path = self.write("users.csv", "\n".join([
+            "email,first_name,last_name,password,image_id,total_brushes",
+            "one@example.com,One,User,testpassword1!D,3,7",
+            "not-an-email,Bad,User,testpassword1!D,,",
+            "weak@example.com,Weak,User,weak,,",
+            "taken@example.com,Taken,User,testpassword1!D,,",
+            "one@example.com,Again,User,testpassword1!D,,",
+            "two@example.com,Two,User,testpassword1!D,,",
+            "three@example.com,Three,User,testpassword1!D,x,",
+        ]) + "\n")
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command("import_users", path, "--batch-size", "1", "--workers", "1", stdout=stdout, stderr=stderr)
+
+        self.assertIn("Imported 2 users, 5 rows skipped", stdout.getvalue())
+        errors = stderr.getvalue().splitlines()
+        self.assertEqual([error.split(":")[0] for error in errors], ["line 3", "line 4", "line 5", "line 6", "line 8"])
+        user = CustomUser.objects.select_related("stats").get(email='one@example.com')
+        self.assertTrue(user.check_password('testpassword1!D'))
+        self.assertEqual((user.image_id, user.total_brushes, user.current_level), (3, 7, 1))
+        self.assertTrue(UserStats.objects.filter(user__email='two@example.com').exists())
+
+    def test_export_and_import_round_trip(self):
+        user = CustomUser.objects.create_user(email='test@example.com',first_name="test",last_name="test", password='testpassword1!D', total_brushes=4)
+        UserActivity.objects.create(user=user, activity_date=datetime.date(2024, 3, 1), activity_time=datetime.datetime(2024, 3, 1, 8, 0, tzinfo=datetime.timezone.utc), activity_type="morning")
+        users_path, activities_path = f"{self.directory}/users.jsonl", f"{self.directory}/activities.csv"
+        call_command("export_users", users_path, "--activities-output", activities_path, "--chunk-size", "1", stdout=io.StringIO())
+
+        with open(activities_path) as stream:
+            self.assertEqual(stream.read().splitlines()[1], "test@example.com,2024-03-01,2024-03-01T08:00:00+00:00,morning")
+        with open(users_path) as stream:
+            row = json.loads(stream.readline())
+        self.assertEqual(row["password_hash"], user.password)
+
+        user.delete()
+        stdout = io.StringIO()
+        call_command("import_users", users_path, stdout=stdout, stderr=io.StringIO())
+        self.assertIn("Imported 1 users, 0 rows skipped", stdout.getvalue())
+        imported = CustomUser.objects.select_related("stats").get(email='test@example.com')
+        self.assertTrue(imported.check_password('testpassword1!D'))
+        self.assertEqual(imported.total_brushes, 4)
+
+    def test_invalid_json_line(self):
+        path = self.write("users.jsonl", '{"email": "a@example.com"\n["not", "an", "object"]\n')
+        stderr = io.StringIO()
+        call_command("import_users", path, stdout=io.StringIO(), stderr=stderr)
+        self.assertEqual([error.split(":")[0] for error in stderr.getvalue().splitlines()], ["line 1", "line 2"])
@@ -0,0 +1,187 @@
+"""
+Throttles used by every API view (DEFAULT_THROTTLE_CLASSES), so that one client stuck in a retry loop
+cannot occupy all the workers.
+
+A budget of N requests per period is kept with a sliding window: requests are counted per period long
+window, and a request is allowed while the count of the current window, plus the count of the previous
+one weighted by the part of it still within the last period, stays under N. So a client can send a
+burst of N requests, then gets them back gradually at N per period, as from a token bucket. A refused
+request is not counted and gets 429, with a Retry-After header telling when the next one is allowed.
+
+The counts are taken with the atomic cache.add and cache.incr, so concurrent requests never both get
+the last request of a budget. This is why THROTTLE_CACHE is a Redis, Memcached or local memory cache,
+the file and database caches do not increment atomically.
+
+Each view has a throttle_scope ('auth' for the endpoints that hash passwords or check the PIN, 'write'
+for the ones that update counters, 'default' otherwise), and every scope has its own budgets in the
+THROTTLE_BUCKETS setting, for each of the three buckets a request is counted in:
+-user: one bucket per user. Anonymous requests to 'auth' endpoints use the email they send, so
+guessing the password of one account is limited however many addresses are used
+-ip: one bucket per client address
+-global: one bucket for all clients, sheds load before the workers are saturated
+
+Counts are stored in the THROTTLE_CACHE cache, shared by all the workers when CACHE_URL is Redis or
+Memcached. If that cache cannot be reached, a cache local to the process is used instead of failing the
+request.
+
+Classes:
+-BucketThrottle: Base class, implements the sliding window
+-UserBucketThrottle, IPBucketThrottle, GlobalBucketThrottle: The three buckets
+"""
+
+import hashlib
+import logging
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger("application")
+
+# Used when THROTTLE_CACHE is unavailable
+_fallback_cache = LocMemCache("throttle-fallback", {"OPTIONS": {"MAX_ENTRIES": 10000}})
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(rate):
+    """
+    Args:
+        rate (str): '<requests>/<period>', the period being s, sec, m, min, h, hour, d or day
+
+    Returns:
+        tuple: (number of requests, period in seconds), None for no limit
+    """
+    if rate is None:
+        return None
+    requests, period = rate.split("/")
+    return int(requests), PERIODS[period[0]]
+
+
+def retry_after(limit, period, elapsed, previous, current):
+    """
+    Args:
+        limit (int): Number of requests allowed per period
+        period (int): Length of a window in seconds
+        elapsed (float): Seconds since the start of the current window
+        previous (int): Requests counted in the previous window
+        current (int): Requests counted in the current window
+
+    Returns:
+        float: Seconds until the next request is allowed
+    """
+    if current < limit and previous:
+        # Allowed in this window once enough of the previous one has slid out
+        return period - period * (limit - current - 1) / previous - elapsed
+    # Allowed in the next window, once enough of the current one has slid out
+    slid_out = max(0, period - period * (limit - 1) / current) if current else 0
+    return period - elapsed + slid_out
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    Counts the request in its bucket. Subclasses set bucket (the THROTTLE_BUCKETS entry) and implement
+    get_key.
+    """
+
+    bucket = None
+    timer = time.time
+
+    def get_key(self, request, view):
+        """
+        Returns the part of the cache key that identifies the bucket of the request
+        """
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        scope = getattr(view, "throttle_scope", None) or "default"
+        rate = parse_rate(settings.THROTTLE_BUCKETS.get(scope, {}).get(self.bucket))
+        if rate is None:
+            return True
+        limit, period = rate
+        window, elapsed = divmod(self.timer(), period)
+        key = f"throttle:{scope}:{self.bucket}:{self.get_key(request, view)}"
+
+        try:
+            cache = caches[settings.THROTTLE_CACHE]
+            previous, current = self.count(cache, key, int(window), period)
+        except Exception:
+            logger.warning("Throttle cache unavailable, using the local fallback", exc_info=True)
+            cache = _fallback_cache
+            previous, current = self.count(cache, key, int(window), period)
+
+        if previous * (1 - elapsed / period) + current <= limit:
+            self.wait_seconds = None
+            return True
+        try:
+            cache.decr(f"{key}:{int(window)}")
+        except Exception:
+            pass  # The refused request is counted until the window expires, nothing worse
+        self.wait_seconds = retry_after(limit, period, elapsed, previous, current - 1)
+        return False
+
+    def count(self, cache, key, window, period):
+        """
+        Counts a request in the current window
+
+        Returns:
+            tuple: (requests of the previous window, requests of the current window including this one)
+        """
+        current_key = f"{key}:{window}"
+        previous = cache.get(f"{key}:{window - 1}", 0)
+        try:
+            current = cache.incr(current_key)
+        except ValueError:
+            # First request of the window. If a concurrent one created the counter first, add does nothing
+            # and both increments are kept. It is still needed as the previous window during the next one.
+            cache.add(current_key, 0, timeout=2 * period + 1)
+            current = cache.incr(current_key)
+        return previous, current
+
+    def wait(self):
+        """
+        Returns the number of seconds until the next request is allowed, sent as Retry-After
+        """
+        return getattr(self, "wait_seconds", None)
+
+
+class UserBucketThrottle(BucketThrottle):
+    """
+    One bucket per user, or per submitted email for anonymous requests to 'auth' endpoints
+    (per client address for other anonymous requests)
+    """
+
+    bucket = "user"
+
+    def get_key(self, request, view):
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return f"id-{user.pk}"
+        email = request.data.get("email") if getattr(view, "throttle_scope", None) == "auth" else None
+        if isinstance(email, str) and email:
+            # Hashed, an email can contain characters that are not allowed in cache keys
+            return "email-" + hashlib.sha256(email.strip().lower().encode()).hexdigest()
+        return f"ip-{self.get_ident(request)}"
+
+
+class IPBucketThrottle(BucketThrottle):
+    """
+    One bucket per client address (see NUM_PROXIES in REST_FRAMEWORK)
+    """
+
+    bucket = "ip"
+
+    def get_key(self, request, view):
+        return self.get_ident(request)
+
+
+class GlobalBucketThrottle(BucketThrottle):
+    """
+    One bucket shared by all the clients
+    """
+
+    bucket = "global"
+
+    def get_key(self, request, view):
+        return "all"
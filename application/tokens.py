@@ -0,0 +1,38 @@
+"""
+Token types issued by the API in addition to simplejwt's access and refresh tokens.
+
+Classes:
+-ClaimsToken: Access token carrying a signed snapshot of a few profile fields of the user
+"""
+
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .cache import get_user_version
+
+# Fields of CustomUser copied into a ClaimsToken
+PROFILE_CLAIMS = ("is_pin_set", "character_name", "is_char_name_set", "image_id")
+
+
+class ClaimsToken(AccessToken):
+    """
+    Access token with a "profile" claim holding the PROFILE_CLAIMS fields of the user and a
+    "profile_version" claim holding the user's cache version at the time the token was issued.
+
+    ClaimsJWTAuthentication serves the profile fields straight from the token while the version
+    still matches, i.e. as long as the user has not been saved since. It has the same lifetime as an
+    access token and is returned next to it by SignUp, SignIn and token/refresh/.
+    """
+
+    token_type = "claims"
+
+    @classmethod
+    def for_user(cls, user):
+        """
+        Returns a claims token for the given user
+        """
+        # Read the version first, a change saved after this point makes the token stale
+        version = get_user_version(user.pk)
+        token = super().for_user(user)
+        token["profile"] = {name: getattr(user, name) for name in PROFILE_CLAIMS}
+        token["profile_version"] = version
+        return token
@@ -1,37 +1,61 @@
 # application/urls.py
+from django.conf import settings
 from django.urls import path
 from django.contrib import admin
-from rest_framework_simplejwt.views import TokenRefreshView
 from . import views
 
+
+def api_view(view_class):
+    """
+    Returns the view function of an API view. With ASYNC_VIEWS set (under ASGI) the async version
+    from async_views is used for the views that have one.
+    """
+    if settings.ASYNC_VIEWS:
+        from .async_views import ASYNC_VERSIONS
+
+        view_class = ASYNC_VERSIONS.get(view_class, view_class)
+    return view_class.as_view()
+
+
 urlpatterns = [
     # User authentication and management URLs
-    path("signup/", views.SignUp.as_view(), name="signup"),
-    path("signin/", views.SignIn.as_view(), name="signin"),
-    path("authenticated/", views.isSignedIn.as_view(), name="authenticatedUser"),
-    path("signout/", views.SignOut.as_view(), name="signout"),
-    path("delete/", views.DeleteUser.as_view(), name="delete"),
-    path("token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
+    path("signup/", api_view(views.SignUp), name="signup"),
+    path("signin/", api_view(views.SignIn), name="signin"),
+    path("authenticated/", api_view(views.isSignedIn), name="authenticatedUser"),
+    path("signout/", api_view(views.SignOut), name="signout"),
+    path("delete/", api_view(views.DeleteUser), name="delete"),
+    path("token/refresh/", api_view(views.ClaimsTokenRefreshView), name="token_refresh"),
     # User details and activity update URLs
     path(
         "update_brushtime/",
-        views.update_total_brush_time.as_view(),
+        api_view(views.update_total_brush_time),
         name="update_brush_time",
     ),
-    path("setPin/", views.SetParentPin.as_view(), name="set_pin"),
-    path("isPinSet/", views.CheckIfPinIsSet.as_view(), name="is_pin_set"),
-    path("checkPin/", views.CheckParentPIN.as_view(), name="check_pin"),
-    path("reauthenticate/", views.Reuthenticate.as_view(), name="reauthenticate"),
-    path("levelUp/", views.UpdateLevel.as_view(), name="update_level"),
-    path("updateUserXP/", views.UpdateLevelXP.as_view(), name="update_level_xp"),
+    path("setPin/", api_view(views.SetParentPin), name="set_pin"),
+    path("isPinSet/", api_view(views.CheckIfPinIsSet), name="is_pin_set"),
+    path("profile/", api_view(views.UserProfile), name="profile"),
+    path("checkPin/", api_view(views.CheckParentPIN), name="check_pin"),
+    path("reauthenticate/", api_view(views.Reuthenticate), name="reauthenticate"),
+    path("levelUp/", api_view(views.UpdateLevel), name="update_level"),
+    path("updateUserXP/", api_view(views.UpdateLevelXP), name="update_level_xp"),
     path(
         "updateCurrentLevelMaxXP/",
-        views.UpdateLevelMaxXP.as_view(),
+        api_view(views.UpdateLevelMaxXP),
         name="update_level_max_xp",
     ),
-    path("miniShop/", views.MiniShopPhoto().as_view(), name="mini_shop"),
-    path("updateStreak/", views.UpdateStreak.as_view(), name="update_streak"),
-    path("updateActivity/", views.UpdateActivity.as_view(), name="update_activity"),
-    path("activities/", views.UserActivities.as_view(), name="user_activities"),
-    path("updateCharacterName/", views.SetCharterName.as_view(), name="char_name"),
+    path("miniShop/", api_view(views.MiniShopPhoto), name="mini_shop"),
+    path("updateStreak/", api_view(views.UpdateStreak), name="update_streak"),
+    path("updateActivity/", api_view(views.UpdateActivity), name="update_activity"),
+    path("activities/", api_view(views.UserActivities), name="user_activities"),
+    path("activityCalendar/", api_view(views.ActivityCalendar), name="activity_calendar"),
+    path("completeSession/", api_view(views.CompleteSession), name="complete_session"),
+    path("syncActivities/", api_view(views.SyncActivities), name="sync_activities"),
+    path("export/", api_view(views.PersonalDataExport), name="personal_data_export"),
+    path("updateCharacterName/", api_view(views.SetCharterName), name="char_name"),
+    # Monitoring
+    path("metrics/", views.metrics_view, name="metrics"),
+    path("profiling/token/", api_view(views.ProfilingToken), name="profiling_token"),
+    path("profiling/", api_view(views.ProfileList), name="profile_list"),
+    path("profiling/<str:name>/", api_view(views.ProfileDownload), name="profile_download"),
+    path("memory/", api_view(views.MemoryProfile), name="memory_profile"),
 ]
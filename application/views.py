@@ -1,30 +1,90 @@
-from django.http import HttpResponse
-from django.db import IntegrityError
+import hmac
+import os
+import re
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from rest_framework import status, permissions
 from rest_framework.exceptions import ValidationError as DRFValidationError
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenRefreshView
 from rest_framework import exceptions
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework.exceptions import Throttled, ValidationError, NotFound
+from rest_framework.exceptions import ValidationError, NotFound
 from django.db.utils import OperationalError
-from collections import defaultdict
 import datetime
 from datetime import timedelta
 from django.utils import timezone
 import logging
 
-from .models import CustomUser, get_user_by_email, UserActivity
-from .serializers import CustomUserSerializer, UserActivitySerializer
+from .authentication import CachedJWTAuthentication, ClaimsJWTAuthentication
+from .hashing import HashingOverloaded, hash_password, verify_password
+from .deletion import request_deletion
+from .exports import gzip_stream, personal_data_stream
+from .activity import (
+    activity_days,
+    calendar_summary,
+    lock_daily_activity,
+    record_daily_activity,
+    save_daily_activity,
+    slots_to_activity_type,
+)
+from .models import (
+    CustomUser,
+    get_user_by_email,
+    UserActivity,
+    UserActivityYear,
+    UserDailyActivity,
+)
+from .serializers import (
+    CustomUserSerializer,
+    UserActivitySerializer,
+    BrushingSessionSerializer,
+    ActivitySyncSerializer,
+    ActivityRangeSerializer,
+    ClaimsTokenRefreshSerializer,
+)
+from .stats import (
+    DAY_STREAK_FIELDS,
+    SESSION_FIELDS,
+    SLOT_STREAK_FIELDS,
+    apply_day_streak,
+    apply_slot_streak,
+    apply_xp,
+    locked_user,
+    session_slot,
+    update_user,
+)
+from .memory import memory_report, start_tracing, stop_tracing, take_baseline
+from .profiling import (
+    PROFILE_HEADER,
+    list_profiles,
+    make_profile_token,
+    profile_path,
+    profile_summary,
+)
+from .tokens import PROFILE_CLAIMS, ClaimsToken
 
 # Setup logging
 logger = logging.getLogger("application")
 logger.debug("This is a debug message")
 
 
+def overloaded_response(exception):
+    """
+    Response sent when a password could not be hashed because the hashing pool is full.
+    The client is asked to retry after a second instead of waiting for a slot.
+    """
+    return Response(
+        {"detail": exception.detail},
+        status=exception.status_code,
+        headers={"Retry-After": "1"},
+    )
+
+
 def home_view(request):
     """
     Simple home view, created to test urls.
@@ -32,6 +92,24 @@ def home_view(request):
     return HttpResponse("Welcome to the home page!")
 
 
+def metrics_view(request):
+    """
+    Serves the request metrics of all the worker processes in the Prometheus text format.
+
+    The scraper authenticates with the METRICS_TOKEN setting as a bearer token. Without that setting
+    the endpoint does not exist (404).
+    """
+    expected = settings.METRICS_TOKEN
+    if not settings.METRICS_ENABLED or not expected:
+        raise Http404()
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {expected}"):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED, headers={"WWW-Authenticate": "Bearer"})
+    from .metrics import render_metrics
+
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
+
+
 class SignUp(APIView):
     """
     API view for user registration. Handles user creation with JWT token generation.
@@ -43,6 +121,8 @@ class SignUp(APIView):
     I
     """
 
+    throttle_scope = "auth"
+
     def post(self, request):
         """
         Handle POST requests  to register a new user.
@@ -58,7 +138,7 @@ class SignUp(APIView):
             -Validates the data using the CustomUserSerializer
             -If the validation fails it returns an http 400 bad request
             -If validation passes it saves the user in the database
-            -creates a refresh and access token using django rest
+            -creates a refresh and access token using django rest, and a claims token (see ClaimsToken)
             -returns a response with the user details and tokens if successful
             -handles already existing users - http 409 conflict
             -additionally it checks for any other validation errors (in the serializer)
@@ -67,7 +147,9 @@ class SignUp(APIView):
         serializer = CustomUserSerializer(data=request.data)
         try:
             if serializer.is_valid(raise_exception=True):
-                user = serializer.save()
+                user = serializer.save(
+                    password_hash=hash_password(serializer.validated_data["password"])
+                )
                 refresh_token = RefreshToken.for_user(user)
                 access_token = refresh_token.access_token
 
@@ -78,6 +160,7 @@ class SignUp(APIView):
                     "email": user.email,
                     "refresh": str(refresh_token),
                     "access": str(access_token),
+                    "claims": str(ClaimsToken.for_user(user)),
                 }
                 return Response(data=data, status=status.HTTP_201_CREATED)
             else:
@@ -93,6 +176,8 @@ class SignUp(APIView):
                 {"detail": "A user with that email already exists."},
                 status=status.HTTP_409_CONFLICT,
             )
+        except HashingOverloaded as e:
+            return overloaded_response(e)
 
 
 class SignIn(APIView):
@@ -101,6 +186,8 @@ class SignIn(APIView):
     and provides JWT tokens.
     """
 
+    throttle_scope = "auth"
+
     def post(self, request):
         """
         Authenticate a user based on email and password and return jwt access and refresh tokens
@@ -119,7 +206,7 @@ class SignIn(APIView):
             # Invalid credentials for both cases bc we dont wanna tell an attacker which one is wrong
             if user is None:
                 raise exceptions.AuthenticationFailed("Invalid credentials")
-            if not user.check_password(raw_password=password):
+            if not verify_password(user, password):
                 raise exceptions.AuthenticationFailed("Invalid credentials")
             # Generate access and refresh tokens from JWT
 
@@ -130,10 +217,13 @@ class SignIn(APIView):
             response.data = {
                 "refresh": str(refresh_token),
                 "access": str(access),
+                "claims": str(ClaimsToken.for_user(user)),
                 "user": serializer.data,
             }
             response.status_code = status.HTTP_200_OK
             return response
+        except HashingOverloaded as e:
+            return overloaded_response(e)
         except:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
@@ -143,6 +233,8 @@ class Reuthenticate(APIView):
     API view for reauthenticating users, used in the frontend application to confirm user credentials when requesting to reset parent PIN
     """
 
+    throttle_scope = "auth"
+
     def post(self, request):
         """
         Reauthenticate a user to verify their credentials while still logged in
@@ -159,12 +251,13 @@ class Reuthenticate(APIView):
             password = request.data["password"]
             user = get_user_by_email(email=email)
 
-            if user is None or not user.check_password(raw_password=password):
-                raise exceptions.AuthenticationFailed("Invalid credentials")
-            if not user.check_password(raw_password=password):
+            # One hash per attempt, hashing is by far the most expensive part of the request
+            if user is None or not verify_password(user, password):
                 raise exceptions.AuthenticationFailed("Invalid credentials")
 
             return Response(status=status.HTTP_200_OK)
+        except HashingOverloaded as e:
+            return overloaded_response(e)
         except:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
@@ -176,7 +269,7 @@ class isSignedIn(APIView):
 
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
@@ -210,8 +303,9 @@ class update_total_brush_time(APIView):
 
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def post(self, request):
         """
@@ -226,21 +320,22 @@ class update_total_brush_time(APIView):
 
         Note:
         -User's last_active_date is updated whenever added_time is updated
+        -The time is added by the database, so parallel requests are all counted
 
         """
         added_time = request.data.get("added_time", None)
         user = request.user
 
         if added_time is not None:
-            serializer = CustomUserSerializer(
-                user,
-                data={"total_brush_time": user.total_brush_time + int(added_time)},
-                partial=True,
-            )
             try:
-                user.total_brush_time += int(added_time)
-                user.last_active_date = datetime.date.today()
-                user.save()
+                today = datetime.date.today()
+                with transaction.atomic():
+                    update_user(
+                        user,
+                        total_brush_time=F("total_brush_time") + int(added_time),
+                        last_active_date=today,
+                    )
+                    record_daily_activity(user, today, seconds=int(added_time), sessions=0)
                 serializer = CustomUserSerializer(user)
                 return Response(serializer.data, status=status.HTTP_200_OK)
             except:
@@ -259,8 +354,9 @@ class UpdateStreak(APIView):
     consecutive day logins are accurately tracked and the streak is updated appropriately.
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def post(self, request):
         """
@@ -281,34 +377,10 @@ class UpdateStreak(APIView):
             - Finally, it updates the user's max streak and returns the serialized user data.
 
         """
-        user = request.user
         try:
-            today = datetime.date.today()
-            
-            # logger.debug(f"Updating streak for user: {user.email}, Last active date: {user.last_active_date}, Today: {today}")
-            if user.last_active_date is not None and user.current_streak !=0:
-                 if today - user.last_active_date == timedelta(days=1):
-                     # 1 day so we up the streak
-                     user.current_streak += 1
-                     user.total_brushes_days +=1
-                    
-                 elif today - user.last_active_date > timedelta(days=1):
-                     # longer than 1 day so reset the streak
-                     user.current_streak  = 1
-                     user.total_brushes_days +=1
-            else:
-                user.current_streak = 1
-                user.total_brushes_days +=1
-
-            
-
-            if user.current_streak > user.max_streak:
-                user.max_streak = user.current_streak
-            user.last_active_date = today
-            # user.save()
-            # logger.debug(f"After update - Current streak: {user.current_streak}, Is PIN set: {user.is_pin_set}")
-            
-            user.save()
+            with locked_user(request.user) as user:
+                apply_day_streak(user, datetime.date.today())
+                user.save(update_fields=DAY_STREAK_FIELDS)
             serializer = CustomUserSerializer(user)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Exception as e: 
@@ -321,8 +393,9 @@ class SetCharterName(APIView):
     API view for setting or updating the character name of an authenticated user's profile.
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def post(self, request):
         """
@@ -338,24 +411,21 @@ class SetCharterName(APIView):
         Process:
         - Retrieves the 'new_name' from the request data.
         - If 'new_name' is provided, updates the user's character name and sets 'is_char_name_set' to True if it wasn't already.
-        - Saves the user's updated information to the database.
+        - Writes only these two columns to the database.
         - Returns HTTP 200 OK on successful update or an error response if an exception occurs.
         """
         try:
             new_name = request.data.get("new_name")
-            user = request.user
-            user.character_name = new_name
-            if user.is_char_name_set is False:
-                user.is_char_name_set = True
-            user.save()
+            update_user(request.user, character_name=new_name, is_char_name_set=True)
             return Response(status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"detail": e.messages}, status=status.HTTP_400_BAD_REQUEST)
 
 
 class UpdateActivity(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
     """
     API view for updating user's daily activities and their streaks. The streak is determined based
     on whether the activity is performed consecutively in the morning or evening sessions. Activities
@@ -373,67 +443,23 @@ class UpdateActivity(APIView):
         """
         # Retrieve the user from the request
         user = request.user
-        updated_streak = False
-        today = datetime.date.today()
         if user is None: 
             return Response({'detail':'User not found'}, status=status.HTTP_404_NOT_FOUND)
         time_now = timezone.now()
         try:
-            if time_now.hour < 12:
-                # Morning activity
-                if user.last_active_morning is not None and user.streak_morning !=0:
-                    if time_now.date() - user.last_active_morning.date() == timedelta(days=1):
-                        user.streak_morning += 1
-                        updated_streak = True
-                    elif time_now.date() - user.last_active_morning.date() > timedelta(days=1):
-                        user.streak_morning = 1
-                        updated_streak = True
-                else: 
-                    user.streak_morning = 1
-                    updated_streak = True
-                user.last_active_morning = time_now
-                user.total_brushes_morning += 1
-                user.total_brushes += 1
-                user.percentage_morning = user.total_brushes_morning/user.total_brushes_days
-
-                if user.streak_morning > user.max_streak_morning:
-                    user.max_streak_morning = user.streak_morning
-
-            else:
-                if user.last_active_evening is not None and user.streak_evening !=0:
-                    if time_now.date() - user.last_active_evening.date() == timedelta(days=1):
-                        user.streak_evening += 1
-                        updated_streak = True
-                    elif time_now.date() - user.last_active_evening.date() > timedelta(days=1):
-                        user.streak_evening = 1
-                        updated_streak = True
-                else: user.streak_evening = 1
-                updated_streak = True
-                user.last_active_evening = time_now
-                user.total_brushes_evening += 1
-                user.total_brushes += 1
-                user.percentage_evening = user.total_brushes_evening/user.total_brushes_days
-                if user.streak_evening > user.max_streak_evening:
-                    user.max_streak_evening = user.streak_evening
-
-            if updated_streak == True:
-                time_now = timezone.now()
-                
-                
-                if time_now.hour<12:
-                    type='morning'
-                else:
-                    type='evening'
-
-                
-                new_activity = UserActivity(
-                    user=user,
-                    activity_date=today,
-                    activity_time= time_now,
-                    activity_type=type
-                )
-                new_activity.save()
-            user.save()
+            with locked_user(user) as user:
+                apply_slot_streak(user, time_now)
+                slot = UserDailyActivity.SLOT_BITS[session_slot(time_now)]
+                # An activity for the first session of the slot on that day only
+                if record_daily_activity(user, time_now.date(), slot):
+                    new_activity = UserActivity(
+                        user=user,
+                        activity_date=time_now.date(),
+                        activity_time=time_now,
+                        activity_type=session_slot(time_now)
+                    )
+                    new_activity.save()
+                user.save(update_fields=SLOT_STREAK_FIELDS)
             serializer = CustomUserSerializer(user)
             return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -441,13 +467,148 @@ class UpdateActivity(APIView):
             return Response({'detail':str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class CompleteSession(APIView):
+    """
+    API view that records a whole brushing session in one call. It replaces the sequence
+    update_brushtime/ -> updateStreak/ -> updateActivity/ -> updateUserXP/ -> levelUp/ that the
+    app used to send after every session.
+    """
+
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
+
+    def post(self, request):
+        """
+        Applies the brush time, daily streak, morning/evening streak, activity and XP/level
+        updates of a session in a single transaction.
+
+        Args:
+            request (HttpRequest): The request object containing 'duration' (seconds), an optional
+            'client_timestamp' (ISO 8601, with the device's UTC offset) and an optional 'xp_gained'.
+
+        Returns:
+            Response: A Django REST Framework Response object with the updated user data or an error message.
+
+        Note:
+        -The user row is locked for the duration of the transaction so that two devices posting
+        at the same time cannot overwrite each other's counters
+        -Only the counters touched by a session are written back
+        """
+        session = BrushingSessionSerializer(data=request.data)
+        if not session.is_valid():
+            return Response(session.errors, status=status.HTTP_400_BAD_REQUEST)
+        moment = session.validated_data.get("client_timestamp") or timezone.localtime()
+
+        with locked_user(request.user) as user:
+            user.total_brush_time += session.validated_data["duration"]
+            apply_day_streak(user, moment.date())
+            apply_slot_streak(user, moment)
+            first_of_slot = record_daily_activity(
+                user,
+                moment.date(),
+                UserDailyActivity.SLOT_BITS[session_slot(moment)],
+                seconds=session.validated_data["duration"],
+            )
+            if first_of_slot:
+                UserActivity.objects.create(
+                    user=user,
+                    activity_date=moment.date(),
+                    activity_time=moment,
+                    activity_type=session_slot(moment),
+                )
+            apply_xp(user, session.validated_data["xp_gained"])
+            user.save(update_fields=SESSION_FIELDS)
+
+        serializer = CustomUserSerializer(user)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class SyncActivities(APIView):
+    """
+    API view for replaying brushing sessions that were queued on the device while it was offline.
+    """
+
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
+
+    def post(self, request):
+        """
+        Applies a batch of queued sessions in the order they happened on the device.
+
+        Args:
+            request (HttpRequest): The request object containing 'events', a list of sessions each with
+            'duration', 'client_timestamp' and an optional 'xp_gained'.
+
+        Returns:
+            Response: A Django REST Framework Response object with the final user data or an error message.
+
+        Process:
+        - Sorts the events by their client timestamp, so the streaks are computed from when the
+        sessions happened and not from when they were received.
+        - Locks the user and the daily rollup rows of the batch's days, which keep the client timestamps
+        of the sessions already synced, and skips those sessions, e.g. because the batch is retried
+        after the connection dropped.
+        - Applies every new session to the locked rows in memory. As in completeSession/, an activity
+        is recorded for the first session of a slot on a day only.
+        - Inserts the new activities with one bulk insert, writes the rollup rows with one upsert and
+        the user's counters once.
+        """
+        sync = ActivitySyncSerializer(data=request.data)
+        if not sync.is_valid():
+            return Response(sync.errors, status=status.HTTP_400_BAD_REQUEST)
+        events = sorted(sync.validated_data["events"], key=lambda event: event["client_timestamp"])
+
+        with locked_user(request.user) as user:
+            days = lock_daily_activity(user, {event["client_timestamp"].date() for event in events})
+            new_activities = []
+            changed = {}
+            # Days that gained a slot, marked in the year calendars
+            added = {}
+            for event in events:
+                moment = event["client_timestamp"]
+                day = days[moment.date()]
+                if moment.isoformat() in day.synced_sessions:
+                    continue
+                day.synced_sessions.append(moment.isoformat())
+                slot = UserDailyActivity.SLOT_BITS[session_slot(moment)]
+                if not day.slots & slot:
+                    day.slots |= slot
+                    added[day.day] = day.slots
+                    new_activities.append(
+                        UserActivity(
+                            user=user,
+                            activity_date=day.day,
+                            activity_time=moment,
+                            activity_type=session_slot(moment),
+                        )
+                    )
+                day.session_count += 1
+                day.total_seconds += event["duration"]
+                changed[day.day] = day
+                user.total_brush_time += event["duration"]
+                apply_day_streak(user, moment.date())
+                apply_slot_streak(user, moment)
+                apply_xp(user, event["xp_gained"])
+            if changed:
+                # ignore_conflicts also spares reading the ids of the new rows back
+                UserActivity.objects.bulk_create(new_activities, ignore_conflicts=True)
+                save_daily_activity(user, changed.values(), added)
+                user.save(update_fields=SESSION_FIELDS)
+
+        serializer = CustomUserSerializer(user)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 class UpdateLevel(APIView):
     """
     API view to increment a user's level based on a specified value.
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def post(self, request):
         """
@@ -461,15 +622,8 @@ class UpdateLevel(APIView):
         """
         update_level_by = request.data.get("update_level_by", None)
         user = request.user
-        if update_level_by is not None:
-            serializer = CustomUserSerializer(
-                user,
-                data={"current_level": user.current_level + int(update_level_by)},
-                partial=True,
-            )
         try:
-            user.current_level += int(update_level_by)
-            user.save()
+            update_user(user, current_level=F("current_level") + int(update_level_by))
             serializer = CustomUserSerializer(user)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except:
@@ -481,8 +635,9 @@ class UpdateLevelXP(APIView):
     API view to update the user's current experience points.
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def post(self, request):
         """
@@ -496,13 +651,8 @@ class UpdateLevelXP(APIView):
         """
         update_current_xp = request.data.get("current_level_xp", None)
         user = request.user
-        if update_current_xp is not None:
-            serializer = CustomUserSerializer(
-                user, data={"current_level_xp": int(update_current_xp)}, partial=True
-            )
         try:
-            user.current_level_xp = int(update_current_xp)
-            user.save()
+            update_user(user, current_level_xp=int(update_current_xp))
             serializer = CustomUserSerializer(user)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except ValueError:
@@ -519,8 +669,9 @@ class MiniShopPhoto(APIView):
     API view for updating the user's profile image ID.
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def post(self, request):
         """
@@ -534,13 +685,8 @@ class MiniShopPhoto(APIView):
         """
         update_image_id = request.data.get("image_id", None)
         user = request.user
-        if update_image_id is not None:
-            serializer = CustomUserSerializer(
-                user, data={"image_id": int(update_image_id)}, partial=True
-            )
         try:
-            user.image_id = int(update_image_id)
-            user.save()
+            update_user(user, image_id=int(update_image_id))
             serializer = CustomUserSerializer(user)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except ValueError:
@@ -557,8 +703,9 @@ class UpdateLevelMaxXP(APIView):
     API view for updating the maximum XP level for a user.
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def post(self, request):
         """
@@ -573,16 +720,8 @@ class UpdateLevelMaxXP(APIView):
         update_current_level_max = request.data.get("current_level_max_xp", None)
         user = request.user
 
-        if update_current_level_max is not None:
-            serializer = CustomUserSerializer(
-                user,
-                data={"current_level_max_xp": int(update_current_level_max)},
-                partial=True,
-            )
-
         try:
-            user.current_level_max_xp = int(update_current_level_max)
-            user.save()
+            update_user(user, current_level_max_xp=int(update_current_level_max))
             serializer = CustomUserSerializer(user)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except ValueError:
@@ -600,7 +739,7 @@ class SignOut(APIView):
     API view to handle user logout by invalidating the provided JWT refresh token.
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
@@ -634,12 +773,16 @@ class DeleteUser(APIView):
     API view to delete the currently authenticated user's account.
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def post(self, request):
-        user = request.user
-        user.delete()
+        """
+        Deactivates the account at once and leaves deleting its data to a background job (see
+        application/deletion.py), so the response does not wait for it.
+        """
+        request_deletion(request.user)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -648,8 +791,9 @@ class SetParentPin(APIView):
     API view to set or update a parent PIN for the currently authenticated user.
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def post(self, request):
         """
@@ -668,9 +812,7 @@ class SetParentPin(APIView):
                 {"error": "The PIN mist be exactly 6 digits"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        user.parent_pin = pin
-        user.is_pin_set = True
-        user.save()
+        update_user(user, parent_pin=pin, is_pin_set=True)
         return Response(
             {"message": "Parent PIN was set successfully."}, status=status.HTTP_200_OK
         )
@@ -681,8 +823,9 @@ class CheckParentPIN(APIView):
     API view to check if the provided parent PIN matches the one stored for the authenticated user.
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_scope = "auth"
 
     def post(self, request):
         """
@@ -704,9 +847,10 @@ class CheckParentPIN(APIView):
 class CheckIfPinIsSet(APIView):
     """
     API view to check if the authenticated user has a parent PIN set.
+    Accepts a claims token, in which case the flag is read from the token.
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
@@ -717,30 +861,252 @@ class CheckIfPinIsSet(APIView):
         return Response({"is_pin_set": user.is_pin_set}, status=status.HTTP_200_OK)
 
 
+class UserProfile(APIView):
+    """
+    API view returning the profile flags of the authenticated user (PIN set, character name, image id).
+    Accepts a claims token, in which case the answer is built from the token without a database query.
+    """
+
+    authentication_classes = [ClaimsJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Returns the PROFILE_CLAIMS fields of the current user
+        """
+        user = request.user
+        return Response(
+            {name: getattr(user, name) for name in PROFILE_CLAIMS}, status=status.HTTP_200_OK
+        )
+
+
+class ClaimsTokenRefreshView(TokenRefreshView):
+    """
+    Same as simplejwt's TokenRefreshView, but the response also contains a new claims token.
+    """
+
+    serializer_class = ClaimsTokenRefreshSerializer
+
+
 class UserActivities(APIView):
     """
     API view to retrieve and summarize the user's activities by day, indicating whether activities occurred
     in the morning, evening, or both.
     """
 
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        user = request.user
-        activities = UserActivity.objects.filter(user=user).values('activity_date', 'activity_type')
-
-        grouped = defaultdict(set)
-        for activity in activities:
-            grouped[activity['activity_date']].add(activity['activity_type'])
-        activity_pairs = []
+        """
+        Returns one entry per active day, ordered by date, with the activity type collapsed to
+        'morning', 'evening' or 'both'. The days are read from the UserDailyActivity rollup.
 
-        for date, type in grouped.items():
-            if 'morning' in type and 'evening' in type:
-                activity_pairs.append({'activity_date': date, 'activity_type': 'both'})
-            else:
-                activity_type = 'morning' if 'morning' in type else 'evening'
-                activity_pairs.append({'activity_date': date, 'activity_type': activity_type})
+        Args:
+            request (HttpRequest): The request object, optionally containing
+            'from'/'to' (inclusive ISO dates) to restrict the range, and
+            'after' (exclusive ISO date) with 'limit' to fetch the days page by page.
 
+        Returns:
+            Response: A Django REST Framework Response object with a list of
+            {'activity_date', 'activity_type'} dictionaries or the validation errors.
 
+        Note:
+        -To fetch the next page, send the last activity_date of the current page as 'after'
+        """
+        bounds = ActivityRangeSerializer(data=request.data)
+        if not bounds.is_valid():
+            return Response(bounds.errors, status=status.HTTP_400_BAD_REQUEST)
+        bounds = bounds.validated_data
+
+        days = activity_days(request.user, bounds)
+        activity_pairs = [
+            {"activity_date": day, "activity_type": slots_to_activity_type(slots)}
+            for day, slots in days
+        ]
         return Response(activity_pairs, status=status.HTTP_200_OK)
+
+
+class PersonalDataExport(APIView):
+    """
+    API view streaming all of the user's data (profile and every brushing activity) as NDJSON, for parents
+    who ask for a copy of their child's data.
+    """
+
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Streams the lines of personal_data_stream as they are read from the database, so the memory used
+        does not grow with the length of the history. The response is gzip compressed on the fly when the
+        client accepts it.
+
+        Returns:
+            StreamingHttpResponse: An application/x-ndjson attachment
+        """
+        chunks = personal_data_stream(request.user)
+        compress = re.search(r"\bgzip\b", request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        response = StreamingHttpResponse(
+            gzip_stream(chunks) if compress else chunks, content_type="application/x-ndjson"
+        )
+        if compress:
+            response["Content-Encoding"] = "gzip"
+        response["Vary"] = "Accept-Encoding"
+        response["Content-Disposition"] = 'attachment; filename="brushing-data.ndjson"'
+        return response
+
+
+class ActivityCalendar(APIView):
+    """
+    API view to retrieve a whole year of the user's activity as two compact bitmaps, used by the
+    calendar and heatmap screens.
+    """
+
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Returns the morning and evening bitmaps of a year, base64 encoded. Bit n (byte n // 8,
+        bit n % 8 counting from the least significant bit) is day n + 1 of the year.
+
+        Args:
+            request (HttpRequest): The request object, optionally containing the 'year' query parameter
+            (defaults to the current year).
+
+        Returns:
+            Response: A DRF Response object with the year, the two bitmaps, the number of active days
+            and the longest streak of the year, or an error message.
+        """
+        try:
+            year = int(request.query_params.get("year", timezone.localdate().year))
+        except ValueError:
+            return Response(
+                {"detail": "Invalid year. It must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        calendar = UserActivityYear.objects.filter(user=request.user, year=year).first()
+        return Response(calendar_summary(year, calendar), status=status.HTTP_200_OK)
+
+
+class ProfilingToken(APIView):
+    """
+    Staff only. Issues a value of the X-Profile header: requests that carry it are profiled (see
+    application/profiling.py) until it expires.
+    """
+
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        return Response(
+            {
+                "header": PROFILE_HEADER,
+                "value": make_profile_token(),
+                "expires_in": settings.PROFILE_TOKEN_MAX_AGE,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class ProfileList(APIView):
+    """
+    Staff only. Lists the saved request profiles, newest first.
+    """
+
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(list_profiles(), status=status.HTTP_200_OK)
+
+
+class ProfileDownload(APIView):
+    """
+    Staff only. Downloads a saved request profile as a pstats file (open it with pstats, snakeviz...),
+    or as the pstats text report with ?output=text (and optionally &sort=tottime&limit=100).
+    """
+
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, name):
+        if request.query_params.get("output") == "text":
+            try:
+                limit = int(request.query_params.get("limit", 50))
+                report = profile_summary(name, request.query_params.get("sort", "cumulative"), limit)
+            except (KeyError, ValueError):
+                return Response(
+                    {"detail": "Invalid sort or limit."}, status=status.HTTP_400_BAD_REQUEST
+                )
+            if report is None:
+                raise NotFound()
+            return HttpResponse(report, content_type="text/plain; charset=utf-8")
+        path = profile_path(name)
+        if path is None:
+            raise NotFound()
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=name)
+
+
+class MemoryProfile(APIView):
+    """
+    Staff only. Memory profiling of the worker process that serves the request (see application/memory.py).
+    """
+
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """
+        Reports the memory allocated since the baseline and still held, by module and allocation site.
+
+        Args:
+            request (HttpRequest): The request, optionally with 'limit', the number of modules and sites
+
+        Returns:
+            Response: The report, or 400 if tracing is not started in this worker
+        """
+        try:
+            limit = int(request.query_params.get("limit", 20))
+        except ValueError:
+            return Response({"detail": "Invalid limit."}, status=status.HTTP_400_BAD_REQUEST)
+        report = memory_report(limit)
+        if report is None:
+            return Response(
+                {"detail": "Memory tracing is not started in this worker."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(report, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        """
+        Controls the tracing of this worker.
+
+        Args:
+            request (HttpRequest): The request containing 'action': 'start' (with optionally 'frames', the
+                                   depth of the stacks kept), 'baseline' to take a new baseline, or 'stop'
+
+        Returns:
+            Response: The pid of the worker, or 400 for an unknown action
+        """
+        action = request.data.get("action")
+        if action == "start":
+            try:
+                start_tracing(int(request.data.get("frames", 10)))
+            except (TypeError, ValueError):
+                return Response({"detail": "Invalid frames."}, status=status.HTTP_400_BAD_REQUEST)
+        elif action == "baseline":
+            if not take_baseline():
+                return Response(
+                    {"detail": "Memory tracing is not started in this worker."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        elif action == "stop":
+            stop_tracing()
+        else:
+            return Response(
+                {"detail": "The action must be start, baseline or stop."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response({"pid": os.getpid()}, status=status.HTTP_200_OK)
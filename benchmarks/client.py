@@ -0,0 +1,50 @@
+"""
+Minimal keep-alive HTTP client shared by the benchmark scripts (standard library only).
+
+Functions:
+-connect(base_url): opens a connection to the server
+-request(connection, method, path, token, body): sends a JSON request, returns (status, headers, body)
+-percentile(sorted_values, fraction): value below which the given fraction of the values lie
+"""
+
+import http.client
+import json
+from urllib.parse import urlsplit
+
+
+def connect(base_url):
+    """
+    Opens a keep-alive connection to the server
+    """
+    url = urlsplit(base_url)
+    connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+    return connection_class(url.hostname, url.port, timeout=30)
+
+
+def request(connection, method, path, token=None, body=None):
+    """
+    Sends one JSON request
+
+    Returns:
+        tuple: (status, response headers, response body)
+    """
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = connection.getresponse()
+    return response.status, response.headers, response.read()
+
+
+def percentile(sorted_values, fraction):
+    """
+    Args:
+        sorted_values (list): Values in ascending order
+        fraction (float): e.g. 0.95 for the 95th percentile
+
+    Returns:
+        float: The percentile, 0.0 for no values
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
@@ -0,0 +1,122 @@
+"""
+Side by side benchmark of the WSGI and ASGI deployments of the API.
+
+Sends the same mix of small authenticated requests to each server with the same number of concurrent
+clients, and prints the throughput and latency percentiles of each. Only the standard library is used,
+so it runs from any machine that can reach the servers.
+
+Usage:
+    # One terminal per server, same database and settings, same number of worker processes
+    # (SECURE_SSL_REDIRECT=false to serve plain HTTP locally), gunicorn.conf.py picks the server
+    SERVER_INTERFACE=wsgi gunicorn -w 2 -b 127.0.0.1:8001
+    SERVER_INTERFACE=asgi gunicorn -w 2 -b 127.0.0.1:8002
+
+    python benchmarks/compare_servers.py --email user@example.com --password ... \\
+        --server wsgi=http://127.0.0.1:8001 --server asgi=http://127.0.0.1:8002 \\
+        --concurrency 64 --duration 20
+"""
+
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+
+from client import connect, percentile, request
+
+# (method, path, JSON body) of the requests each client cycles through
+REQUEST_MIX = [
+    ("GET", "/application/isPinSet/", None),
+    ("POST", "/application/authenticated/", {}),
+    ("GET", "/application/activityCalendar/", None),
+    ("POST", "/application/activities/", {"limit": 31}),
+    ("GET", "/application/profile/", None),
+]
+
+
+def sign_in(base_url, email, password):
+    """
+    Returns the access token of the benchmark user
+    """
+    status, _, body = request(connect(base_url), "POST", "/application/signin/", None, {"email": email, "password": password})
+    if status != 200:
+        raise SystemExit(f"Sign in to {base_url} failed with HTTP {status}: {body[:200]!r}")
+    return json.loads(body)["access"]
+
+
+def run_client(base_url, token, deadline, latencies, errors):
+    """
+    Sends the request mix in a loop until the deadline, recording the latency of every request
+    """
+    connection = connect(base_url)
+    i = 0
+    while time.perf_counter() < deadline:
+        method, path, body = REQUEST_MIX[i % len(REQUEST_MIX)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            status, _, _ = request(connection, method, path, token, body)
+        except (OSError, http.client.HTTPException):
+            errors.append(path)
+            connection.close()
+            connection = connect(base_url)
+            continue
+        latencies.append(time.perf_counter() - start)
+        if status >= 400:
+            errors.append(path)
+    connection.close()
+
+
+def benchmark(base_url, token, concurrency, duration):
+    """
+    Returns:
+        dict: requests/sec, error count and latency percentiles (ms) of one server
+    """
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    clients = [
+        threading.Thread(target=run_client, args=(base_url, token, deadline, latencies, errors))
+        for _ in range(concurrency)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+
+    latencies.sort()
+    return {
+        "requests/sec": len(latencies) / duration,
+        "errors": len(errors),
+        "p50 ms": percentile(latencies, 0.50) * 1000,
+        "p95 ms": percentile(latencies, 0.95) * 1000,
+        "p99 ms": percentile(latencies, 0.99) * 1000,
+        "mean ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", action="append", required=True, help="name=base_url, repeat for each server")
+    parser.add_argument("--email", required=True, help="Email of an existing user")
+    parser.add_argument("--password", required=True, help="Password of that user")
+    parser.add_argument("--concurrency", type=int, default=32, help="Number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per server")
+    args = parser.parse_args()
+
+    servers = [server.split("=", 1) for server in args.server]
+    results = {}
+    for name, base_url in servers:
+        token = sign_in(base_url, args.email, args.password)
+        # Warm up the caches and connections before measuring
+        benchmark(base_url, token, args.concurrency, min(2, args.duration))
+        results[name] = benchmark(base_url, token, args.concurrency, args.duration)
+
+    columns = list(next(iter(results.values())))
+    print(f"{'server':<10}" + "".join(f"{column:>14}" for column in columns))
+    for name, result in results.items():
+        print(f"{name:<10}" + "".join(f"{result[column]:>14.1f}" for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+End-to-end load test of the API.
+
+Creates synthetic users through signup/, then runs concurrent clients that each send a weighted mix of
+every route of application/urls.py for the given duration, and removes the users at the end. For every
+endpoint it reports the throughput, the p50/p95/p99 latency, the error rate and the number of database
+queries per request (from the X-DB-Queries header, see QueryCountMiddleware), and writes the results to
+a JSON file that a later run can be compared against.
+
+The server can be started by the script (--server-command), in which case it gets QUERY_COUNT_HEADER,
+DISABLE_THROTTLING and SECURE_SSL_REDIRECT=false in its environment. Otherwise start it with those
+yourself. Any settings work, e.g. SQLite locally or a Postgres DATABASE_URL.
+
+Usage:
+    python benchmarks/load_test.py --base-url http://127.0.0.1:8010 \\
+        --server-command "gunicorn core.wsgi:application -w 2 --worker-class gthread --threads 4 -b 127.0.0.1:8010" \\
+        --users 50 --concurrency 16 --duration 30 --output results.json [--compare previous.json]
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import random
+import shlex
+import statistics
+import subprocess
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from client import connect, percentile, request
+
+PASSWORD = "Loadtest1!pass"
+PIN = "123456"
+
+
+def session_events(user):
+    """
+    A few brushing sessions of the previous days, as queued by the app while offline
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return {
+        "events": [
+            {"duration": 120, "xp_gained": 5, "client_timestamp": (now - datetime.timedelta(days=day, hours=hour)).isoformat()}
+            for day in (1, 2)
+            for hour in (2, 14)
+        ]
+    }
+
+
+# name: (weight, method, path, token type, body). The token type is the key of the user's token used,
+# the body a dict or a function of the user returning one.
+ROUTES = {
+    "authenticated": (10, "POST", "/application/authenticated/", "access", {}),
+    "isPinSet": (5, "GET", "/application/isPinSet/", "claims", None),
+    "profile": (5, "GET", "/application/profile/", "claims", None),
+    "activities": (8, "POST", "/application/activities/", "access", {"limit": 31}),
+    "activityCalendar": (4, "GET", "/application/activityCalendar/", "access", None),
+    "completeSession": (8, "POST", "/application/completeSession/", "access", {"duration": 120, "xp_gained": 10}),
+    "syncActivities": (2, "POST", "/application/syncActivities/", "access", session_events),
+    "update_brushtime": (3, "POST", "/application/update_brushtime/", "access", {"added_time": 120}),
+    "updateStreak": (2, "POST", "/application/updateStreak/", "access", {}),
+    "updateActivity": (2, "POST", "/application/updateActivity/", "access", {}),
+    "levelUp": (1, "POST", "/application/levelUp/", "access", {"update_level_by": 1}),
+    "updateUserXP": (2, "POST", "/application/updateUserXP/", "access", lambda user: {"current_level_xp": random.randint(0, 100)}),
+    "updateCurrentLevelMaxXP": (1, "POST", "/application/updateCurrentLevelMaxXP/", "access", {"current_level_max_xp": 120}),
+    "miniShop": (1, "POST", "/application/miniShop/", "access", lambda user: {"image_id": random.randint(1, 5)}),
+    "updateCharacterName": (1, "POST", "/application/updateCharacterName/", "access", {"new_name": "Brushy"}),
+    "setPin": (1, "POST", "/application/setPin/", "access", {"parent_pin": PIN}),
+    "checkPin": (2, "POST", "/application/checkPin/", "access", {"parent_pin": PIN}),
+    "reauthenticate": (1, "POST", "/application/reauthenticate/", None, lambda user: {"email": user["email"], "password": PASSWORD}),
+    "token/refresh": (1, "POST", "/application/token/refresh/", None, lambda user: {"refresh": user["refresh"]}),
+    "signin": (1, "POST", "/application/signin/", None, lambda user: {"email": user["email"], "password": PASSWORD}),
+}
+
+
+class Recorder:
+    """
+    Collects the latency, status and query count of every request, per endpoint
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def add(self, name, seconds, status, queries):
+        with self.lock:
+            self.samples[name].append((seconds, status, queries))
+
+    def summary(self, duration):
+        """
+        Returns:
+            dict: Endpoint name mapped to its statistics, plus a "total" entry
+        """
+        endpoints = {name: self.summarise(samples, duration) for name, samples in sorted(self.samples.items())}
+        endpoints["total"] = self.summarise([s for samples in self.samples.values() for s in samples], duration)
+        return endpoints
+
+    @staticmethod
+    def summarise(samples, duration):
+        latencies = sorted(seconds * 1000 for seconds, _, _ in samples)
+        queries = [q for _, _, q in samples if q is not None]
+        statuses = defaultdict(int)
+        for _, status, _ in samples:
+            statuses[str(status)] += 1
+        return {
+            "requests": len(samples),
+            "requests_per_sec": len(samples) / duration,
+            "errors": sum(count for status, count in statuses.items() if not status.startswith(("2", "3"))),
+            "statuses": dict(statuses),
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "mean_ms": statistics.fmean(latencies) if latencies else 0.0,
+            "queries_per_request": statistics.fmean(queries) if queries else None,
+        }
+
+
+def call(connection, recorder, name, method, path, token=None, body=None):
+    """
+    Sends a request, records it under name and returns (status, parsed JSON body or None)
+    """
+    start = time.perf_counter()
+    status, headers, raw = request(connection, method, path, token, body)
+    elapsed = time.perf_counter() - start
+    queries = headers.get("X-DB-Queries")
+    recorder.add(name, elapsed, status, int(queries) if queries is not None else None)
+    try:
+        return status, json.loads(raw) if raw else None
+    except ValueError:
+        return status, None
+
+
+def keep_tokens(user, data):
+    """
+    Stores the tokens returned by signup/, signin/ or token/refresh/ on the user
+    """
+    for key in ("access", "refresh", "claims"):
+        if isinstance(data, dict) and key in data:
+            user[key] = data[key]
+
+
+def create_users(base_url, count, run_id, recorder):
+    """
+    Signs up the synthetic users
+
+    Returns:
+        list: One dict per user, with its email and tokens
+    """
+    connection = connect(base_url)
+    users = []
+    for i in range(count):
+        user = {"email": f"loadtest-{run_id}-{i}@example.com"}
+        body = {
+            "first_name": "Load",
+            "last_name": "Test",
+            "email": user["email"],
+            "password": PASSWORD,
+            "total_brush_time": 0,
+            "current_level": 1,
+            "current_level_xp": 0,
+            "current_level_max_xp": 120,
+            "character_name": "Brushy",
+            "image_id": 1,
+            "current_streak": 0,
+            "max_streak": 0,
+            "total_brushes": 0,
+        }
+        status, data = call(connection, recorder, "signup", "POST", "/application/signup/", None, body)
+        if status != 201:
+            raise SystemExit(f"Signing up {user['email']} failed with HTTP {status}: {data}")
+        keep_tokens(user, data)
+        users.append(user)
+    connection.close()
+    return users
+
+
+def delete_users(base_url, users, recorder):
+    """
+    Signs the synthetic users out and deletes them
+    """
+    connection = connect(base_url)
+    for user in users:
+        call(connection, recorder, "signout", "POST", "/application/signout/", user["access"], {"refresh": user["refresh"]})
+        call(connection, recorder, "delete", "POST", "/application/delete/", user["access"], {})
+    connection.close()
+
+
+def run_client(base_url, users, deadline, recorder, seed):
+    """
+    Sends random requests from the mix, as random users, until the deadline
+    """
+    rng = random.Random(seed)
+    names = list(ROUTES)
+    weights = [ROUTES[name][0] for name in names]
+    connection = connect(base_url)
+    while time.perf_counter() < deadline:
+        user = rng.choice(users)
+        name = rng.choices(names, weights)[0]
+        _, method, path, token_type, body = ROUTES[name]
+        if callable(body):
+            body = body(user)
+        try:
+            status, data = call(connection, recorder, name, method, path, user.get(token_type), body)
+        except (OSError, http.client.HTTPException):
+            recorder.add(name, 0.0, "connection-error", None)
+            connection.close()
+            connection = connect(base_url)
+            continue
+        if status == 200 and name in ("signin", "token/refresh"):
+            keep_tokens(user, data)
+    connection.close()
+
+
+def start_server(command, base_url):
+    """
+    Starts the server with the load testing settings and waits until it accepts requests
+    """
+    env = dict(os.environ, QUERY_COUNT_HEADER="true", DISABLE_THROTTLING="true", SECURE_SSL_REDIRECT="false")
+    server = subprocess.Popen(shlex.split(command), env=env)
+    for _ in range(100):
+        try:
+            connection = connect(base_url)
+            request(connection, "GET", "/application/isPinSet/")
+            connection.close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit(f"The server did not start: {command}")
+
+
+def print_results(endpoints, baseline=None):
+    """
+    Prints one line per endpoint, with the change in p95 latency and queries against the baseline if given
+    """
+    header = f"{'endpoint':<26}{'req':>8}{'req/s':>9}{'err':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+    if baseline:
+        header += f"{'p95 vs base':>13}{'queries vs base':>17}"
+    print(header)
+    for name, result in endpoints.items():
+        queries = result["queries_per_request"]
+        line = (
+            f"{name:<26}{result['requests']:>8}{result['requests_per_sec']:>9.1f}{result['errors']:>6}"
+            f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+            f"{queries if queries is not None else float('nan'):>9.2f}"
+        )
+        base = (baseline or {}).get(name)
+        if base:
+            change = (result["p95_ms"] / base["p95_ms"] - 1) * 100 if base["p95_ms"] else 0.0
+            line += f"{change:>+12.1f}%"
+            if queries is not None and base["queries_per_request"] is not None:
+                line += f"{queries - base['queries_per_request']:>+17.2f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8010", help="Address of the server")
+    parser.add_argument("--server-command", help="Command starting the server, if it is not running yet")
+    parser.add_argument("--users", type=int, default=20, help="Number of synthetic users")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random request mix")
+    parser.add_argument("--output", default="load_test_results.json", help="File the results are written to")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    server = start_server(args.server_command, args.base_url) if args.server_command else None
+    try:
+        recorder = Recorder()
+        run_id = uuid.uuid4().hex[:8]
+        users = create_users(args.base_url, args.users, run_id, recorder)
+
+        deadline = time.perf_counter() + args.duration
+        clients = [
+            threading.Thread(target=run_client, args=(args.base_url, users, deadline, recorder, args.seed + i))
+            for i in range(args.concurrency)
+        ]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        delete_users(args.base_url, users, recorder)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    endpoints = recorder.summary(args.duration)
+    results = {
+        "meta": {
+            "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "base_url": args.base_url,
+            "server_command": args.server_command,
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "seed": args.seed,
+        },
+        "endpoints": endpoints,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["endpoints"]
+    print_results(endpoints, baseline)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,74 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 
 import os
 
+from asgiref.sync import sync_to_async
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Under ASGI the async versions of the API views are served (application/async_views.py)
+os.environ.setdefault('ASYNC_VIEWS', 'true')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from whitenoise.middleware import WhiteNoiseMiddleware  # noqa: E402 (needs the settings)
+
+
+class StaticFiles:
+    """
+    Serves the static files in front of Django, as WhiteNoiseMiddleware does under WSGI. WhiteNoise has
+    no async middleware, and a sync one in the middleware chain would make Django hand every request
+    to a thread and back, so under ASGI it is left out of MIDDLEWARE (see settings.ASYNC_VIEWS) and
+    only used here to find the files and their headers. The files are opened and read in the thread
+    pool, so the event loop never waits for the disk.
+    """
+
+    block_size = 64 * 1024
+
+    def __init__(self, application):
+        self.application = application
+        self.whitenoise = WhiteNoiseMiddleware()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(self.whitenoise.static_prefix):
+            response = await sync_to_async(self.get_response, thread_sensitive=False)(scope)
+            if response is not None:
+                return await self.send_response(response, send)
+        return await self.application(scope, receive, send)
+
+    def get_response(self, scope):
+        """
+        Returns:
+            whitenoise.responders.Response: The response of the static file at the path, None if there is none
+        """
+        whitenoise = self.whitenoise
+        path = scope["path"]
+        static_file = whitenoise.find_file(path) if whitenoise.autorefresh else whitenoise.files.get(path)
+        if static_file is None:
+            return None
+        # WhiteNoise reads the conditional and range headers from a WSGI environ
+        environ = {
+            "HTTP_" + name.decode("latin-1").upper().replace("-", "_"): value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+        return static_file.get_response(scope["method"], environ)
+
+    async def send_response(self, response, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status,
+                "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in response.headers],
+            }
+        )
+        if response.file is None:
+            return await send({"type": "http.response.body"})
+        read = sync_to_async(response.file.read, thread_sensitive=False)
+        try:
+            while block := await read(self.block_size):
+                await send({"type": "http.response.body", "body": block, "more_body": True})
+        finally:
+            await sync_to_async(response.file.close, thread_sensitive=False)()
+        await send({"type": "http.response.body"})
+
+
+application = StaticFiles(django_application)
@@ -15,7 +15,9 @@ from pathlib import Path
 import environ
 import dj_database_url
 import os
+import tempfile
 import sys
+from django.core.exceptions import ImproperlyConfigured
 
 #################
 
@@ -45,8 +47,8 @@ ALLOWED_HOSTS = [
     "127.0.0.1",
     "*",
 ]
-SECURE_SSL_REDIRECT = (
-    not DEBUG
+SECURE_SSL_REDIRECT = env.bool(
+    "SECURE_SSL_REDIRECT", default=not DEBUG
 )  # redirect all non-HTTPS requests to HTTPS, which is important for security on Heroku.
 
 
@@ -69,12 +71,31 @@ INSTALLED_APPS = [
 ]
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
-    )
+        "application.authentication.CachedJWTAuthentication",
+    ),
+    "DEFAULT_THROTTLE_CLASSES": (
+        "application.throttling.UserBucketThrottle",
+        "application.throttling.IPBucketThrottle",
+        "application.throttling.GlobalBucketThrottle",
+    ),
+    # Heroku's router adds the client address to X-Forwarded-For, used by the per IP throttle
+    "NUM_PROXIES": env.int("NUM_PROXIES", default=1),
+}
+# Throttle budgets (application/throttling.py) per view throttle_scope and bucket, as
+# "<requests>/<period>": up to <requests> at once, given back gradually over <period>. None is no limit.
+# DISABLE_THROTTLING is meant for load tests (benchmarks/load_test.py) only
+THROTTLE_BUCKETS = {} if env.bool("DISABLE_THROTTLING", default=False) else {
+    # Password hashing and PIN checks
+    "auth": {"user": "10/min", "ip": "60/min", "global": "1200/min"},
+    # Counter updates, sessions and syncs
+    "write": {"user": "120/min", "ip": "600/min", "global": None},
+    "default": {"user": "600/min", "ip": "1200/min", "global": None},
 }
 
 
 MIDDLEWARE = [
+    "application.middleware.MetricsMiddleware",
+    "application.middleware.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -84,7 +105,27 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "corsheaders.middleware.CorsMiddleware",
+    "application.middleware.QueryCountMiddleware",
 ]
+# Report the database queries of each request in X-DB-Queries/X-DB-Time headers (load testing only)
+QUERY_COUNT_HEADER = env.bool("QUERY_COUNT_HEADER", default=False)
+# Prometheus metrics of every request (application/metrics.py), served at application/metrics/ to
+# scrapers sending METRICS_TOKEN as a bearer token. gunicorn.conf.py aggregates the worker processes.
+METRICS_ENABLED = env.bool("METRICS_ENABLED", default=True)
+METRICS_TOKEN = env("METRICS_TOKEN", default=None)
+# On-demand profiling (application/profiling.py): requests with the X-Profile header from
+# profiling/token/, plus this fraction of all requests, are profiled and saved in PROFILE_DIR
+PROFILE_SAMPLE_RATE = env.float("PROFILE_SAMPLE_RATE", default=0.0)
+PROFILE_DIR = env("PROFILE_DIR", default=os.path.join(tempfile.gettempdir(), "profiles"))
+PROFILE_MAX_FILES = env.int("PROFILE_MAX_FILES", default=200)
+PROFILE_TOKEN_MAX_AGE = env.int("PROFILE_TOKEN_MAX_AGE", default=3600)
+# Background job queue (application/jobs.py, run by the run_jobs command). A failed job is retried after
+# JOB_RETRY_DELAY seconds, doubled after every attempt up to JOB_RETRY_MAX_DELAY, and fails after
+# JOB_MAX_ATTEMPTS attempts. Jobs running for longer than JOB_LOCK_TIMEOUT seconds are queued again.
+JOB_MAX_ATTEMPTS = env.int("JOB_MAX_ATTEMPTS", default=5)
+JOB_RETRY_DELAY = env.float("JOB_RETRY_DELAY", default=10)
+JOB_RETRY_MAX_DELAY = env.float("JOB_RETRY_MAX_DELAY", default=3600)
+JOB_LOCK_TIMEOUT = env.int("JOB_LOCK_TIMEOUT", default=600)
 
 ROOT_URLCONF = "core.urls"
 CORS_ALLOW_ALL_ORIGINS = True  # CHANGE TO FRONTEND DOMAIN
@@ -105,6 +146,13 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "core.wsgi.application"
+ASGI_APPLICATION = "core.asgi.application"
+# Serve the views that have an async version (application/async_views.py) with it. Set by core/asgi.py,
+# the sync views are used under WSGI.
+ASYNC_VIEWS = env.bool("ASYNC_VIEWS", default=False)
+if ASYNC_VIEWS:
+    # WhiteNoise's middleware is sync only, under ASGI core/asgi.py serves the static files instead
+    MIDDLEWARE.remove("whitenoise.middleware.WhiteNoiseMiddleware")
 
 # CHANGE TIME SETTINGS LATER
 SIMPLE_JWT = {
@@ -117,11 +165,43 @@ SIMPLE_JWT = {
 ##############HEROKU
 DATABASES = {
     "default": dj_database_url.config(
-        default=os.environ.get("DATABASE_URL"), conn_max_age=600, ssl_require=True
+        default=os.environ.get("DATABASE_URL"),
+        # Use 0 under ASGI, where every request runs in its own thread with its own connection
+        conn_max_age=env.int("CONN_MAX_AGE", default=600),
+        ssl_require=True,
     )
 }
 
 
+# Cache used for the authenticated users (application.cache). With more than one process it must be
+# shared by all of them, otherwise a process keeps using a user that another one changed or deactivated
+# for up to USER_CACHE_TIMEOUT. A file cache is not shared between dynos, so on Heroku (where DYNO is set)
+# CACHE_URL must point to Redis or Memcached, e.g. redis://host:6379/0. Without CACHE_URL, e.g. in
+# development, each process has its own local memory cache.
+CACHES = {"default": env.cache_url("CACHE_URL", default="locmemcache://")}
+SHARED_CACHE_BACKENDS = (
+    "django.core.cache.backends.redis.RedisCache",
+    "django.core.cache.backends.memcached.PyMemcacheCache",
+    "django.core.cache.backends.memcached.PyLibMCCache",
+)
+if "DYNO" in os.environ and CACHES["default"]["BACKEND"] not in SHARED_CACHE_BACKENDS:
+    raise ImproperlyConfigured("Set CACHE_URL to a Redis or Memcached cache shared by all the dynos")
+# Cache holding the throttle counts, which must increment atomically: the Redis or Memcached cache of
+# CACHE_URL, shared by all the workers, or else a local memory cache per process (so each process has
+# the whole budget)
+if CACHES["default"]["BACKEND"] in SHARED_CACHE_BACKENDS:
+    THROTTLE_CACHE = "default"
+else:
+    CACHES["throttle"] = {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "throttle",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+    THROTTLE_CACHE = "throttle"
+# Seconds a cached user is kept
+USER_CACHE_TIMEOUT = env.int("USER_CACHE_TIMEOUT", default=300)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -163,6 +243,45 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing. New and upgraded hashes use PASSWORD_HASHER ("scrypt" or "argon2", the latter needs
+# argon2-cffi), the other hashers are only kept to verify existing hashes, which are rehashed on sign in.
+# The cost parameters come from the environment, run "manage.py calibrate_hasher" to choose them.
+PASSWORD_HASHER = env("PASSWORD_HASHER", default="scrypt")
+_PASSWORD_HASHERS = {
+    "scrypt": "application.hashers.CalibratedScryptPasswordHasher",
+    "argon2": "application.hashers.CalibratedArgon2PasswordHasher",
+}
+PASSWORD_HASHERS = [
+    _PASSWORD_HASHERS[PASSWORD_HASHER],
+    *(hasher for name, hasher in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER),
+    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+]
+PASSWORD_HASH_PARAMS = {
+    "scrypt": {
+        "work_factor": env.int("SCRYPT_WORK_FACTOR", default=2**14),
+        "block_size": env.int("SCRYPT_BLOCK_SIZE", default=8),
+        "parallelism": env.int("SCRYPT_PARALLELISM", default=1),
+    },
+    "argon2": {
+        "time_cost": env.int("ARGON2_TIME_COST", default=2),
+        "memory_cost": env.int("ARGON2_MEMORY_COST", default=102400),
+        "parallelism": env.int("ARGON2_PARALLELISM", default=8),
+    },
+}
+# Time one password hash may take, in milliseconds, used by calibrate_hasher
+PASSWORD_HASH_BUDGET_MS = env.int("PASSWORD_HASH_BUDGET_MS", default=100)
+# Processes hashing passwords for each web worker (application.hashing), 0 hashes in the request thread.
+# By default the cores are shared between the WEB_CONCURRENCY web workers.
+PASSWORD_HASH_WORKERS = env.int(
+    "PASSWORD_HASH_WORKERS",
+    default=max(1, (os.cpu_count() or 1) // env.int("WEB_CONCURRENCY", default=1)),
+)
+# Passwords hashed or waiting at the same time in a web worker before new ones are refused with a 503
+PASSWORD_HASH_QUEUE_LIMIT = env.int(
+    "PASSWORD_HASH_QUEUE_LIMIT", default=2 * max(PASSWORD_HASH_WORKERS, 1)
+)
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
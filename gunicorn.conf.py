@@ -0,0 +1,61 @@
+"""
+Gunicorn settings of the web process of the Procfile (gunicorn reads this file from the working
+directory).
+
+SERVER_INTERFACE picks how the application is served:
+-wsgi (default): core.wsgi with gthread workers, GUNICORN_THREADS threads each
+-asgi: core.asgi with uvicorn workers, so the async views are used (application/async_views.py).
+Database connections are not kept between requests (CONN_MAX_AGE=0), since every request of an async
+view runs its queries in a new thread with its own connection
+
+The worker processes write their request metrics (application/metrics.py) to files in
+PROMETHEUS_MULTIPROC_DIR, so that the metrics endpoint of any worker reports all of them. The directory
+is emptied when gunicorn starts, and the files of a worker that exits are merged so its counts are kept.
+
+With MEMORY_TRACING set (to the number of frames kept, e.g. 10), every worker traces its memory
+allocations from the time it has loaded the application, see application/memory.py.
+"""
+
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "prometheus_metrics"))
+
+if os.environ.get("SERVER_INTERFACE", "wsgi") == "asgi":
+    wsgi_app = "core.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+    os.environ.setdefault("CONN_MAX_AGE", "0")
+else:
+    wsgi_app = "core.wsgi:application"
+    worker_class = "gthread"
+    threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+
+def on_starting(server):
+    """
+    Drops the metrics of a previous run of the server
+    """
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    """
+    Marks the metrics of a worker that exited as dead
+    """
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    """
+    Starts tracing the memory allocations of the worker if MEMORY_TRACING is set
+    """
+    frames = int(os.environ.get("MEMORY_TRACING") or 0)
+    if frames:
+        from application.memory import start_tracing
+
+        start_tracing(frames)